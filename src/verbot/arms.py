@@ -0,0 +1,85 @@
+from verbot.shared import State
+from verbot.utils import tickDiff
+
+# Weight given to each new full-travel measurement in the running average
+ARM_TRAVEL_SMOOTHING = 0.5
+
+# Moves shorter than this (as a fraction of full travel) aren't worth making
+MIN_ARM_MOVE = 0.02
+
+# Direction of travel of each arm action. Position is 0.0 (fully down) to 1.0 (fully up)
+ARM_DIRECTIONS = {
+    State.PICK_UP   : 1,
+    State.PUT_DOWN  : -1,
+}
+
+class ArmModel():
+    """
+    Estimate of Verbot's arm position, learnt from the timing of PICK_UP/PUT_DOWN actions.
+
+    The arms have limit switches at either end of their travel, in series with the
+    action switches. Reaching a limit fixes the position exactly, and a move between
+    known positions measures the time for full travel in that direction. In between,
+    the position is integrated from the time each arm action was performed.
+    """
+
+    def __init__(self):
+        """c'tor"""
+        self._position = None   # 0.0 - 1.0, or None if unknown
+        self._travel_us = {}    # State to full travel time (us)
+
+    @property
+    def position(self):
+        """Returns the arm position, 0.0 (down) to 1.0 (up), or None if unknown"""
+        return self._position
+
+    def travel_us(self, state: State):
+        """Returns the measured full travel time (us) for an arm action, or None if not yet measured"""
+        return self._travel_us.get(state)
+
+    def on_action(self, state: State, start_tick, end_tick, limit_tick=None):
+        """
+        Integrate an arm action performed from start_tick until end_tick,
+        or until limit_tick if its limit switch was reached
+        """
+        direction = ARM_DIRECTIONS.get(state)
+        if direction is None:
+            return
+        limit = 1.0 if direction > 0 else 0.0
+        if limit_tick is not None:
+            if self._position is not None and abs(limit - self._position) > 0.5:
+                # Measure full travel from the distance covered
+                travel_us = tickDiff(start_tick, limit_tick) / abs(limit - self._position)
+                old = self._travel_us.get(state)
+                self._travel_us[state] = travel_us if old is None else old + ARM_TRAVEL_SMOOTHING * (travel_us - old)
+            self._position = limit
+            return
+        travel_us = self._travel_us.get(state)
+        if self._position is None or travel_us is None:
+            self._position = None
+            return
+        moved = tickDiff(start_tick, end_tick) / travel_us
+        self._position = min(1.0, max(0.0, self._position + direction * moved))
+
+    def move_to(self, position):
+        """
+        Returns (state, secs) of the timed arm action to move to position (0.0 - 1.0),
+        or None if the arms are already there.
+        Raises ValueError if the position or travel time is unknown
+        """
+        if self._position is None:
+            raise ValueError("Arm position is unknown - move the arms fully up or down first")
+        distance = position - self._position
+        if abs(distance) < MIN_ARM_MOVE:
+            return None
+        state = State.PICK_UP if distance > 0 else State.PUT_DOWN
+        travel_us = self._travel_us.get(state)
+        if travel_us is None:
+            raise ValueError("Arm travel time is unknown - move the arms fully up and down first")
+        return state, abs(distance) * travel_us / 1000000
+
+    def as_dict(self):
+        return {
+            "position_percent"  : None if self._position is None else 100 * self._position,
+            "travel_secs"       : {state.name.lower() : us / 1000000 for state, us in self._travel_us.items()},
+        }
@@ -9,8 +9,11 @@ from aiy.assistant.library import Assistant
 from aiy.board import Board, Led
 
 from verbot.assistant_commands import COMMANDS
+from verbot.sequence import RunSequence
 from verbot.shared import State
 
+logger = logging.getLogger(__name__)
+
 class VerbotAssistant():
     """
     Google Voice Assistant for Verbot
@@ -18,17 +21,29 @@ class VerbotAssistant():
     def __init__(self, pi:apigpio.Pi):
         self._the_pi = pi
         self._callback = None
+        self._event_callback = None
         self._task = threading.Thread(target=self._run_task, daemon=True)
         self._can_start_conversation = False
         self._conversation_in_progress = False
         self._assistant = None
+        self._credentials = None
         self._board = Board()
 
-    def start(self, callback=None):
+    def load_credentials(self):
+        """
+        Load the assistant's credentials. Blocking, so may be called from a worker thread before start()
+        """
+        self._credentials = auth_helpers.get_assistant_credentials()
+
+    def start(self, callback=None, event_callback=None):
         """
         Starts the assistant event loop and begins processing events.
+        callback - called with the State (or RunSequence) for each recognized voice command
+        event_callback - called with the name and args of every assistant event
+        Callbacks are called on the assistant's thread
         """
         self._callback = callback
+        self._event_callback = event_callback
         self._task.start()
 
     def stop(self):
@@ -42,19 +57,22 @@ class VerbotAssistant():
             self._assistant.stop_conversation()
         
     def _run_task(self):
-        credentials = auth_helpers.get_assistant_credentials()
-        with Assistant(credentials) as assistant:
+        if self._credentials is None:
+            self.load_credentials()
+        with Assistant(self._credentials) as assistant:
             self._assistant = assistant
             for event in assistant.start():
                 self._process_event(event)
 
     def _process_event(self, event):
-        logging.info(event)
+        logger.debug("Assistant event %s", event)
+        if callable(self._event_callback):
+            self._event_callback(event.type.name, event.args)
         if event.type == EventType.ON_START_FINISHED:
             self._update_led(Led.ON, 0.1)
             self._can_start_conversation = True
             # Start the voicehat button trigger.
-            logging.info('Assistant ready')
+            logger.info('Assistant ready')
 
         elif event.type == EventType.ON_CONVERSATION_TURN_STARTED:
             self._conversation_in_progress = True
@@ -65,7 +83,7 @@ class VerbotAssistant():
             self._update_led(Led.PULSE_SLOW, 0.1)
 
         elif event.type == EventType.ON_RECOGNIZING_SPEECH_FINISHED and event.args:
-            print('You said:', event.args['text'])
+            logger.info('You said: %s', event.args['text'])
             text = event.args['text'].lower()
             self._on_recognized_speech(text)
 
@@ -84,7 +102,7 @@ class VerbotAssistant():
         if callable(action):
             self._assistant.stop_conversation()
             action()
-        elif isinstance(action, State) and callable(self._callback):
+        elif isinstance(action, (State, RunSequence)) and callable(self._callback):
             self._assistant.stop_conversation()
             self._callback(action)
 
@@ -2,6 +2,7 @@ import subprocess
 from aiy.voice import tts
 
 from verbot.shared import State
+from verbot.sequence import RunSequence
 
 def power_off_pi():
     tts.say('Night night')
@@ -26,6 +27,8 @@ COMMANDS = {
     "turn right"    : State.ROTATE_RIGHT,
     "pick up"       : State.PICK_UP,
     "put down"      : State.PUT_DOWN,
+    "wave"          : RunSequence("wave"),
+    "dance"         : RunSequence("dance"),
     "power off"     : power_off_pi,
     "shut down"     : power_off_pi,
     "reboot"        : reboot_pi,
@@ -0,0 +1,87 @@
+import json
+import os
+from verbot.shared import State
+
+# Per-robot calibration is kept outside the source tree, as every Verbot's gearbox & batteries differ
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.expanduser("~"), ".config", "verbot", "calibration.json")
+
+# Units of the calibrated rates
+DEGREES_PER_SEC = "degrees_per_sec"
+MM_PER_SEC      = "mm_per_sec"
+
+# Rough figures for a Verbot on fresh batteries, used until the robot has been calibrated
+DEFAULT_RATES = {
+    State.ROTATE_LEFT   : {DEGREES_PER_SEC : 45.0},
+    State.ROTATE_RIGHT  : {DEGREES_PER_SEC : 45.0},
+    State.FORWARDS      : {MM_PER_SEC : 60.0},
+    State.REVERSE       : {MM_PER_SEC : 60.0},
+}
+
+class Calibration():
+    """
+    Per-robot table of motion rates, used to turn distances & angles into action durations and back.
+
+    Stored as JSON keyed by action name, e.g.
+    {"rotate_left": {"degrees_per_sec": 48.5}, "forwards": {"mm_per_sec": 64.0}}
+    """
+
+    def __init__(self, rates=None):
+        """
+        c'tor
+        rates - dict of State to dict of unit to rate. Defaults are used for any not given
+        """
+        self._rates = {state : dict(state_rates) for state, state_rates in DEFAULT_RATES.items()}
+        for state, state_rates in (rates or {}).items():
+            self.set_rate(state, **state_rates)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CALIBRATION_PATH):
+        """
+        Load a calibration table. Returns the default calibration if the file doesn't exist.
+        Raises ValueError if the file is invalid
+        """
+        try:
+            with open(path) as f:
+                table = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        try:
+            return cls(rates={State[name.upper()] : rates for name, rates in table.items()})
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError("Invalid calibration file {0}: {1}".format(path, e))
+
+    def save(self, path=DEFAULT_CALIBRATION_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def as_dict(self):
+        return {state.name.lower() : dict(state_rates) for state, state_rates in self._rates.items()}
+
+    def set_rate(self, state: State, degrees_per_sec=None, mm_per_sec=None):
+        """Set the rate(s) of motion for an action. Raises ValueError for rates that aren't positive"""
+        for unit, rate in ((DEGREES_PER_SEC, degrees_per_sec), (MM_PER_SEC, mm_per_sec)):
+            if rate is None:
+                continue
+            rate = float(rate)
+            if rate <= 0:
+                raise ValueError("{0} for {1} must be positive".format(unit, state.name.lower()))
+            self._rates.setdefault(state, {})[unit] = rate
+
+    def degrees_per_sec(self, state: State):
+        """Returns the rate of rotation for an action, or None if it doesn't rotate the robot"""
+        return self._rates.get(state, {}).get(DEGREES_PER_SEC)
+
+    def mm_per_sec(self, state: State):
+        """Returns the rate of travel for an action, or None if it doesn't move the robot along"""
+        return self._rates.get(state, {}).get(MM_PER_SEC)
+
+    def secs_for_degrees(self, state: State, degrees):
+        """
+        Returns how long to perform an action to turn through an angle.
+        Raises ValueError if the action isn't calibrated for rotation
+        """
+        rate = self.degrees_per_sec(state)
+        if not rate:
+            raise ValueError("{0} is not calibrated for rotation".format(state.name.lower()))
+        return abs(degrees) / rate
@@ -0,0 +1,368 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import aiohttp
+from zeroconf import ServiceBrowser, Zeroconf
+from verbot.shared import CLIENT_HEADER, SERVICE_TYPE
+from verbot.timesync import ClockEstimate
+
+logger = logging.getLogger(__name__)
+
+# Discovered robots are remembered (in memory and on disk) for this long (secs) before browsing again
+DEFAULT_DISCOVERY_TTL = 300.0
+DEFAULT_DISCOVERY_CACHE_PATH = os.path.expanduser("~/.cache/verbot/discovery.json")
+# How long to browse for robots (secs). Browsing stops as soon as the wanted robot is found
+DEFAULT_DISCOVERY_TIMEOUT = 3.0
+
+# Keep-alive connections kept open to each robot, e.g. for concurrent (pipelined) requests
+DEFAULT_CONNECTIONS = 4
+DEFAULT_KEEPALIVE_SECS = 60.0
+DEFAULT_REQUEST_TIMEOUT = 30.0
+
+class VerbotError(Exception):
+    """A JSON-RPC error response from the control server"""
+
+    def __init__(self, code, message, data=None):
+        """c'tor"""
+        super().__init__("{0} (code {1})".format(message, code))
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class DiscoveryCache():
+    """
+    Robots found by zeroconf discovery, cached in memory and in a file so that
+    short lived scripts don't pay for an mDNS lookup every time they run
+    """
+
+    def __init__(self, ttl=DEFAULT_DISCOVERY_TTL, path=DEFAULT_DISCOVERY_CACHE_PATH):
+        """c'tor - path may be None to cache in memory only"""
+        self._ttl = ttl
+        self._path = path
+        self._robots = None
+        self._expires_at = 0.0  # Wall clock time, as it is shared between processes
+
+    def get(self):
+        """Returns the cached list of robots, or None if nothing is cached or the cache has expired"""
+        if self._robots is None and self._path is not None:
+            try:
+                with open(self._path) as f:
+                    cached = json.load(f)
+                self._robots, self._expires_at = cached["robots"], cached["expires_at"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if self._robots is None or time.time() >= self._expires_at:
+            return None
+        return self._robots
+
+    def put(self, robots):
+        self._robots = robots
+        self._expires_at = time.time() + self._ttl
+        if self._path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path, "w") as f:
+                json.dump({"robots" : robots, "expires_at" : self._expires_at}, f)
+        except OSError:
+            logger.warning("Couldn't write discovery cache %s", self._path, exc_info=True)
+
+    def invalidate(self):
+        """Forget the cached robots, e.g. when one can't be reached"""
+        self._robots = None
+        self._expires_at = 0.0
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+# Shared by all clients in the process
+_default_cache = DiscoveryCache()
+
+def _browse(name=None, timeout=DEFAULT_DISCOVERY_TIMEOUT):
+    """
+    Browse for robots with zeroconf, returning a list of dicts of name, host, port, teleop_port & url.
+    Blocking - returns as soon as a robot named name (or any robot, if None) is found, else after timeout
+    """
+    found = threading.Event()
+    names = set()
+    class Listener():
+        def add_service(self, zeroconf, type_, service_name):
+            names.add(service_name)
+            if name is None or service_name.startswith(name + "."):
+                found.set()
+        def update_service(self, zeroconf, type_, service_name):
+            pass
+        def remove_service(self, zeroconf, type_, service_name):
+            pass
+    zeroconf = Zeroconf()
+    try:
+        browser = ServiceBrowser(zeroconf, SERVICE_TYPE, Listener())
+        found.wait(timeout)
+        browser.cancel()
+        robots = []
+        for service_name in sorted(names):
+            info = zeroconf.get_service_info(SERVICE_TYPE, service_name, 1000)
+            if info is None:
+                continue
+            addresses = info.parsed_addresses()
+            host = addresses[0] if addresses else info.server.rstrip(".")
+            teleop_port = info.properties.get(b"teleop_port")
+            robots.append({
+                "name"          : service_name[:-len(SERVICE_TYPE) - 1],
+                "host"          : host,
+                "port"          : info.port,
+                "teleop_port"   : int(teleop_port) if teleop_port else None,
+                "url"           : "http://{0}:{1}/".format(host, info.port),
+            })
+        return robots
+    finally:
+        zeroconf.close()
+
+async def discover(name=None, timeout=DEFAULT_DISCOVERY_TIMEOUT, cache=None, refresh=False):
+    """
+    Returns a list of robots (see _browse()) advertised by zeroconf, from the cache if it is still fresh.
+    name - stop browsing as soon as this robot is found
+    refresh - True to browse even if the cache is fresh
+    """
+    cache = cache or _default_cache
+    robots = None if refresh else cache.get()
+    if robots is None or (name is not None and not any(robot["name"] == name for robot in robots)):
+        started_at = time.perf_counter()
+        robots = await asyncio.get_running_loop().run_in_executor(None, _browse, name, timeout)
+        logger.info("Discovered %s robot(s) in %.3f secs", len(robots), time.perf_counter() - started_at)
+        if robots:
+            cache.put(robots)
+    return robots
+
+
+class VerbotClient():
+    """
+    asyncio client for the control server's JSON-RPC API.
+
+    Requests are sent over a pool of keep-alive connections, so a script pays for TCP setup
+    (and, with discover(), for the mDNS lookup) once rather than on every move.
+    Independent requests can be pipelined over the pool with pipeline(), or sent in a single
+    round trip with batch()
+    """
+
+    def __init__(self, url, client_id=None, connections=DEFAULT_CONNECTIONS, timeout=DEFAULT_REQUEST_TIMEOUT, cache=None):
+        """
+        c'tor
+        url - of the control server, e.g. http://verbot.local:8080/
+        client_id - identifies this client for control leases. A unique id by default
+        cache - the DiscoveryCache the url came from, invalidated if the server can't be reached
+        """
+        self.url = url
+        self.client_id = client_id or "verbot-client-{0}".format(uuid.uuid4().hex[:8])
+        self._connections = connections
+        self._timeout = timeout
+        self._cache = cache
+        self._session = None
+        self._ids = itertools.count(1)
+        self.clock = ClockEstimate()    # The robot's clock relative to this loop's, see sync_clock()
+
+    @classmethod
+    async def discover(cls, name=None, cache=None, timeout=DEFAULT_DISCOVERY_TIMEOUT, **kwargs):
+        """
+        Returns a client for the robot named name (or the first robot found) by zeroconf discovery.
+        Raises LookupError if there is no such robot
+        """
+        cache = cache or _default_cache
+        robots = await discover(name, timeout, cache)
+        for robot in robots:
+            if name is None or robot["name"] == name:
+                return cls(robot["url"], cache=cache, **kwargs)
+        raise LookupError("No Verbot found" if name is None else "Verbot {0} not found".format(name))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def call(self, method, **params):
+        """Call a JSON-RPC method, returning its result. Raises VerbotError for an error response"""
+        response = await self._post({"jsonrpc" : "2.0", "method" : method, "params" : params, "id" : next(self._ids)})
+        return _result(response)
+
+    async def pipeline(self, calls):
+        """
+        Send (method, params dict) calls concurrently over the connection pool, without waiting for each response
+        before sending the next. Returns their results in order, with a VerbotError in place of each failed call.
+        The server may act on them in any order - use batch() with mode="sequence" where order matters
+        """
+        return await asyncio.gather(*(self.call(method, **params) for method, params in calls), return_exceptions=True)
+
+    async def batch(self, calls, mode=None):
+        """
+        Send (method, params dict) calls in a single request.
+        mode None - a standard JSON-RPC batch. Returns results in order, with a VerbotError in place of each failed call
+        mode "sequence" or "coalesce" - see server.BATCH_MODES. Returns the server's report, a dict of
+            results (as above), steps (per-step timing) and total_ms
+        """
+        requests = [
+            {"jsonrpc" : "2.0", "method" : method, "params" : params, "id" : next(self._ids)}
+            for method, params in calls
+        ]
+        report = await self._post(requests, params=None if mode is None else {"batch" : mode})
+        if isinstance(report, dict) and "error" in report:
+            _result(report)
+        responses = {response["id"] : response for response in (report if mode is None else report["responses"])}
+        results = [_result(responses[request["id"]], raise_error=False) for request in requests]
+        if mode is None:
+            return results
+        report["results"] = results
+        del report["responses"]
+        return report
+
+    async def action(self, action, duration=None, degrees=None):
+        params = {"action" : action}
+        if duration is not None:
+            params["duration"] = duration
+        if degrees is not None:
+            params["degrees"] = degrees
+        return await self.call("verbot_action", **params)
+
+    async def action_wait(self, action, timeout=10.0, duration=None, degrees=None, until_end=False):
+        return await self.call("verbot_action_wait", action=action, timeout=timeout, duration=duration, degrees=degrees,
+            until_end=until_end)
+
+    async def stop(self):
+        return await self.call("verbot_stop")
+
+    async def sync_clock(self, samples=8):
+        """Exchange timestamps with the robot to refine the estimate of its clock (self.clock). Returns the estimate"""
+        loop = asyncio.get_running_loop()
+        for _ in range(samples):
+            sent_at = loop.time()
+            times = await self.call("verbot_time")
+            self.clock.add(sent_at, times["received"], times["sent"], loop.time(), times["tick"], times["tick_at"])
+        return self.clock.as_dict()
+
+    async def action_at(self, action, at, duration=None, degrees=None):
+        """
+        Request an action at time at of this loop's clock (loop.time()), converted to the robot's clock.
+        Call sync_clock() first
+        """
+        if not self.clock.samples:
+            raise RuntimeError("The robot's clock hasn't been synchronised - call sync_clock() first")
+        params = {"action" : action, "at" : self.clock.to_remote(at)}
+        if duration is not None:
+            params["duration"] = duration
+        if degrees is not None:
+            params["degrees"] = degrees
+        return await self.call("verbot_action_at", **params)
+
+    async def stats(self):
+        return await self.call("verbot_stats")
+
+    async def _post(self, request, params=None):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self._connections, keepalive_timeout=DEFAULT_KEEPALIVE_SECS),
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+                headers={CLIENT_HEADER : self.client_id},
+            )
+        try:
+            async with self._session.post(self.url, json=request, params=params) as response:
+                return await response.json(content_type=None)
+        except aiohttp.ClientConnectionError:
+            if self._cache is not None:
+                # The robot may have moved - discover it afresh next time
+                self._cache.invalidate()
+            raise
+
+
+def _result(response, raise_error=True):
+    error = response.get("error")
+    if error is None:
+        return response.get("result")
+    error = VerbotError(error.get("code"), error.get("message"), error.get("data"))
+    if raise_error:
+        raise error
+    return error
+
+
+def _close_loop(loop):
+    """
+    Close a private event loop, first joining its default executor's threads.
+    Before Python 3.9 loops can't wait for them, so they are left to finish by themselves
+    """
+    if hasattr(loop, "shutdown_default_executor"):
+        loop.run_until_complete(loop.shutdown_default_executor())
+    loop.close()
+
+
+class SyncVerbotClient():
+    """
+    Blocking wrapper of VerbotClient for scripts that don't use asyncio.
+    Runs a private event loop, so connections are still kept alive between calls
+    """
+
+    def __init__(self, url, **kwargs):
+        """c'tor - see VerbotClient"""
+        self._loop = asyncio.new_event_loop()
+        self._client = VerbotClient(url, **kwargs)
+
+    @classmethod
+    def discover(cls, name=None, cache=None, timeout=DEFAULT_DISCOVERY_TIMEOUT, **kwargs):
+        """See VerbotClient.discover()"""
+        cache = cache or _default_cache
+        loop = asyncio.new_event_loop()
+        try:
+            # The async client's session is only created on first use, so needn't be closed
+            url = loop.run_until_complete(VerbotClient.discover(name, cache, timeout)).url
+        finally:
+            # Browsing ran on the loop's default executor
+            _close_loop(loop)
+        return cls(url, cache=cache, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def url(self):
+        return self._client.url
+
+    def close(self):
+        if not self._loop.is_closed():
+            self._loop.run_until_complete(self._client.close())
+            _close_loop(self._loop)
+
+    def call(self, method, **params):
+        return self._loop.run_until_complete(self._client.call(method, **params))
+
+    def pipeline(self, calls):
+        return self._loop.run_until_complete(self._client.pipeline(calls))
+
+    def batch(self, calls, mode=None):
+        return self._loop.run_until_complete(self._client.batch(calls, mode))
+
+    def action(self, action, duration=None, degrees=None):
+        return self._loop.run_until_complete(self._client.action(action, duration, degrees))
+
+    def action_wait(self, action, timeout=10.0, duration=None, degrees=None, until_end=False):
+        return self._loop.run_until_complete(self._client.action_wait(action, timeout, duration, degrees, until_end))
+
+    def stop(self):
+        return self._loop.run_until_complete(self._client.stop())
+
+    def stats(self):
+        return self._loop.run_until_complete(self._client.stats())
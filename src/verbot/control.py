@@ -1,9 +1,18 @@
 import asyncio
-import itertools
+import logging
+import time
 import apigpio
 import verbot.drv_8835_driver as drv8835
 from verbot.shared import State
-from verbot.assistant import VerbotAssistant
+from verbot.arms import ArmModel
+from verbot.calibration import Calibration, DEFAULT_CALIBRATION_PATH
+from verbot.drum import DrumModel
+from verbot.odometry import Odometry
+from verbot.pipeline import ActionPipeline
+from verbot.planner import MotionPlanner, Plan
+from verbot.sequence import CompiledSequence, RunSequence, SequenceLibrary, SequenceRun, SequenceRunner
+from verbot.trace import EdgeTrace
+from verbot.utils import runScript
 
 GPIO_ACTIONS = {
     22  : State.STOP,           # Purple
@@ -17,48 +26,191 @@ GPIO_ACTIONS = {
     16  : State.ASSISTANT       # Voice assistant
 }
 
-MOTOR_SPEED_FOR_INTERROGATION   = 50
+# Switch contacts bounce, so edges are only reported once a level has been steady for this long
+GLITCH_FILTER_US = 25000
+
+# Interrogation order of the action switches on the drum
+DRUM_ORDER = tuple(state for state in GPIO_ACTIONS.values() if state != State.ASSISTANT)
+
+logger = logging.getLogger(__name__)
+edge_logger = logging.getLogger(__name__ + ".edges")
+
+MOTOR_SPEED_FOR_INTERROGATION   = 50    # Used on approach to the target switch, or when the drum position is unknown
+MOTOR_SPEED_FOR_INTERROGATION_FAST = 100
 MOTOR_SPEED_FOR_ACTIONS         = -100
 MOTOR_SPEED_STOPPED             = 0
 
+# Interrogation slows to approach speed once the predicted time to the target switch at full speed falls below this
+INTERROGATION_APPROACH_US       = 250000
+
+class RequestSuperseded(Exception):
+    """A request was overtaken by a request for another state before it was reached"""
+
+
+class _PendingRequest():
+    """An awaited request, see Controller.request()"""
+
+    def __init__(self, state: State, future, until_end):
+        """c'tor"""
+        self.state = state
+        self.future = future
+        self.until_end = until_end
+        self.begun = False
+        self.requested_at = time.perf_counter()
+        self.timer = None
+
+
 class Controller():
     """
     GPIO controller for Verbot
     """
 
-    def __init__(self, host="127.0.0.1", port="8888"):
-        """c'tor"""
+    def __init__(self, host="127.0.0.1", port="8888", pi=None, assistant=True, pwm_mode=drv8835.PWM_MODE_SOFTWARE,
+                 calibration_path=DEFAULT_CALIBRATION_PATH):
+        """
+        c'tor
+        pi - an apigpio.Pi (or stand-in such as verbot.sim.SimulatedPi). A new apigpio.Pi is created if None
+        assistant - False to run without the Google voice assistant
+        pwm_mode - drv_8835_driver.PWM_MODE_SOFTWARE or PWM_MODE_HARDWARE for the motor PWM
+        calibration_path - this robot's calibration table, used for angle based actions
+        """
         self._address = (host, port)
-        self._the_pi = apigpio.Pi()
-        self._motor = drv8835.Motor(self._the_pi)
-        self._assistant = VerbotAssistant(self._the_pi)
+        self._the_pi = pi or apigpio.Pi()
+        self._motor = drv8835.Motor(self._the_pi, pwm_mode=pwm_mode)
+        self._assistant = None
+        if assistant:
+            # Imported here as the Google assistant library is only available on the Pi
+            from verbot.assistant import VerbotAssistant
+            self._assistant = VerbotAssistant(self._the_pi)
+        self._calibration_path = calibration_path
+        self._calibration = Calibration()
         self._current_state = State.STOP
         self._desired_state = State.STOP
+        self._desired_secs = None   # Duration of the desired action, or None to continue until the next request
+        self._timed_action = None
+        self._action_started = None # (state, tick) of the action being performed
+        self._action_listeners = []
+        self._state_listeners = []
+        self._pending_requests = []
+        self._edge_listeners = []
+        self._assistant_listeners = []
+        self._stop_listeners = []
+        self._last_requested = State.STOP
+        self._odometry = Odometry(self._calibration)
+        self.add_action_listener(self._odometry.on_action)
+        self._arms = ArmModel()
+        self._limit = None  # (state, tick) of the limit switch reached during the action being performed
+        self.add_action_listener(self._on_arm_action)
+        self.add_action_listener(self._on_request_action_end)
+        self._planner = MotionPlanner(DRUM_ORDER, self._calibration, MOTOR_SPEED_FOR_INTERROGATION_FAST, MOTOR_SPEED_FOR_INTERROGATION)
+        self._sequences = SequenceLibrary(self._calibration)
+        self._sequence_runner = SequenceRunner(self)
+        self._drum = DrumModel(DRUM_ORDER)
+        self._motor_speed = None
+        self._actions = ActionPipeline(self._execute_desired_state, self._is_desired_state)
+        self._interrogation_started_at = None
+        self._targeted_at = None    # When interrogation began, or was last retargeted
+        self._edge_trace = EdgeTrace()
 
     async def init_io(self):
+        """
+        Connect to pigpiod and configure the GPIO pins, loading the assistant's credentials concurrently
+        """
         self._loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        init_coros = [self._init_gpio(), self._load_calibration()]
+        if self._assistant is not None:
+            # Credential loading is blocking file I/O, so is run on a worker thread
+            init_coros.append(self._loop.run_in_executor(None, self._assistant.load_credentials))
+        await asyncio.gather(*init_coros)
+        await self._discover_drum_position()
+        self._actions.start()
+        if self._assistant is not None:
+            logger.info("GPIO pins configured - Starting assistant ...")
+            self._assistant.start(callback=self._on_assistant_action, event_callback=self._on_assistant_event)
+        logger.info("Controller ready in %.3f secs", time.perf_counter() - started_at)
+
+    async def _init_gpio(self):
         # Connect to pigpiod
-        print("Connecting to pigpiod on {0}:{1} ...".format(self._address[0], self._address[1]))
+        logger.info("Connecting to pigpiod on %s:%s ...", self._address[0], self._address[1])
         await self._the_pi.connect(self._address)
-        print("Connected to pigpiod - Configuring GPIO pins ...")
-        # Set all GPIO pins for actions to input and pull up, and register callbacks for edge events
-        init_coros = list(itertools.chain.from_iterable(
-            (
+        logger.info("Connected to pigpiod - Configuring GPIO pins ...")
+        await asyncio.gather(
+            # Set all GPIO pins for actions to input and pull up, with a glitch filter
+            self._configure_input_pins(),
+            # Register callbacks for edge events. These go via pigpiod's notification socket
+            *(self._the_pi.add_callback(pin, apigpio.EITHER_EDGE, self._on_gpio_edge_event) for pin in GPIO_ACTIONS),
+            # Initialize the motor driver GPIO output pins
+            self._motor.init_io()
+        )
+
+    async def _discover_drum_position(self):
+        '''
+        Find where the drum was left (e.g. before a restart or power cycle) with a single bank read of all the action switches.
+        The motor is stopped, so current state is STOP, but if the drum is parked at another action's switch
+        a request for that action can begin without any interrogation.
+        If no switch is closed the drum is between switches, so a calibration sweep interrogates to the STOP switch,
+        measuring the drum timing on the way
+        '''
+        levels = await self._the_pi.read_bank_1()
+        closed = [state for pin, state in GPIO_ACTIONS.items() if state in DRUM_ORDER and not levels & (1 << pin)]
+        self._set_current_state(State.STOP)
+        self._desired_state = State.STOP
+        if len(closed) == 1:
+            logger.info("Drum is parked at the %s switch", closed[0])
+            self._drum.park(closed[0])
+        else:
+            logger.info("Drum position unknown (closed switches: %s) - calibrating", closed)
+            self._drum.forget()
+            await self._start_action_interrogation()
+
+    async def _load_calibration(self):
+        if self._calibration_path is None:
+            return
+        try:
+            self._calibration = await self._loop.run_in_executor(None, Calibration.load, self._calibration_path)
+            self._odometry.calibration = self._calibration
+            self._planner.calibration = self._calibration
+            self._sequences.recompile(self._calibration)
+        except ValueError:
+            logger.warning("Failed to load calibration - using defaults", exc_info=True)
+
+    async def set_calibration(self, state: State, degrees_per_sec=None, mm_per_sec=None):
+        """
+        Update this robot's calibration for an action and save it.
+        Raises ValueError for invalid rates
+        """
+        self._calibration.set_rate(state, degrees_per_sec=degrees_per_sec, mm_per_sec=mm_per_sec)
+        self._sequences.recompile(self._calibration)
+        if self._calibration_path is not None:
+            await self._loop.run_in_executor(None, self._calibration.save, self._calibration_path)
+
+    async def _configure_input_pins(self):
+        '''
+        Configure all the input pins with a single pigpio script rather than three round trips to pigpiod per pin
+        '''
+        script = " ".join(
+            "m {0} r pud {0} u fg {0} {1}".format(pin, GLITCH_FILTER_US) for pin in GPIO_ACTIONS
+        ).encode()
+        try:
+            await runScript(self._the_pi, script)
+            return
+        except Exception:
+            logger.warning("Failed to configure GPIO pins by script - configuring them one-by-one", exc_info=True)
+        await asyncio.gather(*(
+            coro for pin in GPIO_ACTIONS for coro in (
                 self._the_pi.set_mode(pin, apigpio.INPUT),
                 self._the_pi.set_pull_up_down(pin, apigpio.PUD_UP),
-                self._the_pi.add_callback(pin, apigpio.EITHER_EDGE, self._on_gpio_edge_event),
-                self._the_pi.set_glitch_filter(pin, 25000)
-            ) for pin in GPIO_ACTIONS.keys()
+                self._the_pi.set_glitch_filter(pin, GLITCH_FILTER_US)
+            )
         ))
-        # Initialize the motor driver GPIO output pins
-        init_coros.append(self._motor.init_io())
-        # await it all
-        await asyncio.gather(*init_coros)
-        print("GPIO pins configured - Starting assistant ...")
-        self._assistant.start(callback=self._on_assistant_action)
 
     async def cleanup(self):
-        self._assistant.stop()
+        self._sequence_runner.cancel()
+        self._actions.stop()
+        self._cancel_timed_action()
+        if self._assistant is not None:
+            self._assistant.stop()
         await self._motor.setSpeedPercent(0)
         await self._the_pi.stop()
  
@@ -67,6 +219,202 @@ class Controller():
         """Returns the current state"""
         return self._current_state
 
+    @property
+    def calibration(self) -> Calibration:
+        """Returns this robot's calibration table"""
+        return self._calibration
+
+    @property
+    def pose(self):
+        """Returns the dead-reckoning pose estimate"""
+        return self._odometry.pose
+
+    def reset_pose(self, x=0.0, y=0.0, heading=0.0):
+        self._odometry.reset(x, y, heading)
+
+    def plan_heading(self, heading) -> Plan:
+        """
+        Returns the quickest Plan of timed actions to turn from the current pose estimate to face heading (degrees)
+        """
+        return self._planner.plan_heading(self._odometry.pose["heading_deg"], heading, **self._plan_origin())
+
+    def plan_waypoints(self, waypoints) -> Plan:
+        """
+        Returns the quickest Plan of timed actions to visit a list of (x, y) waypoints (mm) from the current pose estimate
+        """
+        pose = self._odometry.pose
+        return self._planner.plan_waypoints((pose["x_mm"], pose["y_mm"], pose["heading_deg"]), waypoints, **self._plan_origin())
+
+    def _plan_origin(self):
+        '''
+        Where plans start from: the drum position, whether its gears are engaged there, and its measured timing
+        '''
+        drum_at = self._drum.position
+        return {
+            "drum_at"   : drum_at,
+            "engaged"   : self._drum.parked_at is not None or self._current_state == drum_at,
+            "step_us"   : self._drum.step_us,
+        }
+
+    def request(self, state: State, timeout=None, secs=None, degrees=None, until_end=False) -> asyncio.Future:
+        """
+        Request a state, returning a future which resolves with the time (secs) taken for the
+        current state to reach it. i.e. for the action to begin, or with until_end for a timed
+        (secs or degrees, see perform()) or limit switched action to end.
+        The future fails with RequestSuperseded if a request for another state is acted upon first,
+        or asyncio.TimeoutError after timeout secs. Timing out or cancelling the future withdraws
+        the request if it has not yet been reached.
+        Raises ValueError for invalid requests
+        """
+        timed = secs is not None or degrees is not None
+        if until_end and not timed and state not in (State.PICK_UP, State.PUT_DOWN):
+            raise ValueError("Only timed actions or actions with limit switches end by themselves")
+        future = asyncio.get_running_loop().create_future()
+        if not timed and not until_end and state == self._current_state:
+            future.set_result(0.0)
+            return future
+        pending = _PendingRequest(state, future, until_end)
+        if timed:
+            self.perform(state, secs=secs, degrees=degrees)
+        else:
+            self.desired_state = state
+        self._pending_requests.append(pending)
+        future.add_done_callback(lambda _: self._on_request_done(pending))
+        if timeout is not None:
+            pending.timer = asyncio.get_running_loop().call_later(timeout, self._expire_request, pending)
+        return future
+
+    @property
+    def arms(self):
+        """Returns the arm position estimate & measured travel times"""
+        return self._arms.as_dict()
+
+    def move_arms(self, percent):
+        """
+        Move the arms to a position from 0% (down) to 100% (up).
+        Full moves run to the limit switch. Partial moves are timed from the learnt arm travel time.
+        Returns (state, secs) of the action requested, or None if the arms are already there.
+        Raises ValueError if a partial move can't be timed yet
+        """
+        if not 0 <= percent <= 100:
+            raise ValueError("Arm position must be between 0 and 100%")
+        if percent in (0, 100):
+            state = State.PICK_UP if percent == 100 else State.PUT_DOWN
+            self.desired_state = state
+            return state, None
+        move = self._arms.move_to(percent / 100)
+        if move is not None:
+            self.perform(move[0], secs=move[1])
+        return move
+
+    def add_action_listener(self, listener):
+        """
+        Add a function to be called with (state, start_tick, end_tick) each time an action is completed or interrupted.
+        Ticks are pigpio ticks
+        """
+        self._action_listeners.append(listener)
+
+    def remove_action_listener(self, listener):
+        self._action_listeners.remove(listener)
+
+    def add_state_listener(self, listener):
+        """
+        Add a function to be called with the new state each time the current state changes,
+        or an action (re)begins
+        """
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        self._state_listeners.remove(listener)
+
+    def add_edge_listener(self, listener):
+        """
+        Add a function to be called with (gpio, level, tick) for each GPIO edge event.
+        Called from the edge callback, so must be quick
+        """
+        self._edge_listeners.append(listener)
+
+    def remove_edge_listener(self, listener):
+        self._edge_listeners.remove(listener)
+
+    def add_assistant_listener(self, listener):
+        """Add a function to be called on the loop with (event name, args) for each voice assistant event"""
+        self._assistant_listeners.append(listener)
+
+    def add_stop_listener(self, listener):
+        """
+        Add a function to be called (without arguments) on each emergency stop, once the motor has stopped,
+        to abandon anything else which would start the robot moving again, e.g. scheduled actions
+        """
+        self._stop_listeners.append(listener)
+
+    def remove_stop_listener(self, listener):
+        self._stop_listeners.remove(listener)
+
+    def add_metrics_listener(self, listener):
+        """Add a function to be called with (stage, secs) for each action pipeline stage timing"""
+        self._actions.add_record_listener(listener)
+
+    def define_sequence(self, name, steps) -> CompiledSequence:
+        """
+        Validate, compile and cache a named sequence of steps. See verbot.sequence.compile_sequence()
+        Raises ValueError if invalid
+        """
+        return self._sequences.define(name, steps)
+
+    def run_sequence(self, name) -> SequenceRun:
+        """
+        Start running a named sequence, cancelling any sequence already running.
+        Returns the run, whose task may be awaited. Raises ValueError if not defined
+        """
+        try:
+            sequence = self._sequences.get(name)
+        except KeyError:
+            raise ValueError("Unknown sequence {0}".format(name))
+        return self._sequence_runner.start(sequence)
+
+    def cancel_sequence(self):
+        self._sequence_runner.cancel()
+
+    @property
+    def sequences(self):
+        """Returns the names of the defined sequences and the telemetry of their last runs"""
+        return {
+            "defined"   : self._sequences.names,
+            "running"   : None if self._sequence_runner.current is None else self._sequence_runner.current.sequence.name,
+            "last_runs" : self._sequence_runner.last_runs,
+        }
+
+    async def get_current_tick(self):
+        """Returns pigpio's current tick (us, wrapping at 32 bits)"""
+        return await self._the_pi.get_current_tick()
+
+    @property
+    def pipeline_stats(self):
+        """Returns statistics for the action pipeline"""
+        return self._actions.stats
+
+    @property
+    def motor_pwm_info(self):
+        """Returns the PWM frequency & resolution achieved by the motor driver"""
+        return self._motor.pwm_info
+
+    @property
+    def edge_trace(self) -> EdgeTrace:
+        """Returns the ring buffer of recent GPIO edge events"""
+        return self._edge_trace
+
+    @property
+    def predicted_time_to_target(self):
+        """
+        Returns the predicted time (secs) from the last switch activation until the drum
+        reaches the switch for the desired state, or None if not interrogating or unknown
+        """
+        if self._current_state != State.INTERROGATE:
+            return None
+        eta_us = self._drum.eta_us(self._desired_state, speed=self._motor_speed)
+        return None if eta_us is None else eta_us / 1000000
+
     @property 
     def desired_state(self) -> State:
         """Returns the desired state"""
@@ -77,17 +425,105 @@ class Controller():
         """Request a new desired state"""
 
         if state == State.ASSISTANT:
-            print("Request for new desired state {0}. Desired state will be set to STOP and assistant started/stopped".format(state))
+            logger.info("Request for new desired state %s. Desired state will be set to STOP and assistant started/stopped", state)
             state = State.STOP
-            self._assistant.toggle_conversation()
+            if self._assistant is not None:
+                self._assistant.toggle_conversation()
+
+        # Requests are serialized & coalesced by the action pipeline
+        self._last_requested = state
+        self._actions.submit((state, None))
 
-        if state == self._current_state: # Already in desired state
-            print("Request for new desired state {0} matches current state - ignored".format(state))
-            return; 
+    def perform(self, state: State, secs=None, degrees=None):
+        """
+        Request an action for a duration (secs) or, for rotations, through an angle (degrees)
+        using the calibration table. The stop is timed by pigpiod once the action begins,
+        after which the state is STOP with the drum left at the action's switch.
+        Returns the duration. Raises ValueError for invalid requests
+        """
+        if secs is not None and degrees is not None:
+            raise ValueError("Give a duration or an angle, not both")
+        if state not in DRUM_ORDER or state == State.STOP:
+            raise ValueError("{0} can't be timed".format(state.name.lower()))
+        if degrees is not None:
+            secs = self._calibration.secs_for_degrees(state, degrees)
+        if secs is None or not 0 < secs <= drv8835.MAX_HOLD_MS / 1000:
+            raise ValueError("Duration must be between 0 and {0} secs".format(drv8835.MAX_HOLD_MS // 1000))
+        self._last_requested = state
+        self._actions.submit((state, secs))
+        return secs
 
+    async def emergency_stop(self) -> float:
+        '''
+        Priority stop path. The motor PWM is zeroed before anything else happens,
+        queued requests and any interrogation in progress are abandoned, and then
+        the drum is settled back to the STOP switch in interrogation mode (which doesn't move the robot).
+        Returns the latency (secs) from the call until the motor was stopped
+        '''
+        started_at = time.perf_counter()
+        self._motor_speed = MOTOR_SPEED_STOPPED
+        await self._motor.stop()
+        latency = time.perf_counter() - started_at
+        self._actions.record("emergency_stop", latency)
+        logger.warning("EMERGENCY STOP: motor stopped in %.3f ms", latency * 1000, extra={"fields": {"latency_ms": latency * 1000}})
+        await self._end_action()
+        self._actions.flush()
+        self._sequence_runner.cancel()
+        for listener in self._stop_listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("Error in stop listener")
+        self._fail_requests(lambda pending: pending.state != State.STOP, RequestSuperseded("Emergency stop"))
+        self._cancel_timed_action()
+        self._interrogation_started_at = self._targeted_at = None
+        self._desired_state = State.STOP
+        self._desired_secs = None
+        if self._current_state != State.STOP:
+            # Drum is left at an action switch, or somewhere between switches - settle it at STOP
+            await self._start_action_interrogation()
+        return latency
+
+    def _is_desired_state(self, request):
+        '''
+        Pipeline no-op test. The request is already satisfied or already being interrogated for.
+        Timed requests always (re)start their action
+        '''
+        state, secs = request
+        if secs is None and self._desired_secs is None and state == self._desired_state:
+            logger.debug("Request for new desired state %s matches desired state - ignored", state)
+            return True
+        return False
+
+    async def _execute_desired_state(self, request):
+        '''
+        Pipeline executor. Called for each (coalesced) request for a new desired state.
+        If interrogation is already in progress the drum is simply retargeted, without resending the motor command
+        '''
+        state, secs = request
+        retargeted = state != self._desired_state
         self._desired_state = state
-        print("New desired state: {0}".format(self._desired_state))
-        asyncio.create_task(self._on_new_desired_state())
+        self._desired_secs = secs
+        self._fail_requests(lambda pending: pending.state != state and not pending.begun,
+            RequestSuperseded("Superseded by a request for {0}".format(state.name.lower())))
+        logger.info("New desired state: %s", state, extra={"fields": {"secs": secs}} if secs is not None else None)
+        if self._current_state == State.INTERROGATE:
+            if retargeted and self._targeted_at is not None:
+                # Drum travel towards the previous target was wasted
+                now = time.perf_counter()
+                self._actions.record("retarget_wasted", now - self._targeted_at)
+                self._targeted_at = now
+            motor_speed = self._interrogation_speed()
+            self._drum.set_speed(motor_speed)
+            await self._set_motor_speed(motor_speed)
+        elif self._current_state == State.STOP and self._drum.parked_at == state:
+            # Gears were left in the correct position for this action - no need to interrogate
+            await self._begin_action(state)
+        elif self._current_state == state:
+            # Already performing this action (re)timed - the gears are still engaged
+            await self._begin_action(state)
+        else:
+            await self._on_new_desired_state()
 
     async def _on_new_desired_state(self):
         '''
@@ -98,35 +534,179 @@ class Controller():
         '''
         await self._start_action_interrogation()
 
-    async def _on_reached_desired_state(self):
+    async def _on_reached_desired_state(self, state: State):
         '''
         Gears have rotated to correct position for desired state.
         Begin action by setting motor to action mode (CW) and resolve current state
         '''
-        self._current_state = self._desired_state
-        await self._set_motor_speed_for_current_state()
+        if state != self._desired_state or self._current_state != State.INTERROGATE:
+            return  # Retargeted since the switch activated - keep interrogating
+        await self._begin_action(state)
+
+    async def _begin_action(self, state: State):
+        self._cancel_timed_action()
+        await self._end_action()
+        self._drum.park(state)
+        self._set_current_state(state)
+        if self._interrogation_started_at is not None:
+            self._actions.record("interrogate", time.perf_counter() - self._interrogation_started_at)
+            self._interrogation_started_at = None
+        self._targeted_at = None
+        motor_started_at = time.perf_counter()
+        secs = self._desired_secs
+        if secs is None:
+            await self._set_motor_speed_for_current_state()
+        else:
+            logger.info("Current state is %s. Motor speed will be set to %s for %.3f secs", state, MOTOR_SPEED_FOR_ACTIONS, secs)
+            self._motor_speed = MOTOR_SPEED_FOR_ACTIONS
+            await self._motor.setSpeedPercentFor(MOTOR_SPEED_FOR_ACTIONS, secs)
+            self._timed_action = asyncio.create_task(self._finish_timed_action(state))
+        self._actions.record("motor", time.perf_counter() - motor_started_at)
+        if state != State.STOP:
+            self._action_started = (state, await self._the_pi.get_current_tick())
+
+    async def _finish_timed_action(self, state: State):
+        '''
+        Bookkeeping once pigpiod has stopped the motor at the end of a timed action.
+        The drum stays parked at the action's switch, so repeating the action needs no interrogation
+        '''
+        hold_ticks = None
+        try:
+            hold_ticks = await self._motor.waitUntilStopped()
+        except asyncio.TimeoutError:
+            logger.warning("Timed action %s still running after its expected end", state)
+        if self._current_state != state:
+            return
+        logger.info("Timed action %s complete", state)
+        self._timed_action = None
+        await self._end_action(hold_ticks)
+        self._set_current_state(State.STOP)
+        self._desired_state = State.STOP
+        self._desired_secs = None
+        self._motor_speed = MOTOR_SPEED_STOPPED
+
+    async def _end_action(self, ticks=None):
+        '''
+        Notify action listeners that the action being performed has ended.
+        ticks - (start, end) pigpio ticks of a hold timed by pigpiod, else the action runs until now
+        '''
+        if self._action_started is None:
+            return
+        state, start_tick = self._action_started
+        self._action_started = None
+        if ticks is None:
+            ticks = (start_tick, await self._the_pi.get_current_tick())
+        else:
+            # A timed run's duration includes its ramp up, so it is measured from the motor command
+            ticks = (start_tick, ticks[1])
+        for listener in self._action_listeners:
+            try:
+                listener(state, *ticks)
+            except Exception:
+                logger.exception("Error in action listener for %s", state)
+
+    def _on_arm_action(self, state: State, start_tick, end_tick):
+        limit_tick = None
+        if self._limit is not None and self._limit[0] == state:
+            limit_tick = self._limit[1]
+        self._limit = None
+        self._arms.on_action(state, start_tick, end_tick, limit_tick)
+
+    def _on_request_action_end(self, state: State, start_tick, end_tick):
+        for pending in list(self._pending_requests):
+            if pending.state == state and pending.begun and pending.until_end and not pending.future.done():
+                pending.future.set_result(time.perf_counter() - pending.requested_at)
+
+    def _fail_requests(self, predicate, exception):
+        for pending in list(self._pending_requests):
+            if predicate(pending) and not pending.future.done():
+                pending.future.set_exception(exception)
+
+    def _expire_request(self, pending: _PendingRequest):
+        if not pending.future.done():
+            pending.future.set_exception(asyncio.TimeoutError())
+
+    def _on_request_done(self, pending: _PendingRequest):
+        self._pending_requests.remove(pending)
+        if pending.timer is not None:
+            pending.timer.cancel()
+        if pending.begun or pending.state != self._last_requested:
+            return  # Reached, or another request has been made since
+        if pending.future.cancelled() or isinstance(pending.future.exception(), asyncio.TimeoutError):
+            logger.info("Request for %s withdrawn", pending.state)
+            self.desired_state = State.STOP
+
+    def _set_current_state(self, state: State):
+        self._current_state = state
+        for pending in list(self._pending_requests):
+            if pending.state == state and not pending.begun:
+                pending.begun = True
+                if not pending.until_end and not pending.future.done():
+                    pending.future.set_result(time.perf_counter() - pending.requested_at)
+        for listener in self._state_listeners:
+            try:
+                listener(state)
+            except Exception:
+                logger.exception("Error in state listener for %s", state)
+
+    def _cancel_timed_action(self):
+        if self._timed_action is not None:
+            self._timed_action.cancel()
+            self._timed_action = None
 
     async def _start_action_interrogation(self):
-        self._current_state = State.INTERROGATE
+        self._cancel_timed_action()
+        self._interrogation_started_at = self._targeted_at = time.perf_counter()
+        self._set_current_state(State.INTERROGATE)
         await self._set_motor_speed_for_current_state()
+        await self._end_action()
         # ... and wait for falling edge callbacks in self._on_gpio_edge_event
 
+    def _interrogation_speed(self):
+        '''
+        Speed profile for interrogation. Run at full speed whilst the target switch is predicted to be far away,
+        then slow to approach speed for the last switch(es) so the clutch engages without overshooting
+        '''
+        eta_us = self._drum.eta_us(self._desired_state, speed=MOTOR_SPEED_FOR_INTERROGATION_FAST)
+        if eta_us is None or eta_us <= INTERROGATION_APPROACH_US or self._drum.steps_to(self._desired_state) <= 1:
+            return MOTOR_SPEED_FOR_INTERROGATION
+        return MOTOR_SPEED_FOR_INTERROGATION_FAST
+
+    def _update_interrogation_speed(self):
+        '''
+        Called at each switch activation during interrogation to follow the speed profile
+        '''
+        motor_speed = self._interrogation_speed()
+        self._drum.set_speed(motor_speed)
+        if motor_speed != self._motor_speed:
+            asyncio.create_task(self._set_motor_speed(motor_speed))
+
     async def _set_motor_speed_for_current_state(self):
         motor_speed = MOTOR_SPEED_FOR_ACTIONS
         if self._current_state == State.INTERROGATE:
-            motor_speed = MOTOR_SPEED_FOR_INTERROGATION
+            motor_speed = self._interrogation_speed()
+            self._drum.set_speed(motor_speed)
         elif self._current_state == State.STOP:
             motor_speed = MOTOR_SPEED_STOPPED
-        print("Current state is {0}. Motor speed will be set to {1}".format(self._current_state, motor_speed))
+        logger.info("Current state is %s. Motor speed will be set to %s", self._current_state, motor_speed)
+        await self._set_motor_speed(motor_speed)
+
+    async def _set_motor_speed(self, motor_speed):
+        if motor_speed == self._motor_speed:
+            return  # Avoid a redundant round trip to pigpiod
+        self._motor_speed = motor_speed
         await self._motor.setSpeedPercent(motor_speed)
 
     def _on_gpio_edge_event(self, gpio, level, tick):
         if level == apigpio.TIMEOUT:
             return # No change, just a watchdog event
 
+        self._edge_trace.record(gpio, level, tick, self._current_state)
+        for listener in self._edge_listeners:
+            listener(gpio, level, tick)
+        if edge_logger.isEnabledFor(logging.DEBUG):
+            edge_logger.debug("Edge on GPIO #%s", gpio, extra={"fields": {"level": level, "tick": tick, "state": self._current_state.name}})
         action = GPIO_ACTIONS[gpio]
-        edge_event_type = "RISING" if level == apigpio.HIGH else "FALLING"
-        print("EVENT (tick={4}): {0} edge event on GPIO #{1} ({2}), level={3}".format(edge_event_type, gpio, action, level, tick))
 
         # Special case for Assistant button press, distinct from the the other inputs which are action switches
         if action == State.ASSISTANT:
@@ -142,7 +722,8 @@ class Controller():
             In these cases we must stop/reverse the motor to prevent arms trying to rise/fall to far
             '''
             if action == self._current_state:
-                print("LIMIT switch for state {0}".format(self._current_state))
+                logger.info("LIMIT switch for state %s", self._current_state)
+                self._limit = (action, tick)
                 self.desired_state = State.STOP
         else:
             '''
@@ -150,19 +731,40 @@ class Controller():
             '''
             if action == self._current_state:
                 return  # Ignore 'noise' of switch for current state activating (again)
+            if self._current_state == State.INTERROGATE:
+                self._drum.on_switch(action, tick)
             if action == self._desired_state:
                 # Gear has reached correct position for new desired state
-                print("Action {0} matches desired state".format(action))
-                asyncio.create_task(self._on_reached_desired_state())
+                logger.info("Action %s matches desired state", action)
+                asyncio.create_task(self._on_reached_desired_state(action))
+            elif self._current_state == State.INTERROGATE:
+                self._update_interrogation_speed()
 
     def _on_assistant_action(self, state):
         """
         Assistant callback. Called on worker thread
         """
         if isinstance(state, State):
-            print("ASSISTANT: request for state {}".format(state))
+            logger.info("ASSISTANT: request for state %s", state)
             # Note: this is called on an alternative thread, so we need to schedule it on the main thread loop
             asyncio.run_coroutine_threadsafe(self._set_new_desired_state_threadsafe_wrapper(state), self._loop)           
+        elif isinstance(state, RunSequence):
+            logger.info("ASSISTANT: request for sequence %s", state.name)
+            self._loop.call_soon_threadsafe(self.run_sequence, state.name)
+
+    def _on_assistant_event(self, name, args):
+        """
+        Assistant event callback. Called on worker thread
+        """
+        if self._assistant_listeners:
+            self._loop.call_soon_threadsafe(self._notify_assistant_listeners, name, args)
+
+    def _notify_assistant_listeners(self, name, args):
+        for listener in self._assistant_listeners:
+            try:
+                listener(name, args)
+            except Exception:
+                logger.exception("Error in assistant listener for %s", name)
 
     async def _set_new_desired_state_threadsafe_wrapper(self, state: State):
         """
@@ -0,0 +1,119 @@
+from verbot.utils import tickDiff
+
+# Weight given to each new switch-to-switch measurement in the running average
+STEP_TIME_SMOOTHING = 0.25
+
+class DrumModel():
+    """
+    Predictive model of the position of Verbot's interrogation cam drum.
+
+    The drum activates the action switches one-by-one in a fixed order as it
+    rotates (CCW) during interrogation. By observing the tick stamped falling
+    edges of those switches we know the last switch passed and can measure the
+    time taken to travel between adjacent switches. Times are normalized to
+    100% motor speed so measurements taken at any speed can be combined.
+    """
+
+    def __init__(self, switch_order):
+        """c'tor - switch_order is the sequence of states in interrogation order"""
+        self._order = tuple(switch_order)
+        self._indices = {state: index for index, state in enumerate(self._order)}
+        self._position = None       # Index of the last switch activated, or None if unknown
+        self._parked = False        # True whilst the drum is stopped with the switch at position activated
+        self._last_tick = None      # Tick of the last switch activation seen during interrogation
+        self._speed = 0             # Motor speed (%) most recently set
+        self._steady = False        # True if the speed has not changed since the last switch activation
+        self._at_switch = True      # True until the speed is set following a switch activation
+        self._step_us = None        # Measured switch-to-switch time (us) at 100% motor speed
+
+    @property
+    def switch_order(self):
+        """Returns the states of the switches in interrogation order"""
+        return self._order
+
+    @property
+    def position(self):
+        """Returns the state of the switch last activated by the drum, or None if unknown"""
+        return None if self._position is None else self._order[self._position]
+
+    @property
+    def parked_at(self):
+        """Returns the state of the switch the drum is stopped at, or None if not known to be stopped at a switch"""
+        return self.position if self._parked else None
+
+    @property
+    def step_us(self):
+        """Returns the measured time (us) between adjacent switches at full speed, or None if unknown"""
+        return self._step_us
+
+    def set_speed(self, speed):
+        """
+        Notify the model of the interrogation motor speed (%).
+        Call immediately after on_switch() for a change of speed at a switch
+        """
+        if speed != self._speed and not self._at_switch:
+            # Speed changed part way between switches, so the current interval can't be measured
+            self._steady = False
+        self._speed = speed
+        self._at_switch = False
+        if speed > 0:
+            self._parked = False
+
+    def on_switch(self, state, tick):
+        """
+        Notify the model that the drum activated the switch for state at tick during interrogation
+        """
+        index = self._indices.get(state)
+        if index is None:
+            return
+        if self._position is not None and self._last_tick is not None and self._steady and self._speed > 0:
+            steps = (index - self._position) % len(self._order)
+            if steps > 0:
+                step_us = tickDiff(self._last_tick, tick) * self._speed / (100 * steps)
+                if self._step_us is None:
+                    self._step_us = step_us
+                else:
+                    self._step_us += STEP_TIME_SMOOTHING * (step_us - self._step_us)
+        self._position = index
+        self._last_tick = tick
+        self._parked = False
+        self._steady = True
+        self._at_switch = True
+
+    def park(self, state):
+        """
+        Notify the model that the drum has stopped with the switch for state activated.
+        e.g. when the motor is reversed to perform an action
+        """
+        self._position = self._indices.get(state)
+        self._last_tick = None
+        self._parked = self._position is not None
+        self._at_switch = True
+
+    def forget(self):
+        """Discard the position estimate. e.g. when the drum may have moved unobserved"""
+        self._position = None
+        self._last_tick = None
+        self._parked = False
+
+    def steps_to(self, state):
+        """
+        Returns the number of switches the drum must advance to activate the switch for state,
+        or None if the drum position is unknown.
+        A target matching the current position needs a full revolution
+        """
+        index = self._indices.get(state)
+        if index is None or self._position is None:
+            return None
+        return (index - self._position - 1) % len(self._order) + 1
+
+    def eta_us(self, state, speed=100, elapsed_us=0):
+        """
+        Returns the predicted time (us) until the switch for state is activated when
+        interrogating at speed (%), given elapsed_us since the last switch activation.
+        Returns None if the drum position or timing is not yet known
+        """
+        steps = self.steps_to(state)
+        if steps is None or self._step_us is None or speed <= 0:
+            return None
+        return max(0, steps * self._step_us * 100 / speed - elapsed_us)
@@ -1,5 +1,10 @@
 import asyncio
+import logging
+import math
+import struct
 import apigpio
+from apigpio.apigpio import ApigpioError
+from verbot.utils import tickDiff, waitForScript
 
 # Motor speeds for this module are specified as numbers
 # between -MAX_SPEED and MAX_SPEED, inclusive.
@@ -11,20 +16,124 @@ MOTOR_DIR_PIN = 6
 # Default PWM frequency - Note pigpio will match nearest based on sample rate
 PWM_FREQUENCY=250000 # 250 KHz is the max PWM supported by the 8835!
 
+# PWM may be generated by pigpio's DMA sampled ('software') PWM, which rounds the frequency down to what
+# its sample rate allows, or by the PWM peripheral ('hardware') which is only available on some pins, including 13
+PWM_MODE_SOFTWARE = "software"
+PWM_MODE_HARDWARE = "hardware"
+# Hardware PWM duty cycles range from 0 to 1M, and the peripheral clocks at 250 MHz
+HW_PWM_RANGE = 1000000
+HW_PWM_CLOCK = 250000000
+# pigpio socket commands, sent directly for apigpio versions without the Pi methods for them
+PI_CMD_PFG  = 23    # get_PWM_frequency()
+PI_CMD_PRRG = 24    # get_PWM_real_range()
+PI_CMD_HP   = 86    # hardware_PWM()
+
+logger = logging.getLogger(__name__)
+
+# pigpio script performing a complete transition to a new direction & speed inside pigpiod.
+# If the direction changes the motor is first ramped down to zero, so the direction pin never changes under power.
+# Params: p0 = direction, p1 = target duty cycle, p2 = accel step, p3 = decel step, p4 = ms between steps,
+# p5 = ms to hold the target duty cycle before ramping down to zero (0 = hold until the next transition).
+# The tick at which the script started is recorded in p7, and a timed hold records the ticks at which it began & ended in p8 & p9
+RAMP_SCRIPT = (
+    "tick sta p7 gdc {pwm} sta v0 "
+    "r {dir} cmp p0 jz 20 "
+    # Ramp down to zero before changing direction
+    "tag 10 lda v0 cmp 0 jz 15 "
+    "lda v0 sub p3 sta v0 cmp 0 jp 11 ld v0 0 "
+    "tag 11 {set_duty} v0 mils p4 jmp 10 "
+    "tag 15 w {dir} p0 "
+    # Ramp to the target duty cycle
+    "tag 20 lda v0 cmp p1 jz 99 jm 30 "
+    "lda v0 sub p3 sta v0 cmp p1 jp 25 ld v0 p1 "
+    "tag 25 {set_duty} v0 mils p4 jmp 20 "
+    "tag 30 lda v0 add p2 sta v0 cmp p1 jm 35 ld v0 p1 "
+    "tag 35 {set_duty} v0 mils p4 jmp 20 "
+    # Hold, then stop
+    "tag 99 lda p5 cmp 0 jz 100 "
+    "tick sta p8 mils p5 tick sta p9 "
+    "ld p5 0 ld p1 0 jmp 20 "
+    "tag 100"
+)
+# Longest delay a pigpio script can make in one command
+MAX_HOLD_MS = 60000
+# Whilst waiting for a transition to complete, pigpiod is polled at least this often (secs), and at most this often near its end
+RAMP_POLL_MAX_SECS = 0.1
+RAMP_POLL_MIN_SECS = 0.002
+# A transition still running this long (secs) after its expected end is given up on
+RAMP_OVERRUN_SECS = 1.0
+
+class RampProfile(object):
+    """
+    Acceleration & deceleration profile for motor transitions.
+    Duty cycle changes by up to accel_step/decel_step every step_ms
+    """
+    def __init__(self, accel_step=MAX_SPEED, decel_step=MAX_SPEED, step_ms=0):
+        self.accel_step = max(1, accel_step)
+        self.decel_step = max(1, decel_step)
+        self.step_ms = step_ms
+
+    def duration(self, from_duty, from_dir, to_duty, to_dir):
+        """Returns the time (secs) a transition will take"""
+        if from_dir != to_dir:
+            steps = math.ceil(from_duty / self.decel_step) + math.ceil(to_duty / self.accel_step)
+        elif to_duty > from_duty:
+            steps = math.ceil((to_duty - from_duty) / self.accel_step)
+        else:
+            steps = math.ceil((from_duty - to_duty) / self.decel_step)
+        return steps * self.step_ms / 1000
+
+# No ramping. Transitions are still atomic
+NO_RAMP = RampProfile()
+# Full speed in ~40ms, stop in ~20ms - enough to take the slam out of the gears without delaying actions
+DEFAULT_RAMP_PROFILE = RampProfile(accel_step=32, decel_step=64, step_ms=5)
+
 class Motor(object):
-    def __init__(self, pi:apigpio.Pi):
+    def __init__(self, pi:apigpio.Pi, ramp_profile=DEFAULT_RAMP_PROFILE, pwm_mode=PWM_MODE_SOFTWARE):
         self.the_pi = pi
- 
+        self.ramp_profile = ramp_profile
+        self.pwm_mode = pwm_mode
+        # Duty cycle range of the PWM backend. Speeds are scaled from MAX_SPEED to this
+        self._range = HW_PWM_RANGE if pwm_mode == PWM_MODE_HARDWARE else MAX_SPEED
+        # PWM actually achieved, as reported by pigpiod after init_io()
+        self.pwm_frequency = None
+        self.pwm_resolution = None
+        self._script_ids = []   # Two copies of the ramp script, used alternately
+        self._script_index = 0
+        self._ramp_ends_at = 0
+        self._ramp_secs = 0     # Expected duration of the last transition by the ramp script
+        self._stop_timer = None # Timed stop when running without the ramp script
+        self._timed = False     # Whether the last transition was a timed run
+        self._duty = 0
+        self._dir = 0
+
     async def init_io(self):
-        await asyncio.gather(
-            # Setup digital output GPIO pin for motor direction
-            self.the_pi.set_mode(MOTOR_DIR_PIN, apigpio.OUTPUT),
-            # Set PWM range & frequency
-            self.the_pi.set_PWM_range(MOTOR_PWM_PIN, MAX_SPEED),
-            self.the_pi.set_PWM_frequency(MOTOR_PWM_PIN, PWM_FREQUENCY)
-        )
-        # Set initial speed to 0 (stopped) using hardware PWM
-        await self._setRawSpeedAndDir(0, 0)
+        if self.pwm_mode == PWM_MODE_HARDWARE:
+            # Setup digital output GPIO pin for motor direction. The PWM peripheral is set up with the first duty cycle
+            await self.the_pi.set_mode(MOTOR_DIR_PIN, apigpio.OUTPUT)
+            set_duty = "hp {0} {1}".format(MOTOR_PWM_PIN, PWM_FREQUENCY)
+        else:
+            await asyncio.gather(
+                # Setup digital output GPIO pin for motor direction
+                self.the_pi.set_mode(MOTOR_DIR_PIN, apigpio.OUTPUT),
+                # Set PWM range & frequency
+                self.the_pi.set_PWM_range(MOTOR_PWM_PIN, MAX_SPEED),
+                self.the_pi.set_PWM_frequency(MOTOR_PWM_PIN, PWM_FREQUENCY)
+            )
+            set_duty = "pwm {0}".format(MOTOR_PWM_PIN)
+        # Set initial speed to 0 (stopped) directly, which also puts the pin into PWM mode for the ramp script
+        await self._writeRawSpeedAndDir(0, 0)
+        await self._read_pwm_info()
+        script = RAMP_SCRIPT.format(set_duty=set_duty, dir=MOTOR_DIR_PIN, pwm=MOTOR_PWM_PIN).encode()
+        try:
+            for _ in range(2):
+                script_id = await self.the_pi.store_script(script)
+                await waitForScript(self.the_pi, script_id)
+                self._script_ids.append(script_id)
+        except (ApigpioError, asyncio.TimeoutError):
+            # Fall back to timed writes from Python, without ramping
+            logger.warning("Failed to store the motor ramp script - falling back to unramped writes timed from Python", exc_info=True)
+            self._script_ids = []
 
     async def setSpeed(self, speed):
         dir_value = 0
@@ -34,7 +143,7 @@ class Motor(object):
         if speed > MAX_SPEED:
             speed = MAX_SPEED
         await self._setRawSpeedAndDir(speed, dir_value)
- 
+
     async def setSpeedPercent(self, speed):
         if speed < -100:
             speed = -100
@@ -44,10 +153,154 @@ class Motor(object):
         speed = speed * MAX_SPEED // 100
         await self.setSpeed(speed)
 
-    async def _setRawSpeedAndDir(self, speed, dir):
+    async def setSpeedPercentFor(self, speed, secs):
+        """
+        Run at speed for secs (measured from this call) then stop.
+        The stop is timed by pigpiod, so is unaffected by network or event loop latency
+        """
+        if not 0 < secs <= MAX_HOLD_MS / 1000:
+            raise ValueError("Timed runs must be between 0 and {0} secs".format(MAX_HOLD_MS // 1000))
+        dir_value = 1 if speed < 0 else 0
+        speed = min(abs(speed), 100) * MAX_SPEED // 100
+        await self._setRawSpeedAndDir(speed, dir_value, run_secs=secs)
+
+    async def waitUntilStopped(self):
+        """
+        Wait for a transition (including any timed run) to complete.
+        Returns the pigpio ticks at which a timed run's hold began & ended, if known, else None.
+        Raises asyncio.TimeoutError if the transition overruns its expected end by RAMP_OVERRUN_SECS
+        """
+        if not self._script_ids:
+            # Timed from the event loop, so waited for on it
+            loop = asyncio.get_running_loop()
+            while loop.time() < self._ramp_ends_at:
+                await asyncio.sleep(self._ramp_ends_at - loop.time())
+            return None
+        script_id = self._script_ids[self._script_index]
+        while True:
+            status, params = await self.the_pi.script_status(script_id)
+            if status not in (apigpio.PI_SCRIPT_INITING, apigpio.PI_SCRIPT_RUNNING, apigpio.PI_SCRIPT_WAITING):
+                break
+            # Timed by pigpiod's clock, from when the script started, rather than the loop's.
+            # They needn't run at the same rate, e.g. a verbot.sim.SimulatedPi runs in virtual time
+            remaining = self._ramp_secs - tickDiff(params[7] & 0xFFFFFFFF, await self.the_pi.get_current_tick()) / 1000000
+            if remaining < -RAMP_OVERRUN_SECS:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(min(RAMP_POLL_MAX_SECS, max(RAMP_POLL_MIN_SECS, remaining)))
+        if not self._timed:
+            return None
+        return params[8] & 0xFFFFFFFF, params[9] & 0xFFFFFFFF
+
+    @property
+    def pwm_info(self):
+        """Returns a dict describing the PWM achieved"""
+        return {
+            "mode"                  : self.pwm_mode,
+            "requested_frequency"   : PWM_FREQUENCY,
+            "frequency"             : self.pwm_frequency,
+            "resolution"            : self.pwm_resolution,
+        }
+
+    async def stop(self):
+        # Zero the PWM duty cycle in a single write, whatever the direction
+        await self._writeDuty(0)
+        self._duty = 0
+        self._cancelStopTimer()
+        if self._rampMayBeRunning():
+            # Halt the ramp so it can't raise the duty cycle again, then make sure of zero
+            await self.the_pi.stop_script(self._script_ids[self._script_index])
+            await self._writeDuty(0)
+            self._ramp_ends_at = 0
+
+    async def _read_pwm_info(self):
+        self.pwm_frequency = await self._pigpio("get_PWM_frequency", PI_CMD_PFG, MOTOR_PWM_PIN)
+        if self.pwm_mode == PWM_MODE_HARDWARE:
+            self.pwm_resolution = HW_PWM_CLOCK // self.pwm_frequency if self.pwm_frequency else None
+        else:
+            # The duty cycle can't be finer than pigpio's real range, whatever range we set
+            self.pwm_resolution = min(MAX_SPEED, await self._pigpio("get_PWM_real_range", PI_CMD_PRRG, MOTOR_PWM_PIN))
+        logger.info("Motor PWM (%s): requested %s Hz, achieved %s Hz with %s steps",
+            self.pwm_mode, PWM_FREQUENCY, self.pwm_frequency, self.pwm_resolution)
+
+    async def _writeDuty(self, duty):
+        if self.pwm_mode == PWM_MODE_HARDWARE:
+            await self._pigpio("hardware_PWM", PI_CMD_HP, MOTOR_PWM_PIN, PWM_FREQUENCY, duty)
+        else:
+            await self.the_pi.set_PWM_dutycycle(MOTOR_PWM_PIN, duty)
+
+    async def _pigpio(self, method, cmd, *params):
+        """
+        Call the apigpio.Pi method taking params or, for apigpio versions without it, send its pigpio socket
+        command (cmd) directly: with params as p1 & p2, and any third as a 32 bit extension.
+        Returns the result. Raises ApigpioError if pigpiod returns an error (negative) status, either way
+        """
+        function = getattr(self.the_pi, method, None)
+        if function is not None:
+            status = await function(*params)
+        else:
+            p1, p2 = (params + (0,))[:2]
+            if len(params) > 2:
+                status = await self.the_pi._pigpio_aio_command_ext(cmd, p1, p2, 4, [struct.pack("I", params[2])])
+            else:
+                status = await self.the_pi._pigpio_aio_command(cmd, p1, p2)
+            # Raw commands return the status unsigned, and unchecked
+            status = struct.unpack("i", struct.pack("I", status))[0]
+        if status < 0:
+            raise ApigpioError("{0} failed with pigpio error {1}".format(method, status))
+        return status
+
+    def _rampMayBeRunning(self):
+        return self._script_ids and asyncio.get_running_loop().time() < self._ramp_ends_at
+
+    def _cancelStopTimer(self):
+        if self._stop_timer is not None:
+            self._stop_timer.cancel()
+            self._stop_timer = None
+
+    async def _setRawSpeedAndDir(self, speed, dir, run_secs=None):
+        speed = speed * self._range // MAX_SPEED
+        loop = asyncio.get_running_loop()
+        if not self._script_ids:
+            self._cancelStopTimer()
+            await self._writeRawSpeedAndDir(speed, dir)
+            self._ramp_ends_at = 0
+            if run_secs is not None:
+                # Best effort. Timed from the event loop
+                self._stop_timer = loop.call_later(run_secs, lambda: asyncio.ensure_future(self.stop()))
+                self._ramp_ends_at = loop.time() + run_secs
+            return
+        if self._rampMayBeRunning():
+            # A running script can't be restarted, so halt it and use the other copy
+            await self.the_pi.stop_script(self._script_ids[self._script_index])
+            self._script_index = 1 - self._script_index
+        profile = self.ramp_profile
+        duration = profile.duration(self._duty * MAX_SPEED / self._range, self._dir, speed * MAX_SPEED / self._range, dir)
+        hold_ms = 0
+        if run_secs is not None:
+            # The run includes the ramp up. Holding for 0ms would mean holding forever, so hold for at least 1ms
+            hold_ms = min(MAX_HOLD_MS, max(1, round(1000 * (run_secs - duration))))
+            duration += hold_ms / 1000 + profile.duration(speed * MAX_SPEED / self._range, dir, 0, dir)
+        # The whole transition is a single command to pigpiod
+        await self.the_pi.run_script(self._script_ids[self._script_index], [
+            dir, speed,
+            profile.accel_step * self._range // MAX_SPEED,
+            profile.decel_step * self._range // MAX_SPEED,
+            profile.step_ms,
+            hold_ms
+        ])
+        self._ramp_secs = duration + profile.step_ms / 1000
+        self._ramp_ends_at = loop.time() + self._ramp_secs
+        self._timed = run_secs is not None
+        self._duty = 0 if run_secs is not None else speed
+        self._dir = dir
+
+    async def _writeRawSpeedAndDir(self, speed, dir):
+        if dir != self._dir:
+            # Remove power before changing direction
+            await self._writeDuty(0)
         # set motor direction
-        await self.the_pi.write(MOTOR_DIR_PIN, dir),
+        await self.the_pi.write(MOTOR_DIR_PIN, dir)
         # set motor speed via PWM
-        await self.the_pi.set_PWM_dutycycle(MOTOR_PWM_PIN, speed)
-        
- 
\ No newline at end of file
+        await self._writeDuty(speed)
+        self._duty = speed
+        self._dir = dir
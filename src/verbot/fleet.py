@@ -0,0 +1,465 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import aiohttp
+from aiohttp import web
+from jsonrpcserver import async_dispatch
+from jsonrpcserver.methods import Methods
+from jsonrpcserver.exceptions import ApiError, InvalidParamsError
+from verbot.calibration import DEFAULT_CALIBRATION_PATH
+from verbot.lease import current_client
+from verbot.server import Server
+from verbot.shared import CLIENT_HEADER
+from verbot.timesync import ClockEstimate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLEET_PORT = 8090
+
+# Local robots' calibration tables are kept apart, one file per robot name
+DEFAULT_FLEET_CALIBRATION_DIR = os.path.join(os.path.dirname(DEFAULT_CALIBRATION_PATH), "fleet")
+
+# Robots' health is checked this often (secs), each check timing out after HEALTH_TIMEOUT
+HEALTH_INTERVAL = 5.0
+HEALTH_TIMEOUT = 2.0
+# Time allowed for each robot to answer a broadcast
+BROADCAST_TIMEOUT = 10.0
+
+# Clock synchronisation exchanges with each robot before a timeline is run
+DEFAULT_SYNC_SAMPLES = 8
+# Time (secs) from scheduling a timeline until its start, allowing for every robot to be told in time
+DEFAULT_TIMELINE_LEAD = 1.0
+# Time (secs) after the last step of a timeline is due, allowed for its actions to begin before reporting
+TIMELINE_SETTLE = 5.0
+
+# JSON-RPC error codes for a robot which didn't answer, or answered with something other than a JSON-RPC response
+ERROR_UNREACHABLE   = -32003
+ERROR_BAD_RESPONSE  = -32004
+
+# Health status of a robot
+HEALTH_OK           = "ok"
+HEALTH_ERROR        = "error"           # Answered with an error
+HEALTH_UNREACHABLE  = "unreachable"     # Didn't answer
+HEALTH_UNKNOWN      = "unknown"         # Not yet checked
+
+# Methods of the gateway's own JSON-RPC API. Kept apart from the robots' methods.
+# Robots' methods are given as robot_method, as jsonrpcserver reserves 'method'
+fleet_methods = Methods()
+
+class LocalRobot():
+    """
+    A Verbot driven from this process, i.e. via its own pigpiod host.
+    Each has its own Server, so its own controller, action pipeline and control leases
+    """
+
+    def __init__(self, name, pigpiod_addr="127.0.0.1", pigpiod_port=8888, pi=None, pwm_mode=None, calibration_path=None):
+        """
+        c'tor - pi may be a stand-in for apigpio.Pi, e.g. verbot.sim.SimulatedPi
+        calibration_path - this robot's calibration table. By default <name>.json in DEFAULT_FLEET_CALIBRATION_DIR
+        """
+        self.name = name
+        if calibration_path is None:
+            calibration_path = os.path.join(DEFAULT_FLEET_CALIBRATION_DIR, "{0}.json".format(name))
+        self.server = Server(pigpiod_addr=pigpiod_addr, pigpiod_port=pigpiod_port, pi=pi, assistant=False, pwm_mode=pwm_mode,
+                             teleop_port=None, calibration_path=calibration_path)
+        self._started = False
+
+    async def start(self, session):
+        await self.server.start_controller()
+        self._started = True
+
+    async def stop(self):
+        if self._started:
+            self._started = False
+            await self.server.stop_controller()
+
+    async def forward(self, request):
+        """Handle a JSON-RPC HTTP request for this robot"""
+        self._check_started()
+        return await self.server._handle_json_rpc_request(request)
+
+    async def call(self, request):
+        """Returns the JSON-RPC response (dict) to a request (dict)"""
+        self._check_started()
+        response = await async_dispatch(request=json.dumps(request), context=self.server)
+        return response.deserialized() if response.wanted else None
+
+    def _check_started(self):
+        if not self._started:
+            raise ConnectionError("Not connected to pigpiod")
+
+
+class RemoteRobot():
+    """A Verbot served by a verbot_pi control server elsewhere, reached over HTTP"""
+
+    def __init__(self, name, url):
+        """c'tor"""
+        self.name = name
+        self.url = url
+        self._session = None
+
+    async def start(self, session):
+        """session - aiohttp.ClientSession shared by all remote robots, so connections are pooled and kept alive"""
+        self._session = session
+
+    async def stop(self):
+        self._session = None
+
+    async def forward(self, request):
+        body = await request.read()
+        async with self._session.post(self.url, data=body, params=request.query, headers=self._headers()) as response:
+            return web.Response(body=await response.read(), status=response.status, content_type="application/json")
+
+    async def call(self, request):
+        """Returns the JSON-RPC response (dict) to a request (dict). Raises ValueError if the response isn't one"""
+        async with self._session.post(self.url, json=request, headers=self._headers()) as response:
+            result = await response.json(content_type=None)
+        if result is not None and not isinstance(result, dict):
+            raise ValueError("Not a JSON-RPC response")
+        return result
+
+    def _headers(self):
+        client = current_client.get()
+        return {} if client is None else {CLIENT_HEADER : client}
+
+
+class FleetServer():
+    """
+    Gateway to a fleet of Verbots on one asyncio loop, each robot local (its own pigpiod host) or remote
+    (a verbot_pi server). Requests for one robot are POSTed to /robots/<name>, and are handled exactly as
+    that robot's own server would. The gateway's own JSON-RPC API (at /) broadcasts to the fleet and
+    reports each robot's health, which is checked periodically in the background
+    """
+
+    def __init__(self, bind_addr=None, listen_port=DEFAULT_FLEET_PORT, health_interval=HEALTH_INTERVAL):
+        """c'tor"""
+        self._app = web.Application()
+        self._bind_addr = bind_addr
+        self._listen_port = listen_port
+        self._app.router.add_post("/", self._handle_json_rpc_request)
+        self._app.router.add_post("/robots/{name}", self._handle_robot_request)
+        self._app.on_startup.append(self._on_startup)
+        self._app.on_shutdown.append(self._on_shutdown)
+        self._health_interval = health_interval
+        self._robots = {}
+        self._health = {}
+        self._clocks = {}       # Robot name to ClockEstimate of its loop's clock relative to ours
+        self._session = None
+        self._health_task = None
+
+    def add_local(self, name, **kwargs):
+        """Add a robot driven from this process. See LocalRobot"""
+        self._add(LocalRobot(name, **kwargs))
+
+    def add_remote(self, name, url):
+        """Add a robot served by a verbot_pi server at url"""
+        self._add(RemoteRobot(name, url))
+
+    @property
+    def robots(self):
+        return dict(self._robots)
+
+    @property
+    def health(self):
+        """Returns the latest health of each robot"""
+        return dict(self._health)
+
+    def start_server(self):
+        """
+        This is a synchronous function.
+        It will run the asyncio event loop and not return until the loop is stopped
+        """
+        web.run_app(self._app, host=self._bind_addr, port=self._listen_port)
+
+    async def start(self):
+        """Start all robots concurrently, and the health monitor"""
+        started_at = time.perf_counter()
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=4))
+        results = await asyncio.gather(*(robot.start(self._session) for robot in self._robots.values()), return_exceptions=True)
+        for robot, result in zip(self._robots.values(), results):
+            if isinstance(result, Exception):
+                logger.error("Robot %s failed to start: %s", robot.name, result)
+                self._health[robot.name] = {"status" : HEALTH_UNREACHABLE, "error" : str(result)}
+        if self._health_interval:
+            self._health_task = asyncio.get_running_loop().create_task(self._monitor_health())
+        logger.info("Fleet of %s robots ready in %.3f secs", len(self._robots), time.perf_counter() - started_at)
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(robot.stop() for robot in self._robots.values()), return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def broadcast(self, method, params=None, robots=None, timeout=BROADCAST_TIMEOUT):
+        """
+        Call a method on each robot (or those named in robots, a name or list of names) concurrently.
+        Returns a dict of robot name to its JSON-RPC response. Raises ValueError for an unknown robot
+        """
+        targets = self._targets(robots)
+        request = {"jsonrpc" : "2.0", "method" : method, "params" : params or {}, "id" : 1}
+        async def call(robot):
+            try:
+                return await asyncio.wait_for(robot.call(request), timeout)
+            except asyncio.TimeoutError:
+                return {"jsonrpc" : "2.0", "error" : {"code" : ERROR_UNREACHABLE, "message" : "Timed out"}, "id" : 1}
+            except (aiohttp.ClientError, OSError) as e:
+                return {"jsonrpc" : "2.0", "error" : {"code" : ERROR_UNREACHABLE, "message" : str(e)}, "id" : 1}
+            except ValueError as e:
+                # e.g. a body which isn't JSON. One robot's bad response mustn't fail the whole broadcast
+                return {"jsonrpc" : "2.0", "error" : {"code" : ERROR_BAD_RESPONSE, "message" : "Invalid response: {0}".format(e)}, "id" : 1}
+        responses = await asyncio.gather(*(call(robot) for robot in targets))
+        return {robot.name : response for robot, response in zip(targets, responses)}
+
+    async def check_health(self):
+        """Check every robot's health concurrently. Returns the health of each robot"""
+        started_at = time.perf_counter()
+        responses = await self.broadcast("verbot_stats", timeout=HEALTH_TIMEOUT)
+        latency_ms = 1000 * (time.perf_counter() - started_at)
+        for name, response in responses.items():
+            health = {"checked_at" : time.time(), "latency_ms" : latency_ms}
+            error = response.get("error") if response is not None else {"code" : ERROR_UNREACHABLE, "message" : "No response"}
+            stats = response.get("result") if error is None else None
+            if error is None and not isinstance(stats, dict):
+                error = {"code" : ERROR_BAD_RESPONSE, "message" : "Invalid verbot_stats result"}
+            if error is None:
+                # Robots running older versions don't report everything
+                pipeline = stats.get("pipeline")
+                pipeline = pipeline if isinstance(pipeline, dict) else {}
+                health.update({
+                    "status"            : HEALTH_OK,
+                    "state"             : stats.get("state"),
+                    "desired"           : stats.get("desired"),
+                    "pipeline_depth"    : pipeline.get("depth"),
+                    "executed"          : pipeline.get("executed"),
+                })
+            else:
+                health["status"] = HEALTH_UNREACHABLE if error.get("code") == ERROR_UNREACHABLE else HEALTH_ERROR
+                health["error"] = error.get("message")
+                if self._health.get(name, {}).get("status") == HEALTH_OK:
+                    logger.warning("Robot %s is %s: %s", name, health["status"], health["error"])
+            self._health[name] = health
+        return self.health
+
+    @property
+    def clocks(self):
+        """Returns the estimate of each robot's clock"""
+        return {name : clock.as_dict() for name, clock in self._clocks.items()}
+
+    async def sync_clocks(self, samples=DEFAULT_SYNC_SAMPLES, robots=None):
+        """
+        Exchange timestamps with each robot (or those named in robots) concurrently, to refine the estimate of its clock.
+        Returns the estimate of each robot's clock
+        """
+        loop = asyncio.get_running_loop()
+        request = {"jsonrpc" : "2.0", "method" : "verbot_time", "params" : {}, "id" : 1}
+        async def sync(robot):
+            clock = self._clocks[robot.name]
+            for _ in range(samples):
+                sent_at = loop.time()
+                try:
+                    response = await asyncio.wait_for(robot.call(request), HEALTH_TIMEOUT)
+                except (asyncio.TimeoutError, aiohttp.ClientError, OSError, ValueError):
+                    return
+                times = response.get("result") if response is not None else None
+                if times is None:
+                    return
+                clock.add(sent_at, times["received"], times["sent"], loop.time(), times["tick"], times["tick_at"])
+        await asyncio.gather(*(sync(robot) for robot in self._targets(robots)))
+        return self.clocks
+
+    async def run_timeline(self, steps, lead=DEFAULT_TIMELINE_LEAD):
+        """
+        Run a timeline of actions across the fleet, each starting at the same instant on every robot.
+        steps - list of dicts of at (secs from the start), action, optional duration or degrees,
+            and optional robots (names, default all)
+        Clocks are synchronised first, and each action is scheduled on each robot at its own clock's time for the step.
+        Once the actions are due, returns a report of how late each action was requested and begun on each robot,
+        and the skew (spread) between robots of each.
+        Raises ValueError for an invalid timeline
+        """
+        if not isinstance(steps, list) or not steps:
+            raise ValueError("A timeline must be a non-empty list of steps")
+        for index, step in enumerate(steps):
+            if not isinstance(step, dict) or "action" not in step or float(step.get("at", -1)) < 0:
+                raise ValueError("Step {0} needs an action and a time (at) from the start".format(index))
+            if "robots" in step:
+                step["robots"] = [robot.name for robot in self._targets(step["robots"])]
+        names = {name for step in steps for name in step.get("robots", self._robots)}
+        await self.sync_clocks(robots=names)
+        unsynced = [name for name in names if not self._clocks[name].samples]
+        if unsynced:
+            raise ValueError("Robots {0} could not be synchronised".format(sorted(unsynced)))
+        loop = asyncio.get_running_loop()
+        start = loop.time() + lead
+        # Schedule every action on every robot before the start
+        scheduled = []  # (step index, robot name, response)
+        async def schedule(index, step, name):
+            params = {key : step[key] for key in ("action", "duration", "degrees") if key in step}
+            params["at"] = self._clocks[name].to_remote(start + float(step["at"]))
+            response = await self.broadcast("verbot_action_at", params, robots=[name])
+            scheduled.append((index, name, response[name]))
+        await asyncio.gather(*(
+            schedule(index, step, name)
+            for index, step in enumerate(steps) for name in step.get("robots", self._robots)
+        ))
+        late = loop.time() - start
+        if late > 0:
+            logger.warning("Timeline scheduled %.3f secs after its start - increase the lead", late)
+        await asyncio.sleep(start + max(float(step["at"]) for step in steps) + TIMELINE_SETTLE - loop.time())
+        reports = await self.broadcast("verbot_scheduled", robots=names)
+        return self._timeline_report(steps, start, scheduled, reports)
+
+    def _timeline_report(self, steps, start, scheduled, reports):
+        actions = {
+            name : {action["id"] : action for action in response.get("result") or ()}
+            for name, response in reports.items() if response is not None
+        }
+        report_steps = [{"at" : step["at"], "action" : step["action"], "robots" : {}} for step in steps]
+        for index, name, response in scheduled:
+            result = response.get("result") if response is not None else None
+            if result is None:
+                error = (response or {}).get("error") or {}
+                report_steps[index]["robots"][name] = {"status" : "not_scheduled", "error" : error.get("message")}
+                continue
+            action = actions.get(name, {}).get(result["id"])
+            if action is None:
+                report_steps[index]["robots"][name] = {"status" : "unknown"}
+                continue
+            due = start + float(steps[index]["at"])
+            clock = self._clocks[name]
+            report_steps[index]["robots"][name] = {
+                "status"        : action["status"],
+                # Times on our clock, so are comparable between robots
+                "late_ms"       : None if action["fired_at"] is None else 1000 * (clock.to_local(action["fired_at"]) - due),
+                "begin_late_ms" : None if action["begun_at"] is None else 1000 * (clock.to_local(action["begun_at"]) - due),
+                "clock_error_ms": 1000 * clock.delay / 2,
+            }
+        for step in report_steps:
+            for key, skew_key in (("late_ms", "skew_ms"), ("begin_late_ms", "begin_skew_ms")):
+                times = [robot[key] for robot in step["robots"].values() if robot.get(key) is not None]
+                step[skew_key] = max(times) - min(times) if times else None
+        def worst(key):
+            skews = [step[key] for step in report_steps if step[key] is not None]
+            return max(skews) if skews else None
+        report = {
+            "steps"             : report_steps,
+            "max_skew_ms"       : worst("skew_ms"),
+            "max_begin_skew_ms" : worst("begin_skew_ms"),
+            "clocks"            : self.clocks,
+        }
+        logger.info("Timeline of %s steps run. Max skew %s ms requested, %s ms begun", len(steps),
+            report["max_skew_ms"], report["max_begin_skew_ms"], extra={"fields": {
+                "max_skew_ms": report["max_skew_ms"], "max_begin_skew_ms": report["max_begin_skew_ms"]}})
+        return report
+
+    def _add(self, robot):
+        if robot.name in self._robots:
+            raise ValueError("Robot {0} already added".format(robot.name))
+        self._robots[robot.name] = robot
+        self._health[robot.name] = {"status" : HEALTH_UNKNOWN}
+        self._clocks[robot.name] = ClockEstimate()
+
+    def _robot(self, name):
+        robot = self._robots.get(name)
+        if robot is None:
+            raise ValueError("Unknown robot {0}".format(name))
+        return robot
+
+    def _targets(self, robots=None):
+        """Returns the robots named in robots (a name or list of names), or all of them if None"""
+        if robots is None:
+            return list(self._robots.values())
+        if isinstance(robots, str):
+            robots = [robots]
+        elif not isinstance(robots, (list, tuple, set)):
+            raise ValueError("Robots must be a name or a list of names")
+        return [self._robot(name) for name in robots]
+
+    async def _monitor_health(self):
+        while True:
+            try:
+                await self.check_health()
+                # A sample each interval lets clock drift be tracked over long periods
+                await self.sync_clocks(samples=1)
+            except Exception:
+                logger.exception("Error checking fleet health")
+            await asyncio.sleep(self._health_interval)
+
+    async def _handle_json_rpc_request(self, request):
+        current_client.set(request.headers.get(CLIENT_HEADER) or request.remote)
+        response = await async_dispatch(request=await request.text(), methods=fleet_methods, context=self)
+        if response.wanted:
+            return web.json_response(response.deserialized(), status=response.http_status)
+        else:
+            return web.Response(status=400) # Bad Request
+
+    async def _handle_robot_request(self, request):
+        robot = self._robots.get(request.match_info["name"])
+        if robot is None:
+            raise web.HTTPNotFound()
+        current_client.set(request.headers.get(CLIENT_HEADER) or request.remote)
+        try:
+            return await robot.forward(request)
+        except (aiohttp.ClientError, OSError) as e:
+            raise web.HTTPBadGateway(text=str(e))
+
+    async def _on_startup(self, app):
+        await self.start()
+
+    async def _on_shutdown(self, app):
+        await self.stop()
+
+
+@fleet_methods.add
+async def fleet_robots(fleet):
+    return {name : type(robot).__name__ for name, robot in fleet.robots.items()}
+
+@fleet_methods.add
+async def fleet_health(fleet, refresh=False):
+    if refresh:
+        return await fleet.check_health()
+    return fleet.health
+
+@fleet_methods.add
+async def fleet_call(fleet, robot, robot_method, params=None):
+    try:
+        response = (await fleet.broadcast(robot_method, params, robots=[robot]))[robot]
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+    if response is None:
+        return None
+    error = response.get("error")
+    if error is not None:
+        # The robot's error, as if it had been called directly
+        raise ApiError(error.get("message"), code=error.get("code"), data=error.get("data"))
+    return response.get("result")
+
+@fleet_methods.add
+async def fleet_broadcast(fleet, robot_method, params=None, robots=None):
+    try:
+        return await fleet.broadcast(robot_method, params, robots)
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+
+@fleet_methods.add
+async def fleet_stop(fleet, robots=None):
+    try:
+        return await fleet.broadcast("verbot_stop", robots=robots)
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+
+@fleet_methods.add
+async def fleet_sync(fleet, samples=DEFAULT_SYNC_SAMPLES):
+    return await fleet.sync_clocks(samples)
+
+@fleet_methods.add
+async def fleet_timeline(fleet, steps, lead=DEFAULT_TIMELINE_LEAD):
+    try:
+        return await fleet.run_timeline(steps, float(lead))
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
@@ -0,0 +1,112 @@
+import contextvars
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Time (secs) a client keeps control after its last action, unless it asks for longer
+DEFAULT_LEASE_TTL = 5.0
+MAX_LEASE_TTL = 300.0
+
+# Identity of the client making the current request, set by the server for each request.
+# None for requests made internally (e.g. voice commands), which are never refused
+current_client = contextvars.ContextVar("verbot_client", default=None)
+
+class LeaseBusy(Exception):
+    """Another client holds the control lease"""
+
+    def __init__(self, holder, expires_in):
+        """c'tor"""
+        super().__init__("Busy - {0} has control for {1:.1f} secs".format(holder, expires_in))
+        self.holder = holder
+        self.expires_in = expires_in
+
+
+class LeaseManager():
+    """
+    Arbitrates control of the robot between clients.
+
+    Each action retargets the drum, so clients sending conflicting actions make it spend
+    whole revolutions interrogating without ever acting. Instead one client at a time holds
+    a lease on control: it is granted implicitly by a client's first action (or explicitly, for longer),
+    renewed by each further action, and lapses after its TTL. Other clients are refused
+    immediately until then. Stopping is always allowed, so is not checked here.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_LEASE_TTL, clock=time.monotonic):
+        """c'tor"""
+        self._default_ttl = default_ttl
+        self._clock = clock
+        self._holder = None
+        self._expires_at = 0.0
+        self._granted = 0
+        self._renewed = 0
+        self._refused = 0
+        self._expired = 0
+        self._released = 0
+        self._refused_by_client = {}
+
+    @property
+    def holder(self):
+        """Returns the client holding the lease, or None"""
+        if self._holder is not None and self._clock() >= self._expires_at:
+            logger.info("Lease held by %s expired", self._holder)
+            self._holder = None
+            self._expired += 1
+        return self._holder
+
+    def acquire(self, client=None, ttl=None):
+        """
+        Grant or renew the lease for client (default: the current client) for ttl secs,
+        but never shortening an existing lease. Returns the secs until it expires.
+        Raises LeaseBusy if another client holds it, or ValueError for an invalid ttl
+        """
+        client = current_client.get() if client is None else client
+        ttl = self._default_ttl if ttl is None else float(ttl)
+        if not 0 < ttl <= MAX_LEASE_TTL:
+            raise ValueError("Lease TTL must be between 0 and {0} secs".format(MAX_LEASE_TTL))
+        if client is None:
+            return None
+        holder = self.holder
+        now = self._clock()
+        if holder is None:
+            logger.info("Lease granted to %s for %.1f secs", client, ttl)
+            self._holder = client
+            self._expires_at = now + ttl
+            self._granted += 1
+        elif holder == client:
+            self._expires_at = max(self._expires_at, now + ttl)
+            self._renewed += 1
+        else:
+            self._refused += 1
+            self._refused_by_client[client] = self._refused_by_client.get(client, 0) + 1
+            raise LeaseBusy(holder, self._expires_at - now)
+        return self._expires_at - now
+
+    def release(self, client=None):
+        """Give up the lease if held by client (default: the current client). Returns True if released"""
+        client = current_client.get() if client is None else client
+        if client is None or self.holder != client:
+            return False
+        logger.info("Lease released by %s", client)
+        self._holder = None
+        self._released += 1
+        return True
+
+    def as_dict(self):
+        holder = self.holder
+        return {
+            "holder"        : holder,
+            "expires_in"    : None if holder is None else self._expires_at - self._clock(),
+        }
+
+    @property
+    def stats(self):
+        return {
+            "granted"           : self._granted,
+            "renewed"           : self._renewed,
+            "refused"           : self._refused,
+            "expired"           : self._expired,
+            "released"          : self._released,
+            "refused_by_client" : dict(self._refused_by_client),
+        }
@@ -0,0 +1,94 @@
+import logging
+import logging.handlers
+import queue
+
+# Loggers for each subsystem, whose levels may be changed at runtime
+SUBSYSTEMS = {
+    "control"   : "verbot.control",
+    "edges"     : "verbot.control.edges",
+    "pipeline"  : "verbot.pipeline",
+    "server"    : "verbot.server",
+    "assistant" : "verbot.assistant",
+}
+
+# Edge tracing is off by default. Every GPIO edge would be logged
+DEFAULT_LEVELS = {
+    "edges"     : logging.WARNING,
+}
+
+_listener = None
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as 'time level subsystem message key=value ...'
+    Structured fields are passed to a logger as extra={"fields": {...}}
+    """
+
+    def __init__(self):
+        """c'tor"""
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join("{0}={1}".format(key, value) for key, value in fields.items())
+        return text
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves all message formatting to the listener thread.
+    Arguments to log calls must therefore not be mutated after the call
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start_logging(level=logging.INFO, stream=None):
+    """
+    Route all verbot logging through a queue to a listener thread which formats and writes
+    the records, so logging never blocks the event loop or GPIO callbacks on I/O
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(StructuredFormatter())
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    root = logging.getLogger("verbot")
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+    root.propagate = False
+    for subsystem, subsystem_level in DEFAULT_LEVELS.items():
+        logging.getLogger(SUBSYSTEMS[subsystem]).setLevel(subsystem_level)
+    _listener.start()
+
+def stop_logging():
+    """Flush any queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_levels():
+    """Returns a dict of subsystem name to effective level name"""
+    return {
+        subsystem : logging.getLevelName(logging.getLogger(name).getEffectiveLevel())
+        for subsystem, name in SUBSYSTEMS.items()
+    }
+
+def set_level(subsystem, level):
+    """
+    Set the level of a subsystem logger by name. e.g. set_level("edges", "DEBUG")
+    Raises ValueError for an unknown subsystem or level
+    """
+    name = SUBSYSTEMS.get(subsystem)
+    if name is None:
+        raise ValueError("Unknown subsystem {0}. Valid subsystems are {1}".format(subsystem, list(SUBSYSTEMS)))
+    level_number = logging.getLevelName(str(level).upper())
+    if not isinstance(level_number, int):
+        raise ValueError("Unknown log level {0}".format(level))
+    logging.getLogger(name).setLevel(level_number)
@@ -0,0 +1,61 @@
+import math
+from verbot.calibration import Calibration
+from verbot.shared import State
+from verbot.utils import tickDiff
+
+# Rotations are counter-clockwise +ve, as seen from above
+ROTATION_SIGN = {
+    State.ROTATE_LEFT   : 1,
+    State.ROTATE_RIGHT  : -1,
+}
+TRAVEL_SIGN = {
+    State.FORWARDS      : 1,
+    State.REVERSE       : -1,
+}
+
+class Odometry():
+    """
+    Dead-reckoning pose estimate, integrated from the timing of completed actions.
+
+    Pose is (x, y) in mm and heading in degrees, counter-clockwise from the x axis.
+    The Verbot either drives straight or turns on the spot, so each action interval
+    is integrated exactly as a straight line or a pure rotation.
+    """
+
+    def __init__(self, calibration: Calibration):
+        """c'tor"""
+        self.calibration = calibration
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        self._x = float(x)
+        self._y = float(y)
+        self._heading = float(heading) % 360
+        self._intervals = 0
+        self._travel_secs = 0.0
+
+    def on_action(self, state: State, start_tick, end_tick):
+        """Integrate an action performed from start_tick until end_tick (pigpio ticks)"""
+        secs = tickDiff(start_tick, end_tick) / 1000000
+        if state in ROTATION_SIGN:
+            rate = self.calibration.degrees_per_sec(state) or 0.0
+            self._heading = (self._heading + ROTATION_SIGN[state] * rate * secs) % 360
+        elif state in TRAVEL_SIGN:
+            distance = TRAVEL_SIGN[state] * (self.calibration.mm_per_sec(state) or 0.0) * secs
+            self._x += distance * math.cos(math.radians(self._heading))
+            self._y += distance * math.sin(math.radians(self._heading))
+        else:
+            return  # Doesn't move the robot
+        self._intervals += 1
+        self._travel_secs += secs
+
+    @property
+    def pose(self):
+        """Returns the current pose estimate as a dict"""
+        return {
+            "x_mm"          : self._x,
+            "y_mm"          : self._y,
+            "heading_deg"   : self._heading,
+            "intervals"     : self._intervals,
+            "travel_secs"   : self._travel_secs,
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of requests waiting to be executed. Older requests are merged away when full
+DEFAULT_QUEUE_SIZE = 8
+
+class StageStats():
+    """
+    Accumulated timings for one stage of the action pipeline
+    """
+
+    def __init__(self):
+        """c'tor"""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, secs):
+        self.count += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+
+    def as_dict(self):
+        return {
+            "count"     : self.count,
+            "mean_ms"   : 1000 * self.total / self.count if self.count else 0.0,
+            "max_ms"    : 1000 * self.max,
+        }
+
+
+class ActionPipeline():
+    """
+    Serializes requests for new states through a single executor coroutine.
+    Requests are opaque to the pipeline, e.g. the controller's (state, secs) tuples.
+
+    Requests are fed through a bounded queue. Any requests that arrive whilst the
+    executor is busy are coalesced so that only the latest target is acted upon,
+    and requests that would not change anything are dropped without touching the motor.
+    """
+
+    def __init__(self, execute, is_noop, maxsize=DEFAULT_QUEUE_SIZE):
+        """
+        c'tor
+        execute - coroutine function taking a request, called to act on it
+        is_noop - function taking a request, returning True if it can be dropped
+        """
+        self._execute = execute
+        self._is_noop = is_noop
+        self._queue = asyncio.Queue(maxsize)
+        self._task = None
+        self._submitted = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._executed = 0
+        self._max_depth = 0
+        self._stages = {}
+        self._record_listeners = []
+
+    def start(self):
+        """Start the executor coroutine on the running loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        """Stop the executor coroutine, discarding any pending requests"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+
+    def submit(self, request):
+        """Queue a request, e.g. (state, secs), for a new state. Never blocks"""
+        self._submitted += 1
+        if self._queue.full():
+            # The oldest pending request would be superseded anyway
+            self._queue.get_nowait()
+            self._coalesced += 1
+        self._queue.put_nowait((request, time.perf_counter()))
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def flush(self):
+        """Discard any pending requests, returning the number discarded"""
+        discarded = 0
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            discarded += 1
+        return discarded
+
+    def record(self, stage, secs):
+        """Record the time spent in a named stage"""
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = StageStats()
+        stats.add(secs)
+        for listener in self._record_listeners:
+            listener(stage, secs)
+
+    def add_record_listener(self, listener):
+        """Add a function to be called with (stage, secs) for each stage timing recorded"""
+        self._record_listeners.append(listener)
+
+    @property
+    def stats(self):
+        """Returns a dict of pipeline statistics"""
+        return {
+            "depth"     : self._queue.qsize(),
+            "max_depth" : self._max_depth,
+            "submitted" : self._submitted,
+            "coalesced" : self._coalesced,
+            "dropped"   : self._dropped,
+            "executed"  : self._executed,
+            "stages"    : {name: stats.as_dict() for name, stats in self._stages.items()},
+        }
+
+    async def _run(self):
+        while True:
+            request, queued_at = await self._queue.get()
+            # Merge anything queued behind this request into the latest target
+            while not self._queue.empty():
+                request, _ = self._queue.get_nowait()
+                self._coalesced += 1
+            started_at = time.perf_counter()
+            self.record("queue", started_at - queued_at)
+            if self._is_noop(request):
+                self._dropped += 1
+                continue
+            try:
+                await self._execute(request)
+            except Exception:
+                logger.exception("Error executing request %s", request)
+            self._executed += 1
+            self.record("execute", time.perf_counter() - started_at)
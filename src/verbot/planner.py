@@ -0,0 +1,159 @@
+import math
+from verbot.calibration import Calibration
+from verbot.shared import State
+
+# Assumed switch-to-switch time (us) at full speed until the drum has been measured
+DEFAULT_STEP_US = 150000
+
+# Turns smaller than this are not worth making
+HEADING_TOLERANCE_DEG = 1.0
+
+class PlanStep():
+    """One timed action of a plan, with the drum interrogation needed before it can begin"""
+
+    def __init__(self, state: State, secs, interrogation_us, drum_steps):
+        """c'tor"""
+        self.state = state
+        self.secs = secs
+        self.interrogation_us = interrogation_us
+        self.drum_steps = drum_steps
+
+    def as_dict(self):
+        return {
+            "action"            : self.state.name.lower(),
+            "secs"              : self.secs,
+            "interrogation_secs": self.interrogation_us / 1000000,
+            "drum_steps"        : self.drum_steps,
+        }
+
+
+class Plan():
+    """A sequence of timed actions, with its predicted time to complete"""
+
+    def __init__(self, steps=()):
+        """c'tor"""
+        self.steps = list(steps)
+
+    @property
+    def predicted_secs(self):
+        return sum(step.secs + step.interrogation_us / 1000000 for step in self.steps)
+
+    @property
+    def drum_steps(self):
+        return sum(step.drum_steps for step in self.steps)
+
+    def as_dict(self):
+        return {
+            "steps"             : [step.as_dict() for step in self.steps],
+            "predicted_secs"    : self.predicted_secs,
+            "drum_steps"        : self.drum_steps,
+        }
+
+
+class MotionPlanner():
+    """
+    Turns goals into timed actions, choosing between equivalent motions by their total cost
+    in drum travel (interrogation) as well as motion.
+
+    Each action is only reachable by interrogating the drum forwards through the switches in order,
+    so e.g. FORWARDS -> REVERSE is one step whilst FORWARDS -> ROTATE_LEFT is almost a full revolution.
+    A long turn the 'wrong' way, or driving backwards, can therefore be quicker overall.
+    """
+
+    def __init__(self, switch_order, calibration: Calibration, fast_speed=100, approach_speed=50):
+        """
+        c'tor
+        switch_order - states in drum interrogation order
+        fast_speed, approach_speed - interrogation motor speeds (%) far from and on the final approach to the target switch
+        """
+        self._order = tuple(switch_order)
+        self._indices = {state: index for index, state in enumerate(self._order)}
+        self.calibration = calibration
+        self._fast_speed = fast_speed
+        self._approach_speed = approach_speed
+
+    def drum_steps(self, from_state, to_state, engaged=False):
+        """
+        Returns the number of switches the drum must advance from the switch for from_state to activate to_state.
+        engaged - True if from_state's gears are engaged (performing it or parked at it) so repeating it needs no travel.
+        An unknown (None) from_state is assumed to need a full revolution
+        """
+        if from_state == to_state and engaged:
+            return 0
+        if from_state not in self._indices:
+            return len(self._order)
+        return (self._indices[to_state] - self._indices[from_state] - 1) % len(self._order) + 1
+
+    def interrogation_us(self, steps, step_us=None):
+        """Returns the predicted time (us) to interrogate through steps switches, slowing for the last one"""
+        if steps == 0:
+            return 0
+        step_us = step_us or DEFAULT_STEP_US
+        return step_us * 100 * ((steps - 1) / self._fast_speed + 1 / self._approach_speed)
+
+    def plan(self, actions, drum_at=None, engaged=False, step_us=None):
+        """
+        Cost a sequence of (state, secs) actions from the drum position drum_at.
+        Returns a Plan
+        """
+        steps = []
+        for state, secs in actions:
+            drum_steps = self.drum_steps(drum_at, state, engaged)
+            steps.append(PlanStep(state, secs, self.interrogation_us(drum_steps, step_us), drum_steps))
+            drum_at = state
+            engaged = True  # Timed actions leave the drum parked at their switch
+        return Plan(steps)
+
+    def plan_heading(self, heading, target_heading, drum_at=None, engaged=False, step_us=None):
+        """
+        Returns the quickest Plan to turn from heading to target_heading (degrees, counter-clockwise +ve)
+        """
+        candidates = [
+            self.plan(rotation, drum_at, engaged, step_us)
+            for rotation in self._rotations(heading, target_heading)
+        ]
+        return min(candidates, key=lambda plan: plan.predicted_secs)
+
+    def plan_waypoints(self, pose, waypoints, drum_at=None, engaged=False, step_us=None):
+        """
+        Returns the quickest Plan to visit each (x, y) waypoint (mm) in turn from pose (x, y, heading).
+        Each leg may be driven forwards or in reverse, after turning either way,
+        so the best choice for one leg depends on the drum position left by the last
+        """
+        x, y, heading = pose
+        # Best plan so far for each (drum position, heading) reached
+        best = {(drum_at, heading) : (self.plan([], drum_at, engaged, step_us), [])}
+        for to_x, to_y in waypoints:
+            distance = math.hypot(to_x - x, to_y - y)
+            bearing = math.degrees(math.atan2(to_y - y, to_x - x)) % 360
+            reached = {}
+            for (leg_drum_at, leg_heading), (_, actions) in best.items():
+                for travel, facing in ((State.FORWARDS, bearing), (State.REVERSE, (bearing + 180) % 360)):
+                    rate = self.calibration.mm_per_sec(travel)
+                    if not rate:
+                        continue
+                    for rotation in self._rotations(leg_heading, facing):
+                        leg = actions + rotation + ([(travel, distance / rate)] if distance else [])
+                        plan = self.plan(leg, drum_at, engaged, step_us)
+                        key = (leg[-1][0] if leg else leg_drum_at, facing if rotation else leg_heading)
+                        if key not in reached or plan.predicted_secs < reached[key][0].predicted_secs:
+                            reached[key] = (plan, leg)
+            if not reached:
+                raise ValueError("Forwards/reverse are not calibrated")
+            best = reached
+            x, y = to_x, to_y
+        return min((plan for plan, _ in best.values()), key=lambda plan: plan.predicted_secs)
+
+    def _rotations(self, heading, target_heading):
+        """Returns the alternative (lists of) timed rotations turning from heading to target_heading"""
+        ccw = (target_heading - heading) % 360
+        if min(ccw, 360 - ccw) < HEADING_TOLERANCE_DEG:
+            return [[]]
+        rotations = []
+        for state, degrees in ((State.ROTATE_LEFT, ccw), (State.ROTATE_RIGHT, 360 - ccw)):
+            rate = self.calibration.degrees_per_sec(state)
+            if rate:
+                rotations.append([(state, degrees / rate)])
+        if not rotations:
+            raise ValueError("Rotations are not calibrated")
+        return rotations
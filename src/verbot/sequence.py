@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import time
+import verbot.drv_8835_driver as drv8835
+from verbot.calibration import Calibration
+from verbot.shared import State
+from verbot.utils import tickDiff
+
+logger = logging.getLogger(__name__)
+
+# Actions which may be sequenced, by name
+ACTION_NAMES = {
+    state.name.lower() : state for state in (
+        State.ROTATE_RIGHT, State.ROTATE_LEFT, State.FORWARDS, State.REVERSE, State.PUT_DOWN, State.PICK_UP, State.TALK
+    )
+}
+# Actions with limit switches in series, which stop themselves
+LIMITED_ACTIONS = (State.PICK_UP, State.PUT_DOWN)
+
+# Kinds of step
+STEP_TIMED  = "timed"   # Perform an action for a duration, stopped by pigpiod
+STEP_LIMIT  = "limit"   # Perform an action until its limit switch stops it
+STEP_WAIT   = "wait"    # Pause
+
+# Allowance for drum interrogation when timing out an action step
+DEFAULT_STEP_TIMEOUT = 10.0
+
+# Sequences available without being defined, e.g. for voice commands
+BUILTIN_SEQUENCES = {
+    "wave" : [
+        {"action" : "pick_up", "until" : "limit"},
+        {"action" : "put_down", "until" : "limit"},
+    ],
+    "dance" : [
+        {"action" : "rotate_left", "degrees" : 90},
+        {"action" : "rotate_right", "degrees" : 180},
+        {"action" : "rotate_left", "degrees" : 90},
+        {"action" : "forwards", "duration" : 1.0},
+        {"action" : "reverse", "duration" : 1.0},
+    ],
+}
+
+class RunSequence():
+    """Voice command (see assistant_commands.COMMANDS) to run a named sequence"""
+
+    def __init__(self, name):
+        """c'tor"""
+        self.name = name
+
+
+class SequenceStep():
+    """A validated step of a compiled sequence"""
+
+    def __init__(self, kind, state=None, secs=None, timeout=DEFAULT_STEP_TIMEOUT):
+        """c'tor"""
+        self.kind = kind
+        self.state = state
+        self.secs = secs
+        self.timeout = timeout
+
+    def as_dict(self):
+        return {
+            "kind"      : self.kind,
+            "action"    : None if self.state is None else self.state.name.lower(),
+            "secs"      : self.secs,
+            "timeout"   : self.timeout,
+        }
+
+
+class CompiledSequence():
+    """A named sequence of steps, validated and with angles converted to durations"""
+
+    def __init__(self, name, steps, source):
+        """c'tor"""
+        self.name = name
+        self.steps = tuple(steps)
+        self.source = source
+
+    def as_dict(self):
+        return {"name" : self.name, "steps" : [step.as_dict() for step in self.steps]}
+
+
+def compile_sequence(name, steps, calibration: Calibration) -> CompiledSequence:
+    """
+    Validate a list of step dicts and compile them, e.g.
+    [{"action": "rotate_left", "degrees": 90}, {"wait": 0.5}, {"action": "forwards", "duration": 2.5},
+     {"action": "pick_up", "until": "limit", "timeout": 8}]
+    Raises ValueError describing the first invalid step
+    """
+    if not isinstance(steps, (list, tuple)) or not steps:
+        raise ValueError("A sequence must be a non-empty list of steps")
+    compiled = []
+    for index, step in enumerate(steps):
+        try:
+            compiled.append(_compile_step(step, calibration))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError("Step {0} of sequence {1}: {2}".format(index, name, e))
+    return CompiledSequence(name, compiled, list(steps))
+
+def _compile_step(step, calibration):
+    if "wait" in step:
+        secs = float(step["wait"])
+        if secs < 0:
+            raise ValueError("wait must not be negative")
+        return SequenceStep(STEP_WAIT, secs=secs)
+    state = ACTION_NAMES.get(str(step.get("action")).lower())
+    if state is None:
+        raise ValueError("unknown action {0}".format(step.get("action")))
+    timeout = float(step.get("timeout", DEFAULT_STEP_TIMEOUT))
+    if step.get("until") == "limit":
+        if state not in LIMITED_ACTIONS:
+            raise ValueError("{0} has no limit switch".format(state.name.lower()))
+        return SequenceStep(STEP_LIMIT, state, timeout=timeout)
+    if "until" in step:
+        raise ValueError("unknown condition {0}".format(step["until"]))
+    if "degrees" in step:
+        secs = calibration.secs_for_degrees(state, float(step["degrees"]))
+    elif "duration" in step:
+        secs = float(step["duration"])
+    else:
+        raise ValueError("an action needs a duration, degrees or until")
+    if not 0 < secs <= drv8835.MAX_HOLD_MS / 1000:
+        raise ValueError("duration must be between 0 and {0} secs".format(drv8835.MAX_HOLD_MS // 1000))
+    return SequenceStep(STEP_TIMED, state, secs, timeout + secs)
+
+
+class SequenceLibrary():
+    """
+    Compiled sequences cached by name. Sequences are recompiled if the calibration changes
+    """
+
+    def __init__(self, calibration: Calibration):
+        """c'tor"""
+        self._calibration = calibration
+        self._sequences = {}
+        for name, steps in BUILTIN_SEQUENCES.items():
+            self.define(name, steps)
+
+    def define(self, name, steps) -> CompiledSequence:
+        """Compile and cache a sequence, replacing any of the same name. Raises ValueError if invalid"""
+        sequence = compile_sequence(name, steps, self._calibration)
+        self._sequences[name] = sequence
+        return sequence
+
+    def get(self, name) -> CompiledSequence:
+        """Returns a sequence by name. Raises KeyError if not defined"""
+        return self._sequences[name]
+
+    @property
+    def names(self):
+        return list(self._sequences)
+
+    def recompile(self, calibration: Calibration):
+        self._calibration = calibration
+        for name, sequence in list(self._sequences.items()):
+            try:
+                self.define(name, sequence.source)
+            except ValueError:
+                logger.warning("Sequence %s is invalid with the new calibration - removed", name, exc_info=True)
+                del self._sequences[name]
+
+
+class SequenceRun():
+    """Progress and per-step timing telemetry of one run of a sequence"""
+
+    def __init__(self, sequence: CompiledSequence):
+        """c'tor"""
+        self.sequence = sequence
+        self.status = "pending"
+        self.steps = []
+        self.total_secs = None
+        self.task = None
+
+    def record(self, step: SequenceStep, total_secs, action_secs=None):
+        self.steps.append({
+            "kind"          : step.kind,
+            "action"        : None if step.state is None else step.state.name.lower(),
+            "planned_secs"  : step.secs,
+            "action_secs"   : action_secs,
+            "total_secs"    : total_secs,
+        })
+
+    def as_dict(self):
+        return {
+            "name"          : self.sequence.name,
+            "status"        : self.status,
+            "steps"         : self.steps,
+            "total_secs"    : self.total_secs,
+        }
+
+
+class SequenceRunner():
+    """
+    Runs compiled sequences on the controller's loop, one at a time.
+    Each action step is requested as soon as the previous step has finished, and finishes
+    when the controller reports the end of the action (timed by pigpiod or stopped by its limit switch)
+    """
+
+    def __init__(self, controller):
+        """c'tor - controller is the verbot.control.Controller to run sequences on"""
+        self._controller = controller
+        self._current = None
+        self._last_runs = {}
+
+    def start(self, sequence: CompiledSequence) -> SequenceRun:
+        """Start running a sequence, cancelling any sequence already running"""
+        self.cancel()
+        run = SequenceRun(sequence)
+        self._current = run
+        self._last_runs[sequence.name] = run
+        run.task = asyncio.get_running_loop().create_task(self._run(run))
+        return run
+
+    def cancel(self):
+        """Cancel the running sequence, if any. The action in progress is left to finish"""
+        if self._current is not None:
+            self._current.task.cancel()
+            self._current = None
+
+    @property
+    def current(self) -> SequenceRun:
+        return self._current
+
+    @property
+    def last_runs(self):
+        """Returns a dict of sequence name to telemetry of its most recent run"""
+        return {name : run.as_dict() for name, run in self._last_runs.items()}
+
+    async def _run(self, run: SequenceRun):
+        run.status = "running"
+        started_at = time.perf_counter()
+        logger.info("Running sequence %s", run.sequence.name)
+        try:
+            for step in run.sequence.steps:
+                step_started_at = time.perf_counter()
+                action_secs = None
+                if step.kind == STEP_WAIT:
+                    await asyncio.sleep(step.secs)
+                else:
+                    action_secs = await asyncio.wait_for(self._perform(step), step.timeout)
+                run.record(step, time.perf_counter() - step_started_at, action_secs)
+            run.status = "completed"
+        except asyncio.CancelledError:
+            run.status = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Sequence %s timed out at step %s - stopping", run.sequence.name, len(run.steps))
+            run.status = "timed_out"
+            self._controller.desired_state = State.STOP
+        except Exception:
+            logger.exception("Error running sequence %s", run.sequence.name)
+            run.status = "failed"
+        finally:
+            run.total_secs = time.perf_counter() - started_at
+            if self._current is run:
+                self._current = None
+        logger.info("Sequence %s %s in %.3f secs", run.sequence.name, run.status, run.total_secs,
+            extra={"fields": {"steps": len(run.steps)}})
+
+    async def _perform(self, step: SequenceStep):
+        '''
+        Request a step's action and wait for it to begin & end.
+        Returns the time (secs) the action was performed for, measured by pigpio ticks
+        '''
+        loop = asyncio.get_running_loop()
+        begun = loop.create_future()
+        ended = loop.create_future()
+        def on_state(state):
+            if state == step.state and not begun.done():
+                begun.set_result(None)
+        def on_action(state, start_tick, end_tick):
+            # Ignore the end of an earlier run of the same action
+            if state == step.state and begun.done() and not ended.done():
+                ended.set_result(tickDiff(start_tick, end_tick) / 1000000)
+        self._controller.add_state_listener(on_state)
+        self._controller.add_action_listener(on_action)
+        try:
+            if step.kind == STEP_TIMED:
+                self._controller.perform(step.state, secs=step.secs)
+            else:
+                self._controller.desired_state = step.state
+            return await ended
+        finally:
+            self._controller.remove_state_listener(on_state)
+            self._controller.remove_action_listener(on_action)
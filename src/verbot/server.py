@@ -1,45 +1,118 @@
 import asyncio
+import inspect
+import json
+import logging
+import os
 import socket
-from aiohttp import web
+import tempfile
+import time
+from aiohttp import web, WSMsgType
 from jsonrpcserver import method as json_rpc_method, async_dispatch
 from zeroconf import IPVersion, ServiceInfo, Zeroconf
 from verbot.utils import getNetworkIp
-from verbot.control import State, Controller as Verbot
+from verbot.calibration import DEFAULT_CALIBRATION_PATH
+from verbot.control import State, Controller as Verbot, RequestSuperseded
+from verbot.shared import CLIENT_HEADER, SERVICE_TYPE
+from verbot.lease import LeaseBusy, LeaseManager, current_client
+from verbot import log
+from verbot import stream
+from verbot.teleop import DEFAULT_TELEOP_PORT, TeleopProtocol
+from verbot.timesync import ActionScheduler
+from jsonrpcserver.exceptions import ApiError, InvalidParamsError
+
+logger = logging.getLogger(__name__)
+
+# Application error codes for JSON-RPC ApiErrors
+ERROR_TIMEOUT       = 1
+ERROR_SUPERSEDED    = 2
+ERROR_ABORTED       = 3
+ERROR_BUSY          = 4
+
+# Actions of verbot_action, by name
+ACTIONS_STATES = {
+    "stop"          : State.STOP,
+    "forwards"      : State.FORWARDS,
+    "reverse"       : State.REVERSE,
+    "rotate_left"   : State.ROTATE_LEFT,
+    "rotate_right"  : State.ROTATE_RIGHT,
+    "pick_up"       : State.PICK_UP,
+    "put_down"      : State.PUT_DOWN,
+    "talk"          : State.TALK,
+    "assistant"     : State.ASSISTANT
+}
+
+# Hot control methods dispatched without jsonrpcserver's generic validation, see _fast_method()
+FAST_METHODS = {}
+
+# Modes for batches of requests, given as the 'batch' query parameter
+BATCH_SEQUENCE  = "sequence"    # Run in order, each action waiting for the last to complete. Stops at the first error
+BATCH_COALESCE  = "coalesce"    # Only the last action is acted upon
+BATCH_MODES     = (BATCH_SEQUENCE, BATCH_COALESCE)
+# Methods which request actions, and so are subject to batch modes
+ACTION_METHODS  = ("verbot_action", "verbot_action_wait")
+# How long each action of a sequence batch may take to be reached/completed
+BATCH_STEP_TIMEOUT = 30.0
+
+# Edge trace export formats, with their file extensions
+EDGE_TRACE_FORMATS = {"csv" : "csv", "binary" : "bin"}
 
 class Server:
 
-    def __init__(self, bind_addr=None, listen_port=8080, pigpiod_addr="127.0.0.1", pigpiod_port=8888):
+    def __init__(self, bind_addr=None, listen_port=8080, pigpiod_addr="127.0.0.1", pigpiod_port=8888, pi=None, assistant=True, pwm_mode=None,
+                 teleop_port=DEFAULT_TELEOP_PORT, calibration_path=DEFAULT_CALIBRATION_PATH):
         self._app = web.Application()
         self._bind_addr = bind_addr
         self._listen_port = listen_port
         self._app.router.add_post("/", self._handle_json_rpc_request)
-        self._verbot = Verbot(host=pigpiod_addr, port=pigpiod_port)
+        self._app.router.add_get("/ws", self._handle_websocket)
+        verbot_options = {} if pwm_mode is None else {"pwm_mode" : pwm_mode}
+        self._verbot = Verbot(host=pigpiod_addr, port=pigpiod_port, pi=pi, assistant=assistant, calibration_path=calibration_path,
+                              **verbot_options)
+        # False to send every request through jsonrpcserver, e.g. to benchmark the fast path
+        self.fast_path = True
+        self._leases = LeaseManager()
+        self._scheduler = ActionScheduler(self._verbot)
+        self._hub = stream.EventHub()
+        self._publish_controller_events()
+        # UDP teleop is served beside the HTTP app, on the same loop. None to disable
+        self._teleop_port = teleop_port
+        self._teleop = None
+        self._teleop_transport = None
+        if teleop_port is not None:
+            self._app.on_startup.append(self._start_teleop)
+            self._app.on_cleanup.append(self._stop_teleop)
 
     def start_server(self):
         """
         This is a synchronous function.
         It will run the asyncio event loop and not return until the loop is stopped
         """
-        # wait whilst we initialize verbot controller
+        started_at = time.perf_counter()
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self._verbot.init_io())
         # Set a signal handler to get a chance to shutdown gracefully
         self._app.on_shutdown.append(self._on_shutdown)
+        zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
+        properties = {'path' : '/verbot_control/'}
+        if self._teleop_port:
+            # Only advertised when teleop is enabled on a known port
+            properties['teleop_port'] = str(self._teleop_port)
         try:
             info = ServiceInfo(
-                    "_verbot._tcp.local.",
-                    "Verbot Control Server._verbot._tcp.local.",
+                    SERVICE_TYPE,
+                    "Verbot Control Server." + SERVICE_TYPE,
                     addresses=[socket.inet_aton(self._bind_addr)] if not self._bind_addr == None else None,
                     port=self._listen_port,
-                    properties={
-                        'path' : '/verbot_control/'
-                    },
+                    properties=properties,
                     server=getNetworkIp(),
                 )
-
-            zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
-            print("Registration of a service, press Ctrl-C to exit...")
-            zeroconf.register_service(info)
+            # Initialize the verbot controller whilst the (blocking) mDNS registration runs on a worker thread
+            logger.info("Registration of a service, press Ctrl-C to exit...")
+            loop.run_until_complete(asyncio.gather(
+                self.start_controller(),
+                loop.run_in_executor(None, zeroconf.register_service, info)
+            ))
+            logger.info("Ready in %.3f secs", time.perf_counter() - started_at,
+                extra={"fields": {"time_to_ready_ms": 1000 * (time.perf_counter() - started_at)}})
             web.run_app(self._app, host=self._bind_addr, port=self._listen_port)
             # web.run_app() runs the event loop indefinitely
         finally:
@@ -47,32 +120,509 @@ class Server:
             zeroconf.close()
  
     async def _handle_json_rpc_request(self, request):
-        request = await request.text()
+        # Clients without a CLIENT_HEADER are identified by their address
+        current_client.set(request.headers.get(CLIENT_HEADER) or request.remote)
+        body = await request.read()
+        batch_mode = request.query.get("batch")
+        if batch_mode is not None:
+            return await self._handle_batch(body, batch_mode)
+        return await self._dispatch(body)
+
+    async def _dispatch(self, body):
+        """Dispatch a JSON-RPC request body (bytes), by the fast path if possible"""
+        if self.fast_path:
+            fast = await self._dispatch_fast(body)
+            if fast is not None:
+                response, status = fast
+                return web.Response(text=json.dumps(response), status=status, content_type="application/json")
         # Because jsonrpcserver doesnt support instance methods as @json_rpc_method
         # we need to stash our instance 'self' as a context
-        response = await async_dispatch(request=request, context=self)
+        response = await async_dispatch(request=body.decode(), context=self)
         if response.wanted:
             return web.json_response(response.deserialized(), status=response.http_status)
         else:
             return web.Response(status=400) # Bad Request
 
-    async def _on_shutdown(self, app):
+    async def _dispatch_fast(self, body):
+        """
+        Dispatch a single request (str or bytes) for one of the FAST_METHODS with a minimal parse, bypassing jsonrpcserver.
+        Returns (response, HTTP status), or None for anything else (including anything invalid) to be dispatched in full
+        """
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return None
+        return await self._dispatch_fast_request(request)
+
+    async def _dispatch_fast_request(self, request):
+        """As _dispatch_fast(), for a request already parsed"""
+        try:
+            method, params_names, required = FAST_METHODS[request["method"]]
+            request_id = request["id"]
+            params = request.get("params", {})
+        except (ValueError, TypeError, KeyError):
+            return None
+        if request.get("jsonrpc") != "2.0" or not isinstance(params, dict) \
+                or not params.keys() <= params_names or not required <= params.keys():
+            return None
+        # Responses match jsonrpcserver's
+        try:
+            response = {"jsonrpc" : "2.0", "result" : await method(self, **params), "id" : request_id}
+            status = 200
+        except InvalidParamsError:
+            response = {"jsonrpc" : "2.0", "error" : {"code" : -32602, "message" : "Invalid parameters"}, "id" : request_id}
+            status = 400
+        except ApiError as e:
+            response = {"jsonrpc" : "2.0", "error" : {"code" : e.code, "message" : str(e)}, "id" : request_id}
+            status = 400
+        except Exception:
+            logger.exception("Error in %s", request["method"])
+            response = {"jsonrpc" : "2.0", "error" : {"code" : -32000, "message" : "Server error"}, "id" : request_id}
+            status = 500
+        return response, status
+
+    async def _handle_batch(self, body, mode):
+        """
+        Handle a batch of JSON-RPC requests in order, according to mode (see BATCH_MODES).
+        The whole batch is validated before anything is acted upon.
+        Returns one response: {"mode", "responses" : [JSON-RPC responses], "steps" : [per-step timing], "total_ms"}
+        """
+        started_at = time.perf_counter()
+        try:
+            if mode not in BATCH_MODES:
+                raise ValueError("Unknown batch mode {0}. Valid modes are {1}".format(mode, list(BATCH_MODES)))
+            steps = json.loads(body)
+            if isinstance(steps, dict):
+                steps = [steps]
+            _validate_batch(steps, mode)
+        except ValueError as e:
+            return web.json_response({"jsonrpc" : "2.0", "error" : {"code" : -32600, "message" : str(e)}, "id" : None}, status=400)
+        task = asyncio.get_running_loop().create_task(self._run_batch(steps, mode))
+        client = current_client.get()
+        if mode == BATCH_SEQUENCE and client is not None:
+            # A sequence may outlast a single lease, so control is held until it finishes
+            asyncio.get_running_loop().create_task(_hold_control(self, client, task))
+        responses, timings = await task
+        return web.json_response({
+            "mode"      : mode,
+            "responses" : responses,
+            "steps"     : timings,
+            "total_ms"  : 1000 * (time.perf_counter() - started_at),
+        })
+
+    async def _run_batch(self, steps, mode):
+        """Act upon a validated batch. Returns ([JSON-RPC responses], [per-step timing])"""
+        last_action = max((index for index, step in enumerate(steps) if step["method"] in ACTION_METHODS), default=None)
+        responses = []
+        timings = []
+        aborted_at = None
+        for index, step in enumerate(steps):
+            step_started_at = time.perf_counter()
+            if aborted_at is not None:
+                response = _error_response(step, ERROR_ABORTED, "Batch aborted at step {0}".format(aborted_at))
+                status = "aborted"
+            elif mode == BATCH_COALESCE and step["method"] in ACTION_METHODS and index != last_action:
+                response = {"jsonrpc" : "2.0", "result" : {"coalesced" : True}, "id" : step.get("id")}
+                status = "coalesced"
+            else:
+                if mode == BATCH_SEQUENCE and step["method"] in ACTION_METHODS:
+                    step = _wait_for_completion(self, step)
+                dispatched = await async_dispatch(request=json.dumps(step), context=self)
+                response = dispatched.deserialized() if dispatched.wanted else None
+                status = "ok" if response is None or "error" not in response else "error"
+                if status == "error" and mode == BATCH_SEQUENCE:
+                    aborted_at = index
+            if response is not None and "id" in step:
+                responses.append(response)
+            timings.append({"method" : step["method"], "id" : step.get("id"), "status" : status,
+                            "ms" : 1000 * (time.perf_counter() - step_started_at)})
+        return responses, timings
+
+    async def _handle_websocket(self, request):
+        """
+        Event stream & JSON-RPC over a single WebSocket.
+        Text messages are JSON-RPC requests, or {"subscribe": [topics]} to change the topics streamed.
+        Initial topics may be given as a query parameter, e.g. /ws?topics=state,edge
+        """
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        current_client.set(request.headers.get(CLIENT_HEADER) or request.remote)
+        topics = request.query.get("topics")
+        client = stream.StreamClient(ws.send_str)
+        self._hub.add_client(client)
+        try:
+            if topics:
+                self._hub.subscribe(client, topics.split(","))
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                await self._on_websocket_message(client, msg.data)
+        except ValueError as e:
+            await ws.close(message=str(e).encode())
+        finally:
+            self._hub.remove_client(client)
+        return ws
+
+    async def _on_websocket_message(self, client, data):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and "subscribe" in message and "method" not in message:
+            try:
+                self._hub.subscribe(client, message["subscribe"])
+                await client.reply(json.dumps({"subscribed" : sorted(client.topics)}))
+            except (TypeError, ValueError) as e:
+                await client.reply(json.dumps({"error" : str(e)}))
+            return
+        if self.fast_path and isinstance(message, dict):
+            fast = await self._dispatch_fast_request(message)
+            if fast is not None:
+                await client.reply(json.dumps(fast[0]))
+                return
+        response = await async_dispatch(request=data, context=self)
+        if response.wanted:
+            await client.reply(json.dumps(response.deserialized()))
+
+    def _publish_controller_events(self):
+        hub = self._hub
+        verbot = self._verbot
+        verbot.add_state_listener(lambda state: hub.publish(stream.TOPIC_STATE, {
+            "state" : state.name.lower(), "desired" : verbot.desired_state.name.lower()
+        }))
+        verbot.add_action_listener(lambda state, start_tick, end_tick: hub.publish(stream.TOPIC_ACTION, {
+            "action" : state.name.lower(), "start_tick" : start_tick, "end_tick" : end_tick
+        }))
+        def on_edge(gpio, level, tick):
+            if hub.wants(stream.TOPIC_EDGE):
+                hub.publish(stream.TOPIC_EDGE, {"gpio" : gpio, "level" : level, "tick" : tick})
+        verbot.add_edge_listener(on_edge)
+        verbot.add_assistant_listener(lambda name, args: hub.publish(stream.TOPIC_ASSISTANT, {"event" : name, "args" : args}))
+        verbot.add_metrics_listener(lambda stage, secs: hub.publish(stream.TOPIC_METRICS, {"stage" : stage, "ms" : secs * 1000}))
+
+    async def _start_teleop(self, app):
+        loop = asyncio.get_running_loop()
+        self._teleop_transport, self._teleop = await loop.create_datagram_endpoint(
+            lambda: TeleopProtocol(self._verbot, leases=self._leases),
+            local_addr=(self._bind_addr or "0.0.0.0", self._teleop_port)
+        )
+        logger.info("Teleop listening on UDP port %s", self._teleop_transport.get_extra_info("sockname")[1])
+
+    async def _stop_teleop(self, app):
+        if self._teleop_transport is not None:
+            self._teleop_transport.close()
+
+    async def start_controller(self):
+        """Connect to pigpiod and initialise the controller, without serving HTTP (see start_server())"""
+        await self._verbot.init_io()
+
+    async def stop_controller(self):
+        self._hub.close()
         await self._verbot.cleanup()
+
+    async def _on_shutdown(self, app):
+        await self.stop_controller()
     
+def _fast_method(function):
+    """Decorator adding a @json_rpc_method to FAST_METHODS, with its parameter names precomputed"""
+    params = list(inspect.signature(function).parameters.values())[1:]  # All but server
+    FAST_METHODS[function.__name__] = (
+        function,
+        frozenset(param.name for param in params),
+        frozenset(param.name for param in params if param.default is inspect.Parameter.empty),
+    )
+    return function
+
+def _action_state(action):
+    """Returns the State requested by an action name, or None if it isn't a valid action"""
+    state = State.__members__.get(str(action).upper())
+    return None if state == State.INTERROGATE else state
+
+def _take_control(server, ttl=None):
+    """
+    Acquire or renew the current client's control lease. Raises ApiError if another client has control.
+    The holder and time until the lease expires are given in the error's message, as jsonrpcserver only sends data when debugging
+    """
+    try:
+        server._leases.acquire(ttl=ttl)
+    except LeaseBusy as e:
+        raise ApiError(str(e), code=ERROR_BUSY)
+
+async def _hold_control(server, client, task):
+    """Keep renewing client's control lease until task is done, e.g. a sequence which may outlast a single lease"""
+    while not task.done():
+        try:
+            expires_in = server._leases.acquire(client)
+        except LeaseBusy:
+            return
+        await asyncio.wait([task], timeout=expires_in / 2)
+
+def _validate_batch(steps, mode):
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("A batch must be a non-empty list of requests")
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict) or not isinstance(step.get("method"), str):
+            raise ValueError("Step {0} is not a JSON-RPC request".format(index))
+        params = step.get("params", {})
+        if step["method"] not in ACTION_METHODS:
+            continue
+        state = _action_state(params.get("action")) if isinstance(params, dict) else None
+        # Sequence steps are run by verbot_action_wait, which has no assistant action
+        if state is None or (mode == BATCH_SEQUENCE and state == State.ASSISTANT):
+            raise ValueError("Step {0} has no valid action".format(index))
+
+def _wait_for_completion(server, step):
+    """
+    Rewrite an action request so that it returns once the action has been reached, or for timed actions and
+    arm actions (which run to their limit switch) completed. Timed actions may take their duration on top of the timeout
+    """
+    params = dict(step.get("params", {}))
+    state = _action_state(params["action"])
+    timed = params.get("duration") is not None or params.get("degrees") is not None
+    params.setdefault("timeout", BATCH_STEP_TIMEOUT + _action_secs(server, state, params))
+    params.setdefault("until_end", timed or state in (State.PICK_UP, State.PUT_DOWN))
+    return dict(step, method="verbot_action_wait", params=params)
+
+def _action_secs(server, state, params):
+    """Returns the duration of a timed action request, or 0 if it is untimed or invalid (which verbot_action_wait rejects)"""
+    try:
+        if params.get("duration") is not None:
+            return max(0.0, float(params["duration"]))
+        if params.get("degrees") is not None:
+            return server._verbot.calibration.secs_for_degrees(state, float(params["degrees"]))
+    except (TypeError, ValueError):
+        pass
+    return 0.0
+
+def _error_response(step, code, message):
+    return {"jsonrpc" : "2.0", "error" : {"code" : code, "message" : message}, "id" : step.get("id")}
+
+@_fast_method
 @json_rpc_method
-async def verbot_action(server, action):
-    ACTIONS_STATES={
-        "stop"          : State.STOP,
-        "forwards"      : State.FORWARDS,
-        "reverse"       : State.REVERSE,
-        "rotate_left"   : State.ROTATE_LEFT,
-        "rotate_right"  : State.ROTATE_RIGHT,
-        "pick_up"       : State.PICK_UP,
-        "put_down"      : State.PUT_DOWN,
-        "talk"          : State.TALK,
-        "assistant"     : State.ASSISTANT
-    }
+async def verbot_action(server, action, duration=None, degrees=None):
     new_state = ACTIONS_STATES.get(action)
-    if not new_state == None:
+    if new_state == None:
+        return
+    if new_state != State.STOP:
+        _take_control(server)
+    if duration is None and degrees is None:
         server._verbot.desired_state = new_state
+        return
+    # Timed action. The stop is made by pigpiod, so the client needn't send one
+    try:
+        secs = server._verbot.perform(new_state, secs=duration, degrees=degrees)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    return {"duration" : secs}
+
+@_fast_method
+@json_rpc_method
+async def verbot_stop(server):
+    latency = await server._verbot.emergency_stop()
+    return {"latency_ms" : latency * 1000}
+
+@json_rpc_method
+async def verbot_stats(server):
+    return {
+        "state"     : server._verbot.current_state.name.lower(),
+        "desired"   : server._verbot.desired_state.name.lower(),
+        "pipeline"  : server._verbot.pipeline_stats,
+        "motor_pwm" : server._verbot.motor_pwm_info,
+        "stream"    : server._hub.stats,
+        "teleop"    : None if server._teleop is None else server._teleop.stats,
+        "lease"     : server._leases.stats,
+    }
+
+@json_rpc_method
+async def verbot_edge_trace(server, last=100, gpio=None):
+    if not isinstance(last, int) or isinstance(last, bool) or last < 0:
+        raise InvalidParamsError("last must be a non-negative integer")
+    trace = server._verbot.edge_trace
+    return {
+        "recorded"  : trace.recorded,
+        "capacity"  : trace.capacity,
+        "events"    : [
+            {"gpio" : g, "level" : l, "tick" : t, "state" : s.name}
+            for g, l, t, s in trace.events(last=last, gpio=gpio)
+        ]
+    }
+
+@json_rpc_method
+async def verbot_edge_trace_export(server, format="csv"):
+    extension = EDGE_TRACE_FORMATS.get(format)
+    if extension is None:
+        raise InvalidParamsError("Unknown format {0}. Valid formats are {1}".format(format, list(EDGE_TRACE_FORMATS)))
+    # Written on a worker thread from a copy, as recording continues meanwhile
+    trace = server._verbot.edge_trace.copy()
+    export = trace.export_csv if format == "csv" else trace.export_binary
+    def write():
+        # Traces are only ever written to the temp directory, never to a client supplied path.
+        # mkstemp() makes the name unique, so exports never overwrite each other
+        fd, path = tempfile.mkstemp(prefix="verbot_edges_{0}_".format(int(time.time())), suffix="." + extension)
+        os.close(fd)
+        return path, export(path)
+    path, count = await asyncio.get_running_loop().run_in_executor(None, write)
+    return {"path" : path, "events" : count}
+
+@json_rpc_method
+async def verbot_log_levels(server):
+    return log.get_levels()
+
+@json_rpc_method
+async def verbot_set_log_level(server, subsystem, level):
+    try:
+        log.set_level(subsystem, level)
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+    return log.get_levels()
+
+@json_rpc_method
+async def verbot_pose(server):
+    return server._verbot.pose
+
+@json_rpc_method
+async def verbot_pose_reset(server, x=0.0, y=0.0, heading=0.0):
+    server._verbot.reset_pose(x, y, heading)
+    return server._verbot.pose
+
+@json_rpc_method
+async def verbot_calibration(server):
+    return server._verbot.calibration.as_dict()
+
+@json_rpc_method
+async def verbot_set_calibration(server, action, degrees_per_sec=None, mm_per_sec=None):
+    state = State.__members__.get(str(action).upper())
+    if state is None:
+        raise InvalidParamsError("Unknown action {0}".format(action))
+    try:
+        await server._verbot.set_calibration(state, degrees_per_sec=degrees_per_sec, mm_per_sec=mm_per_sec)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    return server._verbot.calibration.as_dict()
+
+@json_rpc_method
+async def verbot_plan(server, heading=None, waypoints=None):
+    if (heading is None) == (waypoints is None):
+        raise InvalidParamsError("Give a heading or waypoints")
+    try:
+        if heading is not None:
+            plan = server._verbot.plan_heading(float(heading))
+        else:
+            plan = server._verbot.plan_waypoints([(float(x), float(y)) for x, y in waypoints])
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    return plan.as_dict()
+
+@json_rpc_method
+async def verbot_sequence_define(server, name, steps):
+    try:
+        sequence = server._verbot.define_sequence(name, steps)
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+    return sequence.as_dict()
 
+@json_rpc_method
+async def verbot_sequence_run(server, name, wait=False):
+    _take_control(server)
+    try:
+        run = server._verbot.run_sequence(name)
+    except ValueError as e:
+        raise InvalidParamsError(str(e))
+    client = current_client.get()
+    if client is not None:
+        asyncio.get_running_loop().create_task(_hold_control(server, client, run.task))
+    if wait:
+        # Unlike awaiting the task, a client disconnecting doesn't cancel the sequence
+        await asyncio.wait([run.task])
+    return run.as_dict()
+
+@json_rpc_method
+async def verbot_sequence_cancel(server):
+    server._verbot.cancel_sequence()
+
+@json_rpc_method
+async def verbot_sequences(server):
+    return server._verbot.sequences
+
+@json_rpc_method
+async def verbot_arms(server, percent=None):
+    if percent is not None:
+        _take_control(server)
+        try:
+            move = server._verbot.move_arms(float(percent))
+        except (TypeError, ValueError) as e:
+            raise InvalidParamsError(str(e))
+        result = server._verbot.arms
+        result["move"] = None if move is None else {"action" : move[0].name.lower(), "duration" : move[1]}
+        return result
+    return server._verbot.arms
+
+@json_rpc_method
+async def verbot_action_wait(server, action, timeout=10.0, duration=None, degrees=None, until_end=False):
+    state = _action_state(action)
+    if state is None or state == State.ASSISTANT:
+        raise InvalidParamsError("Unknown action {0}".format(action))
+    if state != State.STOP:
+        _take_control(server)
+    try:
+        future = server._verbot.request(state, timeout=timeout, secs=duration, degrees=degrees, until_end=until_end)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    try:
+        secs = await future
+    except asyncio.TimeoutError:
+        raise ApiError("Timed out waiting for {0}".format(action), code=ERROR_TIMEOUT)
+    except RequestSuperseded as e:
+        raise ApiError(str(e), code=ERROR_SUPERSEDED)
+    return {"state" : server._verbot.current_state.name.lower(), "latency_ms" : secs * 1000}
+
+@json_rpc_method
+async def verbot_lease(server):
+    return server._leases.as_dict()
+
+@json_rpc_method
+async def verbot_lease_acquire(server, ttl=None):
+    try:
+        _take_control(server, ttl)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    return server._leases.as_dict()
+
+@json_rpc_method
+async def verbot_lease_release(server):
+    server._leases.release()
+    return server._leases.as_dict()
+
+@_fast_method
+@json_rpc_method
+async def verbot_time(server):
+    """
+    Timestamps for clock synchronisation (see timesync.ClockEstimate), all from the loop's monotonic clock:
+    when the request was received and answered, and pigpio's tick with when it was read
+    """
+    loop = asyncio.get_running_loop()
+    received = loop.time()
+    tick = await server._verbot.get_current_tick()
+    tick_at = (received + loop.time()) / 2
+    return {"received" : received, "tick" : tick, "tick_at" : tick_at, "sent" : loop.time()}
+
+@json_rpc_method
+async def verbot_action_at(server, action, at, duration=None, degrees=None):
+    state = _action_state(action)
+    if state is None or state == State.ASSISTANT:
+        raise InvalidParamsError("Unknown action {0}".format(action))
+    if state != State.STOP:
+        _take_control(server)
+    try:
+        scheduled = server._scheduler.schedule(state, float(at), secs=duration, degrees=degrees)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamsError(str(e))
+    return {"id" : scheduled.id, "scheduled_in" : scheduled.at - asyncio.get_running_loop().time()}
+
+@json_rpc_method
+async def verbot_scheduled(server):
+    return server._scheduler.actions
+
+@json_rpc_method
+async def verbot_schedule_cancel(server, id=None):
+    return {"cancelled" : server._scheduler.cancel(id)}
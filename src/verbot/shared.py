@@ -13,3 +13,9 @@ class State(Enum):
     TALK            = 8
     ASSISTANT       = 9
 
+
+# zeroconf service type advertised by the control server
+SERVICE_TYPE = "_verbot._tcp.local."
+
+# HTTP header identifying a client to the control server, e.g. for control leases
+CLIENT_HEADER = "X-Verbot-Client"
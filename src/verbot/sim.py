@@ -0,0 +1,548 @@
+import asyncio
+import heapq
+import math
+import random
+import apigpio
+from apigpio.apigpio import ApigpioError
+import verbot.drv_8835_driver as drv8835
+
+# Action switch GPIO pins in interrogation order (see README 'Switching Key')
+SWITCH_PINS     = (22, 26, 10, 9, 25, 11, 8, 7)
+PUT_DOWN_PIN    = 11
+PICK_UP_PIN     = 8
+ASSISTANT_PIN   = 16
+
+# Gearbox timings, all at 100% motor speed
+DRUM_STEP_US    = 150000    # Drum rotation time between adjacent switches
+ARM_TRAVEL_US   = 1800000   # Arm travel time between limit switches
+CAM_DWELL       = 0.4       # Fraction of the distance between switches for which each cam holds its switch closed
+
+# Contact bounce generated on every switch transition
+BOUNCE_MAX      = 3         # Maximum number of extra level changes
+BOUNCE_US       = (50, 800) # Range of intervals between bounces
+
+# Frequencies available to pigpio DMA sampled PWM at the default 5us sample rate
+PWM_FREQUENCIES = (8000, 4000, 2000, 1600, 1000, 800, 500, 400, 320, 250, 200, 160, 100, 80, 50, 40, 20, 10)
+
+# Number of times the loop is yielded to after each batch of callbacks, letting the controller react
+SETTLE_YIELDS   = 20
+
+class VirtualClock():
+    """
+    A microsecond clock that only advances when told to, so simulations are deterministic
+    """
+
+    def __init__(self, start_us=0):
+        """c'tor"""
+        self._now_us = start_us
+
+    @property
+    def now_us(self) -> int:
+        """Returns the current virtual time (us)"""
+        return self._now_us
+
+    @property
+    def tick(self) -> int:
+        """Returns the current virtual time as a (wrapping 32 bit) pigpio tick"""
+        return self._now_us & 0xFFFFFFFF
+
+    def advance_to(self, now_us):
+        if now_us > self._now_us:
+            self._now_us = now_us
+
+
+# Number of operands taken by each supported pigpio script command
+SCRIPT_COMMANDS = {
+    "TAG" : 1, "JMP" : 1, "JZ" : 1, "JNZ" : 1, "JM" : 1, "JP" : 1, "HALT" : 0,
+    "LD" : 2, "LDA" : 1, "STA" : 1, "ADD" : 1, "SUB" : 1, "CMP" : 1,
+    "MILS" : 1, "MICS" : 1, "TICK" : 0,
+    "M" : 2, "PUD" : 2, "FG" : 2, "R" : 1, "W" : 2, "PWM" : 2, "HP" : 3, "GDC" : 1,
+}
+
+# Maximum commands executed between delays before a script is considered stuck
+SCRIPT_STEP_LIMIT = 100000
+
+class _SimScript():
+    """A stored pigpio script, parsed into (command, operands) steps"""
+
+    def __init__(self, text):
+        tokens = text.decode() if isinstance(text, bytes) else text
+        tokens = tokens.split()
+        self.steps = []
+        self.tags = {}
+        while tokens:
+            command = tokens.pop(0).upper()
+            argc = SCRIPT_COMMANDS.get(command)
+            if argc is None or len(tokens) < argc:
+                raise ValueError("Unsupported pigpio script command {0}".format(command))
+            operands = [tokens.pop(0) for _ in range(argc)]
+            if command == "TAG":
+                self.tags[int(operands[0])] = len(self.steps)
+            else:
+                self.steps.append((command, operands))
+        self.status = apigpio.PI_SCRIPT_HALTED
+        self.params = [0] * 10
+        self.run_id = 0
+
+
+class _SimCallback():
+    """Stand-in for apigpio.Callback"""
+
+    def __init__(self, pi, gpio, edge, func):
+        self._pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        self._pi._callbacks.remove(self)
+
+
+class SimulatedPi():
+    """
+    In-process stand-in for apigpio.Pi simulating a Verbot gearbox wired to a Raspberry Pi.
+
+    Models the drum with 8 cams driving the action switches in interrogation order whilst the motor runs CCW,
+    the clutch holding the drum still whilst the motor runs CW to perform the selected action,
+    and the PICK_UP/PUT_DOWN limit switches in series with their action switches.
+    Switch transitions bounce, and are reported to callbacks with virtual pigpio ticks honouring any glitch filter.
+
+    Time only passes when run_for() or run_until() is awaited, so runs are deterministic and faster than real time.
+    """
+
+    def __init__(self, clock=None, seed=0, drum_position=0.0, arm_position=0.5, bounce=True):
+        """
+        c'tor
+        drum_position - initial drum position in switch steps. e.g. 0.0 has the STOP switch closed
+        arm_position - initial arm position, 0.0 (fully down) to 1.0 (fully up)
+        """
+        self.clock = clock or VirtualClock()
+        self._random = random.Random(seed)
+        self._bounce = bounce
+        self._events = []           # heap of (time_us, seq, fn, args)
+        self._event_seq = 0
+        self._callbacks = []
+        self._modes = {}
+        self._pulls = {}
+        self._glitch_filters = {}
+        self._written = {}          # levels written to output pins
+        self._switch_levels = {}    # physical switch pin levels
+        self._raw_levels = {}       # switch pin levels including bounce
+        self._reported_levels = {}  # switch pin levels as last reported to callbacks
+        self._pending_levels = {}   # gpio -> time_us a raw level change awaits the glitch filter
+        self._pwm_ranges = {}
+        self._pwm_frequencies = {}
+        self._pwm_duties = {}
+        self._hw_pwm = {}           # gpio -> (frequency, duty) of hardware PWM
+        self._scripts = {}
+        self._physics_us = self.clock.now_us
+        self.drum_position = drum_position % len(SWITCH_PINS)
+        self.arm_position = arm_position
+        self.action_us = {}         # gpio of engaged action switch -> total us its action has run
+        self.commands = {}          # pigpio command name -> count
+        for gpio in SWITCH_PINS:
+            level = self._switch_level(gpio)
+            self._switch_levels[gpio] = level
+            self._raw_levels[gpio] = level
+            self._reported_levels[gpio] = level
+        self._raw_levels[ASSISTANT_PIN] = apigpio.HIGH
+        self._reported_levels[ASSISTANT_PIN] = apigpio.HIGH
+
+    # ---- apigpio.Pi API ----
+
+    async def connect(self, address):
+        self._count("connect")
+
+    async def stop(self):
+        self._count("stop")
+
+    async def set_mode(self, gpio, mode):
+        self._count("set_mode")
+        self._modes[gpio] = mode
+        return 0
+
+    async def get_mode(self, gpio):
+        self._count("get_mode")
+        return self._modes.get(gpio, apigpio.INPUT)
+
+    async def set_pull_up_down(self, gpio, pud):
+        self._count("set_pull_up_down")
+        self._pulls[gpio] = pud
+        return 0
+
+    async def set_glitch_filter(self, user_gpio, steady):
+        self._count("set_glitch_filter")
+        self._glitch_filters[user_gpio] = steady
+        return 0
+
+    async def add_callback(self, user_gpio, edge=apigpio.RISING_EDGE, func=None):
+        self._count("add_callback")
+        cb = _SimCallback(self, user_gpio, edge, func)
+        self._callbacks.append(cb)
+        return cb
+
+    async def read(self, gpio):
+        self._count("read")
+        return self._level(gpio)
+
+    async def read_bank_1(self):
+        self._count("read_bank_1")
+        bits = 0
+        for gpio in set(self._raw_levels) | set(self._written):
+            if self._level(gpio):
+                bits |= 1 << gpio
+        return bits
+
+    async def write(self, gpio, level):
+        self._count("write")
+        self._update_physics()
+        self._written[gpio] = level
+        return 0
+
+    async def get_current_tick(self):
+        self._count("get_current_tick")
+        return self.clock.tick
+
+    async def set_PWM_range(self, user_gpio, range_):
+        self._count("set_PWM_range")
+        self._pwm_ranges[user_gpio] = range_
+        return range_
+
+    async def get_PWM_real_range(self, user_gpio):
+        self._count("get_PWM_real_range")
+        return 1000000 // (self._pwm_frequencies.get(user_gpio, 800) * 5)
+
+    async def set_PWM_frequency(self, user_gpio, frequency):
+        self._count("set_PWM_frequency")
+        nearest = min(PWM_FREQUENCIES, key=lambda f: abs(f - frequency))
+        self._pwm_frequencies[user_gpio] = nearest
+        return nearest
+
+    async def get_PWM_frequency(self, user_gpio):
+        self._count("get_PWM_frequency")
+        if user_gpio in self._hw_pwm:
+            return self._hw_pwm[user_gpio][0]
+        return self._pwm_frequencies.get(user_gpio, 800)
+
+    async def hardware_PWM(self, gpio, PWMfreq, PWMduty):
+        self._count("hardware_PWM")
+        self._update_physics()
+        self._hw_pwm[gpio] = (PWMfreq, PWMduty)
+        return 0
+
+    async def set_PWM_dutycycle(self, user_gpio, dutycycle):
+        self._count("set_PWM_dutycycle")
+        self._update_physics()
+        self._pwm_duties[user_gpio] = dutycycle
+        return 0
+
+    async def get_PWM_dutycycle(self, user_gpio):
+        self._count("get_PWM_dutycycle")
+        return self._duty(user_gpio)
+
+    async def store_script(self, script):
+        self._count("store_script")
+        script_id = max(self._scripts, default=-1) + 1
+        try:
+            self._scripts[script_id] = _SimScript(script)
+        except ValueError as e:
+            # As pigpiod rejects a bad script
+            raise ApigpioError(str(e))
+        return script_id
+
+    async def run_script(self, script_id, params=None):
+        self._count("run_script")
+        script = self._scripts[script_id]
+        script.run_id += 1
+        script.params = (list(params or []) + [0] * 10)[:10]
+        script.status = apigpio.PI_SCRIPT_RUNNING
+        script.vars = {}
+        script.a = 0
+        script.f = 0
+        self._update_physics()
+        self._execute_script(script, 0, script.run_id)
+        return 0
+
+    async def script_status(self, script_id):
+        self._count("script_status")
+        script = self._scripts[script_id]
+        return script.status, tuple(script.params)
+
+    async def stop_script(self, script_id):
+        self._count("stop_script")
+        script = self._scripts[script_id]
+        script.run_id += 1
+        script.status = apigpio.PI_SCRIPT_HALTED
+        return 0
+
+    async def delete_script(self, script_id):
+        self._count("delete_script")
+        del self._scripts[script_id]
+        return 0
+
+    # ---- Simulation control ----
+
+    @property
+    def motor_speed(self) -> float:
+        """Returns the motor speed (%). +ve is CCW (interrogation), -ve is CW (action)"""
+        if drv8835.MOTOR_PWM_PIN in self._hw_pwm:
+            pwm_range = drv8835.HW_PWM_RANGE
+        else:
+            pwm_range = self._pwm_ranges.get(drv8835.MOTOR_PWM_PIN, 255)
+        speed = 100 * self._duty(drv8835.MOTOR_PWM_PIN) / pwm_range
+        return -speed if self._written.get(drv8835.MOTOR_DIR_PIN) else speed
+
+    @property
+    def engaged_switch(self):
+        """Returns the gpio of the switch selected by the drum cams, or None if between switches"""
+        index = round(self.drum_position) % len(SWITCH_PINS)
+        if abs(self.drum_position - round(self.drum_position)) < CAM_DWELL / 2:
+            return SWITCH_PINS[index]
+        return None
+
+    def press_button(self, gpio=ASSISTANT_PIN, duration_us=100000):
+        """Simulate a press & release of a (bounceless) button"""
+        self._schedule(self.clock.now_us, self._on_raw_level, gpio, apigpio.LOW)
+        self._schedule(self.clock.now_us + duration_us, self._on_raw_level, gpio, apigpio.HIGH)
+
+    def advance(self, us):
+        """Advance virtual time by us, delivering callbacks synchronously"""
+        until_us = self.clock.now_us + us
+        while self._step(until_us):
+            pass
+
+    async def run_for(self, secs):
+        """Advance virtual time by secs, letting the event loop react to each callback as it is delivered"""
+        until_us = self.clock.now_us + int(secs * 1000000)
+        await self.settle()
+        while self._step(until_us):
+            await self.settle()
+
+    async def run_until(self, predicate, timeout=60.0):
+        """Advance virtual time until predicate() returns True. Returns False on (virtual) timeout"""
+        until_us = self.clock.now_us + int(timeout * 1000000)
+        await self.settle()
+        while not predicate():
+            if not self._step(until_us):
+                return predicate()
+            await self.settle()
+        return True
+
+    async def settle(self):
+        """Yield to the event loop so tasks scheduled by callbacks can run"""
+        for _ in range(SETTLE_YIELDS):
+            await asyncio.sleep(0)
+
+    # ---- Internals ----
+
+    def _count(self, command):
+        self.commands[command] = self.commands.get(command, 0) + 1
+
+    def _level(self, gpio):
+        if gpio in self._written:
+            return self._written[gpio]
+        return self._raw_levels.get(gpio, apigpio.HIGH if self._pulls.get(gpio) == apigpio.PUD_UP else apigpio.LOW)
+
+    def _execute_script(self, script, pc, run_id):
+        """Run a script from step pc until it halts or delays. Delays resume in virtual time"""
+        if script.run_id != run_id:
+            return  # Stopped or restarted since the delay began
+        def value(operand):
+            if operand[0] in "pP":
+                return script.params[int(operand[1:])]
+            if operand[0] in "vV":
+                return script.vars.get(int(operand[1:]), 0)
+            return int(operand)
+        def store(operand, v):
+            if operand[0] in "pP":
+                script.params[int(operand[1:])] = v
+            else:
+                script.vars[int(operand[1:])] = v
+        for _ in range(SCRIPT_STEP_LIMIT):
+            if pc >= len(script.steps):
+                script.status = apigpio.PI_SCRIPT_HALTED
+                return
+            command, operands = script.steps[pc]
+            pc += 1
+            if command == "HALT":
+                pc = len(script.steps)
+            elif command == "JMP":
+                pc = script.tags[int(operands[0])]
+            elif command in ("JZ", "JNZ", "JM", "JP"):
+                jump = {"JZ" : script.f == 0, "JNZ" : script.f != 0, "JM" : script.f < 0, "JP" : script.f >= 0}[command]
+                if jump:
+                    pc = script.tags[int(operands[0])]
+            elif command == "LD":
+                store(operands[0], value(operands[1]))
+            elif command == "LDA":
+                script.a = script.f = value(operands[0])
+            elif command == "STA":
+                store(operands[0], script.a)
+            elif command == "ADD":
+                script.a += value(operands[0])
+                script.f = script.a
+            elif command == "SUB":
+                script.a -= value(operands[0])
+                script.f = script.a
+            elif command == "CMP":
+                script.f = script.a - value(operands[0])
+            elif command in ("MILS", "MICS"):
+                delay_us = value(operands[0]) * (1000 if command == "MILS" else 1)
+                self._schedule(self.clock.now_us + delay_us, self._execute_script, script, pc, run_id)
+                return
+            elif command == "TICK":
+                script.a = self.clock.tick
+            elif command == "M":
+                self._modes[value(operands[0])] = apigpio.OUTPUT if operands[1].lower() == "w" else apigpio.INPUT
+            elif command == "PUD":
+                self._pulls[value(operands[0])] = {"u" : apigpio.PUD_UP, "d" : apigpio.PUD_DOWN}.get(operands[1].lower(), apigpio.PUD_OFF)
+            elif command == "FG":
+                self._glitch_filters[value(operands[0])] = value(operands[1])
+            elif command == "R":
+                script.a = self._level(value(operands[0]))
+            elif command == "W":
+                self._written[value(operands[0])] = value(operands[1])
+            elif command == "PWM":
+                self._pwm_duties[value(operands[0])] = value(operands[1])
+            elif command == "HP":
+                self._hw_pwm[value(operands[0])] = (value(operands[1]), value(operands[2]))
+            elif command == "GDC":
+                script.a = self._duty(value(operands[0]))
+        script.status = apigpio.PI_SCRIPT_FAILED
+
+    def _duty(self, gpio):
+        if gpio in self._hw_pwm:
+            return self._hw_pwm[gpio][1]
+        return self._pwm_duties.get(gpio, 0)
+
+    def _schedule(self, at_us, fn, *args):
+        self._event_seq += 1
+        heapq.heappush(self._events, (at_us, self._event_seq, fn, args))
+
+    def _step(self, until_us):
+        """
+        Advance to the next event or physical switch transition, not beyond until_us.
+        Returns False once until_us has been reached
+        """
+        now_us = self.clock.now_us
+        if now_us >= until_us:
+            return False
+        next_us = until_us
+        physics_us = self._next_transition_us()
+        if physics_us is not None:
+            next_us = min(next_us, physics_us)
+        if self._events:
+            next_us = min(next_us, self._events[0][0])
+        self.clock.advance_to(next_us)
+        self._update_physics()
+        while self._events and self._events[0][0] <= self.clock.now_us:
+            _, _, fn, args = heapq.heappop(self._events)
+            fn(*args)
+        return True
+
+    def _drum_rate(self):
+        """Drum speed in switch steps per us"""
+        speed = self.motor_speed
+        return speed / (100 * DRUM_STEP_US) if speed > 0 else 0.0
+
+    def _arm_rate(self):
+        """Arm speed in full travels per us, +ve is raising"""
+        speed = self.motor_speed
+        if speed >= 0:
+            return 0.0
+        engaged = self.engaged_switch
+        if engaged == PICK_UP_PIN and self.arm_position < 1.0:
+            return -speed / (100 * ARM_TRAVEL_US)
+        if engaged == PUT_DOWN_PIN and self.arm_position > 0.0:
+            return speed / (100 * ARM_TRAVEL_US)
+        return 0.0
+
+    def _next_transition_us(self):
+        """Returns the virtual time of the next physical switch transition, or None if nothing is moving"""
+        candidates = []
+        drum_rate = self._drum_rate()
+        if drum_rate > 0:
+            position = self.drum_position
+            offset = position - math.floor(position)
+            # Cam boundaries lie either side of each whole switch position
+            boundaries = (CAM_DWELL / 2, 1 - CAM_DWELL / 2, 1 + CAM_DWELL / 2)
+            distance = min(b - offset for b in boundaries if b - offset > 1e-9)
+            candidates.append(distance / drum_rate)
+        arm_rate = self._arm_rate()
+        if arm_rate > 0:
+            candidates.append((1.0 - self.arm_position) / arm_rate)
+        elif arm_rate < 0:
+            candidates.append(self.arm_position / -arm_rate)
+        if not candidates:
+            return None
+        return self._physics_us + max(1, math.ceil(min(candidates)))
+
+    def _update_physics(self):
+        """Move the mechanism on to the current virtual time and raise any resulting switch transitions"""
+        elapsed_us = self.clock.now_us - self._physics_us
+        if elapsed_us <= 0:
+            return
+        self._physics_us = self.clock.now_us
+        drum_rate = self._drum_rate()
+        if drum_rate > 0:
+            self.drum_position = (self.drum_position + drum_rate * elapsed_us) % len(SWITCH_PINS)
+        elif self.motor_speed < 0:
+            engaged = self.engaged_switch
+            if engaged is not None:
+                self.action_us[engaged] = self.action_us.get(engaged, 0) + elapsed_us
+            self.arm_position = min(1.0, max(0.0, self.arm_position + self._arm_rate() * elapsed_us))
+        for gpio in SWITCH_PINS:
+            level = self._switch_level(gpio)
+            if level != self._switch_levels[gpio]:
+                self._switch_levels[gpio] = level
+                self._on_switch_transition(gpio, level)
+
+    def _switch_level(self, gpio):
+        """Physical level of a switch pin. Pulled HIGH, LOW whilst the cam and any series limit switch are closed"""
+        if gpio != self.engaged_switch:
+            return apigpio.HIGH
+        if gpio == PICK_UP_PIN and self.arm_position >= 1.0:
+            return apigpio.HIGH
+        if gpio == PUT_DOWN_PIN and self.arm_position <= 0.0:
+            return apigpio.HIGH
+        return apigpio.LOW
+
+    def _on_switch_transition(self, gpio, level):
+        now_us = self.clock.now_us
+        self._on_raw_level(gpio, level)
+        if self._bounce:
+            # Contacts chatter before settling at the new level
+            at_us = now_us
+            for _ in range(self._random.randint(0, BOUNCE_MAX)):
+                at_us += self._random.randint(*BOUNCE_US)
+                self._schedule(at_us, self._on_raw_level, gpio, 1 - level)
+                at_us += self._random.randint(*BOUNCE_US)
+                self._schedule(at_us, self._on_raw_level, gpio, level)
+
+    def _on_raw_level(self, gpio, level):
+        if self._raw_levels.get(gpio) == level:
+            return
+        self._raw_levels[gpio] = level
+        steady = self._glitch_filters.get(gpio, 0)
+        if steady:
+            # The level must be steady for the glitch filter period before it is reported, stamped with the original tick
+            self._pending_levels[gpio] = self.clock.now_us
+            self._schedule(self.clock.now_us + steady, self._on_glitch_filter_expired, gpio, level, self.clock.now_us)
+        else:
+            self._report(gpio, level, self.clock.now_us)
+
+    def _on_glitch_filter_expired(self, gpio, level, changed_us):
+        if self._pending_levels.get(gpio) == changed_us and self._raw_levels[gpio] == level:
+            del self._pending_levels[gpio]
+            self._report(gpio, level, changed_us)
+
+    def _report(self, gpio, level, at_us):
+        if self._reported_levels.get(gpio) == level:
+            return
+        self._reported_levels[gpio] = level
+        tick = at_us & 0xFFFFFFFF
+        for cb in list(self._callbacks):
+            if cb.gpio != gpio:
+                continue
+            if cb.edge == apigpio.EITHER_EDGE or (cb.edge == apigpio.RISING_EDGE) == (level == apigpio.HIGH):
+                cb.func(gpio, level, tick)
@@ -0,0 +1,162 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Topics of events published to stream clients
+TOPIC_STATE     = "state"       # Controller state transitions
+TOPIC_ACTION    = "action"      # Completed actions, with their pigpio tick timing
+TOPIC_EDGE      = "edge"        # GPIO edge events
+TOPIC_ASSISTANT = "assistant"   # Voice assistant events
+TOPIC_METRICS   = "metrics"     # Action pipeline stage latencies
+TOPICS = (TOPIC_STATE, TOPIC_ACTION, TOPIC_EDGE, TOPIC_ASSISTANT, TOPIC_METRICS)
+
+# Edge events are high volume, so are only sent to clients that ask for them
+DEFAULT_TOPICS = frozenset(TOPICS) - {TOPIC_EDGE}
+
+# Frames buffered per client. The oldest are dropped when a client can't keep up
+DEFAULT_CLIENT_BUFFER = 64
+# Replies buffered per client. Further replies wait for the client to read
+DEFAULT_REPLY_BUFFER = 16
+
+class StreamClient():
+    """
+    One subscriber to the event stream, e.g. a WebSocket.
+
+    Event frames are buffered in a bounded deque and written by a sender task, so a slow
+    client never blocks publishers or grows memory: once the buffer is full the oldest
+    frames are dropped, and the client is told how many before the next frame is sent.
+    Replies (e.g. to JSON-RPC requests) are never dropped and are sent ahead of events.
+    Instead, once the reply buffer is full, reply() waits until the client reads, so
+    a client that sends requests without reading the replies stops being read from.
+    """
+
+    def __init__(self, send, topics=DEFAULT_TOPICS, buffer=DEFAULT_CLIENT_BUFFER, reply_buffer=DEFAULT_REPLY_BUFFER):
+        """
+        c'tor
+        send - coroutine function taking a str, which writes a frame to the client
+        """
+        self._send = send
+        self.topics = frozenset(topics)
+        self._frames = collections.deque(maxlen=buffer)
+        self._replies = collections.deque()
+        self._reply_buffer = reply_buffer
+        self._reply_space = asyncio.Event()
+        self._reply_space.set()
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._dropped = 0       # Frames dropped since the client was last told
+        self.dropped = 0        # Total frames dropped
+        self.sent = 0
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def push(self, frame):
+        if len(self._frames) == self._frames.maxlen:
+            self._dropped += 1
+            self.dropped += 1
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    async def reply(self, frame):
+        """Queue a reply, waiting whilst the reply buffer is full. Dropped once the client is closed"""
+        while len(self._replies) >= self._reply_buffer and not self._closed:
+            self._reply_space.clear()
+            await self._reply_space.wait()
+        if self._closed:
+            return
+        self._replies.append(frame)
+        self._wakeup.set()
+
+    def close(self):
+        self._closed = True
+        self._reply_space.set()
+        self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._replies or self._frames:
+                    if self._replies:
+                        frame = self._replies.popleft()
+                        self._reply_space.set()
+                    elif self._dropped:
+                        frame = json.dumps({"topic" : "dropped", "data" : {"count" : self._dropped}})
+                        self._dropped = 0
+                    else:
+                        frame = self._frames.popleft()
+                    await self._send(frame)
+                    self.sent += 1
+        except Exception:
+            logger.debug("Stream client send failed", exc_info=True)
+        finally:
+            # Nothing more will be sent, so nothing should wait to be
+            self._closed = True
+            self._reply_space.set()
+
+
+class EventHub():
+    """
+    Fans out controller events to stream clients according to their topic subscriptions.
+    Each event is serialised once, however many clients receive it
+    """
+
+    def __init__(self):
+        """c'tor"""
+        self._clients = set()
+        self._subscribers = {topic : 0 for topic in TOPICS}
+        self._published = 0
+
+    def add_client(self, client: StreamClient):
+        self._clients.add(client)
+        self._count(client.topics, 1)
+
+    def remove_client(self, client: StreamClient):
+        if client in self._clients:
+            self._clients.discard(client)
+            self._count(client.topics, -1)
+        client.close()
+
+    def subscribe(self, client: StreamClient, topics):
+        """Replace a client's subscriptions. Raises ValueError for unknown topics"""
+        topics = frozenset(topics)
+        unknown = topics - set(TOPICS)
+        if unknown:
+            raise ValueError("Unknown topics {0}. Valid topics are {1}".format(sorted(unknown), list(TOPICS)))
+        self._count(client.topics, -1)
+        client.topics = topics
+        self._count(topics, 1)
+
+    def wants(self, topic):
+        """Returns True if any client is subscribed to topic. Check before building expensive events"""
+        return self._subscribers[topic] > 0
+
+    def publish(self, topic, data):
+        if not self._subscribers[topic]:
+            return
+        frame = json.dumps({"topic" : topic, "time" : time.time(), "data" : data}, default=str)
+        self._published += 1
+        for client in self._clients:
+            if topic in client.topics:
+                client.push(frame)
+
+    def close(self):
+        for client in list(self._clients):
+            self.remove_client(client)
+
+    @property
+    def stats(self):
+        return {
+            "clients"       : len(self._clients),
+            "published"     : self._published,
+            "dropped"       : sum(client.dropped for client in self._clients),
+            "subscribers"   : dict(self._subscribers),
+        }
+
+    def _count(self, topics, delta):
+        for topic in topics:
+            self._subscribers[topic] += delta
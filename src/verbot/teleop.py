@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import struct
+from verbot.lease import LeaseBusy
+from verbot.shared import State
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TELEOP_PORT = 8089
+
+# Command datagram: sequence number, action (State value, 0 for a heartbeat), duration (ms, 0 until the next command)
+COMMAND = struct.Struct("!IBH")
+# Reply datagram: sequence number of the command, current State value
+REPLY = struct.Struct("!IB")
+
+HEARTBEAT = State.INTERROGATE.value
+
+# The robot is stopped if no datagram arrives for this long whilst it is moving under teleop
+HEARTBEAT_TIMEOUT = 0.5
+
+ACTIONS = {state.value : state for state in State if state not in (State.INTERROGATE, State.ASSISTANT)}
+
+class TeleopProtocol(asyncio.DatagramProtocol):
+    """
+    Compact binary datagram protocol for joystick-style driving.
+
+    Each datagram is parsed with a single struct unpack and acted upon directly, without
+    HTTP or JSON-RPC. Datagrams older than the newest seen from a sender are discarded,
+    so reordering on the network can't replay stale commands. While the robot is
+    moving under teleop the client must keep sending (heartbeats if nothing else),
+    otherwise the robot is emergency stopped.
+    """
+
+    def __init__(self, controller, heartbeat_timeout=HEARTBEAT_TIMEOUT, leases=None):
+        """
+        c'tor
+        controller - the verbot.control.Controller to drive
+        leases - optional verbot.lease.LeaseManager arbitrating control with other clients
+        """
+        self._controller = controller
+        self._leases = leases
+        self._heartbeat_timeout = heartbeat_timeout
+        self._transport = None
+        self._last_seq = {}         # Sender address to newest sequence number
+        self._driver = None         # Address of the sender whose untimed action may be running
+        self._last_received_at = 0  # Time the last datagram from the driver was accepted
+        self._moving = False        # True whilst an untimed action requested by teleop may be running
+        self._watchdog = None
+        self._received = 0
+        self._accepted = 0
+        self._out_of_order = 0
+        self._invalid = 0
+        self._busy = 0
+        self._failsafe_stops = 0
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+
+    def datagram_received(self, data, addr):
+        self._received += 1
+        try:
+            seq, action, duration_ms = COMMAND.unpack(data)
+        except struct.error:
+            self._invalid += 1
+            return
+        last_seq = self._last_seq.get(addr)
+        if last_seq is not None and not 0 < (seq - last_seq) & 0xFFFFFFFF < 0x80000000:
+            self._out_of_order += 1
+            return
+        self._last_seq[addr] = seq
+        if self._leases is not None and action != State.STOP.value and (action != HEARTBEAT or self._moving):
+            # Actions (and heartbeats whilst moving) take or renew control. Stopping is always allowed
+            try:
+                self._leases.acquire("udp:{0}:{1}".format(*addr))
+            except LeaseBusy:
+                self._busy += 1
+                return
+        if action != HEARTBEAT:
+            state = ACTIONS.get(action)
+            if state is None:
+                self._invalid += 1
+                return
+            try:
+                self._act(state, duration_ms, addr)
+            except ValueError:
+                self._invalid += 1
+                return
+        if self._moving and addr == self._driver:
+            # Only the driver's own datagrams keep the robot moving, once accepted
+            self._last_received_at = asyncio.get_running_loop().time()
+        self._accepted += 1
+        self._transport.sendto(REPLY.pack(seq, self._controller.current_state.value), addr)
+
+    def _act(self, state: State, duration_ms, addr):
+        if state == State.STOP:
+            self._moving = False
+            self._driver = None
+            asyncio.create_task(self._controller.emergency_stop())
+        elif duration_ms:
+            # Stopped by pigpiod after the duration, whether or not any more datagrams arrive
+            self._controller.perform(state, secs=duration_ms / 1000)
+            self._moving = False
+            self._driver = None
+        else:
+            self._controller.desired_state = state
+            self._moving = True
+            self._driver = addr
+            self._arm_watchdog()
+
+    def _arm_watchdog(self):
+        if self._watchdog is None:
+            self._watchdog = asyncio.get_running_loop().call_later(self._heartbeat_timeout, self._check_heartbeat)
+
+    def _check_heartbeat(self):
+        self._watchdog = None
+        if not self._moving:
+            return
+        loop = asyncio.get_running_loop()
+        silent_for = loop.time() - self._last_received_at
+        if silent_for < self._heartbeat_timeout:
+            self._watchdog = loop.call_at(self._last_received_at + self._heartbeat_timeout, self._check_heartbeat)
+            return
+        logger.warning("Teleop heartbeat from %s lost for %.3f secs - stopping", self._driver, silent_for)
+        self._moving = False
+        self._driver = None
+        self._failsafe_stops += 1
+        asyncio.create_task(self._controller.emergency_stop())
+
+    @property
+    def stats(self):
+        return {
+            "received"          : self._received,
+            "accepted"          : self._accepted,
+            "out_of_order"      : self._out_of_order,
+            "invalid"           : self._invalid,
+            "busy"              : self._busy,
+            "failsafe_stops"    : self._failsafe_stops,
+        }
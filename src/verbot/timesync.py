@@ -0,0 +1,237 @@
+import asyncio
+import collections
+import itertools
+import logging
+from verbot.shared import State
+
+logger = logging.getLogger(__name__)
+
+# Clock samples kept for estimating offset & drift
+DEFAULT_CLOCK_SAMPLES = 64
+# Drift isn't estimated from samples spanning less than this (secs), as it would be lost in network jitter
+MIN_DRIFT_SPAN = 10.0
+
+# Actions may be scheduled at most this far (secs) ahead
+MAX_SCHEDULE_AHEAD = 3600.0
+# Scheduled actions remembered for reporting
+DEFAULT_SCHEDULE_HISTORY = 64
+
+# Status of a scheduled action
+SCHEDULED   = "scheduled"
+FIRED       = "fired"       # Requested of the controller
+BEGUN       = "begun"       # The controller has begun the action
+CANCELLED   = "cancelled"
+FAILED      = "failed"
+
+def _fit(points):
+    """Returns the least squares (slope, intercept) of a list of (x, y) points"""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    if not sxx:
+        return 0.0, mean_y
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+    return slope, mean_y - slope * mean_x
+
+
+class ClockEstimate():
+    """
+    NTP-style estimate of a remote clock relative to a local one, e.g. a robot's monotonic clock
+    relative to a fleet gateway's, from request/response timestamps.
+
+    Each exchange gives an offset, good to within half its round trip delay. The offset is taken from
+    the quickest exchanges, which are least disturbed by queueing, and the drift between the clocks
+    is fitted to them once they span long enough for it to be measurable.
+    The remote's pigpio tick clock is tracked too, as ticks (us) against its monotonic clock
+    """
+
+    def __init__(self, max_samples=DEFAULT_CLOCK_SAMPLES):
+        """c'tor"""
+        self._samples = collections.deque(maxlen=max_samples)     # (local time, offset, delay)
+        self._ticks = collections.deque(maxlen=max_samples)       # (remote time, unwrapped tick)
+        self._fitted = None
+
+    def add(self, t0, t1, t2, t3, tick=None, tick_at=None):
+        """
+        Add an exchange: request sent at local time t0, received at remote time t1,
+        answered at remote time t2, answer received at local time t3.
+        Optionally the remote's pigpio tick, read at remote time tick_at
+        """
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self._samples.append(((t0 + t3) / 2, offset, delay))
+        if tick is not None:
+            if self._ticks:
+                _, last_tick = self._ticks[-1]
+                # Ticks wrap at 32 bits (every ~72 minutes)
+                tick = last_tick + ((tick - last_tick) & 0xFFFFFFFF)
+            self._ticks.append((tick_at, tick))
+        self._fitted = None
+
+    @property
+    def samples(self):
+        return len(self._samples)
+
+    @property
+    def delay(self):
+        """Returns the quickest round trip (secs), or None before any exchanges"""
+        return min(delay for _, _, delay in self._samples) if self._samples else None
+
+    @property
+    def drift(self):
+        """Returns the rate (secs/sec) at which the remote clock gains on the local one"""
+        return self._fit()[0]
+
+    def offset_at(self, local_time):
+        """Returns the remote clock minus the local clock at local_time"""
+        drift, offset = self._fit()
+        return offset + drift * local_time
+
+    def to_remote(self, local_time):
+        return local_time + self.offset_at(local_time)
+
+    def to_local(self, remote_time):
+        # The offset changes too slowly with drift for the difference between the clocks to matter
+        return remote_time - self.offset_at(remote_time)
+
+    @property
+    def tick_drift(self):
+        """Returns the rate (secs/sec) at which the remote's pigpio tick clock gains on its monotonic clock, or None"""
+        if len(self._ticks) < 2 or self._ticks[-1][0] - self._ticks[0][0] < MIN_DRIFT_SPAN:
+            return None
+        rate, _ = _fit([(at, tick / 1000000) for at, tick in self._ticks])
+        return rate - 1.0
+
+    def as_dict(self):
+        if not self._samples:
+            return {"samples" : 0}
+        tick_drift = self.tick_drift
+        return {
+            "samples"           : len(self._samples),
+            "offset_secs"       : self.offset_at(self._samples[-1][0]),
+            "error_ms"          : 1000 * self.delay / 2,
+            "drift_ppm"         : 1000000 * self.drift,
+            "tick_drift_ppm"    : None if tick_drift is None else 1000000 * tick_drift,
+        }
+
+    def _fit(self):
+        """Returns (drift, offset at local time 0) fitted to the quickest exchanges"""
+        if self._fitted is None:
+            quickest = sorted(self._samples, key=lambda sample: sample[2])[:max(1, len(self._samples) // 2)]
+            span = max(at for at, _, _ in quickest) - min(at for at, _, _ in quickest)
+            if len(quickest) < 2 or span < MIN_DRIFT_SPAN:
+                # Too soon to tell drift from jitter - use the quickest exchange's offset
+                _, offset, _ = quickest[0]
+                self._fitted = (0.0, offset)
+            else:
+                self._fitted = _fit([(at, offset) for at, offset, _ in quickest])
+        return self._fitted
+
+
+class ScheduledAction():
+    """An action to be requested at a given (monotonic) time, with how closely it was achieved"""
+
+    def __init__(self, id, state: State, at, secs=None, degrees=None):
+        """c'tor"""
+        self.id = id
+        self.state = state
+        self.at = at
+        self.secs = secs
+        self.degrees = degrees
+        self.status = SCHEDULED
+        self.fired_at = None
+        self.begun_at = None
+        self.error = None
+        self.handle = None
+
+    def as_dict(self):
+        return {
+            "id"            : self.id,
+            "action"        : self.state.name.lower(),
+            "at"            : self.at,
+            "status"        : self.status,
+            "fired_at"      : self.fired_at,
+            "begun_at"      : self.begun_at,
+            "late_ms"       : None if self.fired_at is None else 1000 * (self.fired_at - self.at),
+            "begin_late_ms" : None if self.begun_at is None else 1000 * (self.begun_at - self.at),
+            "error"         : self.error,
+        }
+
+
+class ActionScheduler():
+    """
+    Requests actions of the controller at given times of the event loop's (monotonic) clock,
+    so several robots with synchronised clocks can start moving together. The time each action was
+    requested (fired) and begun by the controller is recorded, to report the skew achieved.
+
+    An action begins as soon as it is requested only if the drum is already at its switch,
+    e.g. parked there by an earlier timed run of the same action. Otherwise drum interrogation delays it
+    """
+
+    def __init__(self, controller, history=DEFAULT_SCHEDULE_HISTORY):
+        """c'tor - controller is the verbot.control.Controller to act on"""
+        self._controller = controller
+        self._actions = collections.OrderedDict()
+        self._history = history
+        self._ids = itertools.count(1)
+        controller.add_state_listener(self._on_state)
+        # An emergency stop abandons everything still to come
+        controller.add_stop_listener(self.cancel)
+
+    def schedule(self, state: State, at, secs=None, degrees=None) -> ScheduledAction:
+        """
+        Schedule an action at loop time at, for a duration (secs) or angle (degrees) if given.
+        Raises ValueError if at is too far ahead, or the history is full of actions still scheduled
+        """
+        loop = asyncio.get_running_loop()
+        if at - loop.time() > MAX_SCHEDULE_AHEAD:
+            raise ValueError("Actions can be scheduled at most {0} secs ahead".format(MAX_SCHEDULE_AHEAD))
+        if sum(1 for action in self._actions.values() if action.status == SCHEDULED) >= self._history:
+            raise ValueError("At most {0} actions can be scheduled at once".format(self._history))
+        action = ScheduledAction(next(self._ids), state, at, secs, degrees)
+        # A time already past fires as soon as possible, and is reported as late
+        action.handle = loop.call_at(at, self._fire, action)
+        self._actions[action.id] = action
+        # Only the oldest finished actions are forgotten, so every action still scheduled can be cancelled
+        finished = [id for id, action in self._actions.items() if action.status != SCHEDULED]
+        for id in finished[:max(0, len(self._actions) - self._history)]:
+            del self._actions[id]
+        return action
+
+    def cancel(self, id=None):
+        """Cancel a scheduled action by id, or all of them. Returns the number cancelled"""
+        cancelled = 0
+        for action in self._actions.values():
+            if action.status == SCHEDULED and (id is None or action.id == id):
+                action.handle.cancel()
+                action.status = CANCELLED
+                cancelled += 1
+        return cancelled
+
+    @property
+    def actions(self):
+        """Returns the scheduled actions, most recent last"""
+        return [action.as_dict() for action in self._actions.values()]
+
+    def _fire(self, action: ScheduledAction):
+        action.fired_at = asyncio.get_running_loop().time()
+        try:
+            if action.secs is None and action.degrees is None:
+                self._controller.desired_state = action.state
+            else:
+                self._controller.perform(action.state, secs=action.secs, degrees=action.degrees)
+        except ValueError as e:
+            action.status = FAILED
+            action.error = str(e)
+            return
+        action.status = FIRED
+        if self._controller.current_state == action.state and action.secs is None and action.degrees is None:
+            # Already being performed, so nothing more to do
+            self._on_state(action.state)
+
+    def _on_state(self, state: State):
+        for action in self._actions.values():
+            if action.status == FIRED and action.state == state:
+                action.status = BEGUN
+                action.begun_at = asyncio.get_running_loop().time()
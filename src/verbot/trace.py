@@ -0,0 +1,118 @@
+import struct
+from array import array
+from verbot.shared import State
+
+# Number of edge events retained
+DEFAULT_CAPACITY = 4096
+
+# Binary trace file layout: header followed by records in chronological order
+BINARY_MAGIC    = b"VBTR"
+BINARY_VERSION  = 1
+BINARY_HEADER   = struct.Struct("<4sHI")    # magic, version, record count
+BINARY_RECORD   = struct.Struct("<IBBB")    # tick, gpio, level, controller state
+
+class EdgeTrace():
+    """
+    Fixed size ring buffer of GPIO edge events.
+
+    Events are held in preallocated typed arrays so recording an edge
+    allocates no objects and does no formatting or I/O. The oldest events
+    are overwritten once the buffer is full.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """c'tor"""
+        self._capacity = capacity
+        self._ticks = array("L", bytes(array("L").itemsize * capacity))
+        self._gpios = array("B", bytes(capacity))
+        self._levels = array("B", bytes(capacity))
+        self._states = array("B", bytes(capacity))
+        self._recorded = 0  # Total number of events ever recorded
+
+    def record(self, gpio, level, tick, state: State):
+        """Record an edge event, with the controller state at the time it arrived"""
+        index = self._recorded % self._capacity
+        self._ticks[index] = tick
+        self._gpios[index] = gpio
+        self._levels[index] = level
+        self._states[index] = state.value
+        self._recorded += 1
+
+    def clear(self):
+        self._recorded = 0
+
+    def copy(self):
+        """Returns a copy of the trace, e.g. to export on another thread whilst recording continues"""
+        trace = EdgeTrace(0)
+        trace._capacity = self._capacity
+        trace._ticks = array("L", self._ticks)
+        trace._gpios = array("B", self._gpios)
+        trace._levels = array("B", self._levels)
+        trace._states = array("B", self._states)
+        trace._recorded = self._recorded
+        return trace
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def recorded(self):
+        """Returns the total number of events recorded, including those since overwritten"""
+        return self._recorded
+
+    def __len__(self):
+        return min(self._recorded, self._capacity)
+
+    def _indices(self, last=None):
+        """Returns buffer indices of the retained (or last n) events in chronological order"""
+        count = len(self)
+        if last is not None:
+            count = min(count, last)
+        first = self._recorded - count
+        return [i % self._capacity for i in range(first, self._recorded)]
+
+    def events(self, last=None, gpio=None):
+        """
+        Returns a list of (gpio, level, tick, state) tuples in chronological order,
+        optionally only the last n events and/or only those for one gpio
+        """
+        if gpio is None:
+            # Only the last n events need be read
+            return [self._event(i) for i in self._indices(last)]
+        events = [self._event(i) for i in self._indices() if self._gpios[i] == gpio]
+        return events if last is None else events[-last:] if last else []
+
+    def _event(self, i):
+        return (self._gpios[i], self._levels[i], self._ticks[i], State(self._states[i]))
+
+    def export_csv(self, path):
+        """Write the retained events to a CSV file. Returns the number of events written"""
+        indices = self._indices()
+        with open(path, "w") as f:
+            f.write("tick,gpio,level,state\n")
+            for i in indices:
+                f.write("{0},{1},{2},{3}\n".format(self._ticks[i], self._gpios[i], self._levels[i], State(self._states[i]).name))
+        return len(indices)
+
+    def export_binary(self, path):
+        """Write the retained events to a binary trace file. Returns the number of events written"""
+        indices = self._indices()
+        with open(path, "wb") as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(indices)))
+            for i in indices:
+                f.write(BINARY_RECORD.pack(self._ticks[i], self._gpios[i], self._levels[i], self._states[i]))
+        return len(indices)
+
+
+def read_binary(path):
+    """Read a binary trace file, returning a list of (gpio, level, tick, state) tuples"""
+    with open(path, "rb") as f:
+        magic, version, count = BINARY_HEADER.unpack(f.read(BINARY_HEADER.size))
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("{0} is not a version {1} Verbot edge trace".format(path, BINARY_VERSION))
+        events = []
+        for _ in range(count):
+            tick, gpio, level, state = BINARY_RECORD.unpack(f.read(BINARY_RECORD.size))
+            events.append((gpio, level, tick, State(state)))
+    return events
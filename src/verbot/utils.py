@@ -1,6 +1,9 @@
+import asyncio
 import functools
 import socket
 
+import apigpio
+
 def getNetworkIp():
      s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
      s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
@@ -68,3 +71,42 @@ def Debounce(threshold=100, print_status=True):
             return functools.partial(self, instance)
 
     return _decorated
+
+
+def tickDiff(start_tick, end_tick):
+    """
+    Returns the number of microseconds between two pigpio ticks,
+    allowing for the tick counter wrapping around at 32 bits
+    """
+    return (end_tick - start_tick) & 0xFFFFFFFF
+
+
+async def waitForScript(pi, script_id, timeout=1.0, poll_interval=0.002):
+    """
+    Wait until a stored pigpio script is neither initialising nor running.
+    Returns the final status, or raises asyncio.TimeoutError
+    """
+    async def poll():
+        while True:
+            status, _ = await pi.script_status(script_id)
+            if status not in (apigpio.PI_SCRIPT_INITING, apigpio.PI_SCRIPT_RUNNING, apigpio.PI_SCRIPT_WAITING):
+                return status
+            await asyncio.sleep(poll_interval)
+    return await asyncio.wait_for(poll(), timeout)
+
+
+async def runScript(pi, script, params=None, timeout=1.0):
+    """
+    Store, run to completion and delete a one-off pigpio script, so a batch of
+    commands costs a handful of round trips to pigpiod rather than one each.
+    Raises RuntimeError if the script fails
+    """
+    script_id = await pi.store_script(script)
+    try:
+        await waitForScript(pi, script_id, timeout)
+        await pi.run_script(script_id, params)
+        status = await waitForScript(pi, script_id, timeout)
+        if status == apigpio.PI_SCRIPT_FAILED:
+            raise RuntimeError("pigpio script failed: {0}".format(script))
+    finally:
+        await pi.delete_script(script_id)
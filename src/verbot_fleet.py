@@ -0,0 +1,36 @@
+"""
+Gateway to a fleet of Verbots, e.g.
+
+python verbot_fleet.py --local left=192.168.1.20 --local right=192.168.1.21:8888 --remote big=http://verbot.local:8080/
+"""
+import argparse
+from verbot.fleet import FleetServer, DEFAULT_FLEET_PORT
+from verbot.log import start_logging, stop_logging
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--local", action="append", default=[], metavar="NAME=HOST[:PORT]",
+        help="a robot driven from this process via its pigpiod")
+    parser.add_argument("--remote", action="append", default=[], metavar="NAME=URL",
+        help="a robot served by a verbot_pi server")
+    parser.add_argument("--bind", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_FLEET_PORT, help="port to listen on")
+    args = parser.parse_args()
+
+    start_logging()
+    try:
+        fleet = FleetServer(bind_addr=args.bind, listen_port=args.port)
+        for robot in args.local:
+            name, _, address = robot.partition("=")
+            host, _, port = address.partition(":")
+            fleet.add_local(name, pigpiod_addr=host, pigpiod_port=int(port or 8888))
+        for robot in args.remote:
+            name, _, url = robot.partition("=")
+            fleet.add_remote(name, url)
+        fleet.start_server()
+    finally:
+        stop_logging()
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -1,8 +1,13 @@
 from verbot.server import Server as VerbotServer
+from verbot.log import start_logging, stop_logging
 
 def main():
-    server = VerbotServer(pigpiod_addr="127.0.0.1")
-    server.start_server()
+    start_logging()
+    try:
+        server = VerbotServer(pigpiod_addr="127.0.0.1")
+        server.start_server()
+    finally:
+        stop_logging()
 
 if __name__ == "__main__":
     # execute only if run as a script
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from verbot.control import Controller
+from verbot.sim import SimulatedPi
+
+# Scripts run by hand against a robot, rather than tests
+collect_ignore = ["verbot_server_test.py", "verbot_benchmark.py"]
+
+
+async def _sim_controller(seed=0, **kwargs):
+    sim = SimulatedPi(seed=seed)
+    controller = Controller(pi=sim, assistant=False, calibration_path=None, **kwargs)
+    await controller.init_io()
+    return sim, controller
+
+
+async def _run_sim_until(sim, predicate, timeout=5.0):
+    """
+    Advance the simulation until predicate() returns True, or raise on (wall clock) timeout.
+    Unlike SimulatedPi.run_until() this keeps time passing whilst the controller polls pigpiod
+    """
+    give_up_at = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > give_up_at:
+            raise AssertionError("Timed out")
+        await sim.run_for(0.01)
+        await asyncio.sleep(0.001)
+
+
+@pytest.fixture
+def sim_controller():
+    """Coroutine function returning (SimulatedPi, Controller) with the controller initialised against the simulation"""
+    return _sim_controller
+
+
+@pytest.fixture
+def run_sim_until():
+    """Coroutine function to advance a SimulatedPi until a predicate is met"""
+    return _run_sim_until
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from verbot.arms import ArmModel
+from verbot.shared import State
+from verbot.sim import ARM_TRAVEL_US
+
+SEC = 1000000
+
+
+def _calibrated_arms():
+    """Arms moved up to the limit from an unknown position, then fully down and up taking 2 secs each way"""
+    arms = ArmModel()
+    arms.on_action(State.PICK_UP, 0, SEC, limit_tick=SEC)
+    arms.on_action(State.PUT_DOWN, 2 * SEC, 4 * SEC, limit_tick=4 * SEC)
+    arms.on_action(State.PICK_UP, 5 * SEC, 7 * SEC, limit_tick=7 * SEC)
+    return arms
+
+
+def test_position_is_unknown_until_a_limit_is_reached():
+    arms = ArmModel()
+    assert arms.position is None
+    arms.on_action(State.PICK_UP, 0, SEC)
+    assert arms.position is None
+    arms.on_action(State.PUT_DOWN, SEC, 2 * SEC, limit_tick=2 * SEC)
+    assert arms.position == 0.0
+    # Travel isn't measured from an unknown position
+    assert arms.travel_us(State.PUT_DOWN) is None
+
+
+def test_full_travel_is_measured_between_limits():
+    arms = _calibrated_arms()
+    assert arms.position == 1.0
+    assert arms.travel_us(State.PUT_DOWN) == 2 * SEC
+    assert arms.travel_us(State.PICK_UP) == 2 * SEC
+    arms.on_action(State.PUT_DOWN, 8 * SEC, 11 * SEC, limit_tick=11 * SEC)
+    # Smoothed towards the new measurement
+    assert arms.travel_us(State.PUT_DOWN) == 2.5 * SEC
+
+
+def test_partial_moves_are_integrated_from_their_duration():
+    arms = _calibrated_arms()
+    arms.on_action(State.PUT_DOWN, 8 * SEC, 8 * SEC + SEC // 2)
+    assert arms.position == pytest.approx(0.75)
+    arms.on_action(State.PICK_UP, 9 * SEC, 12 * SEC)
+    assert arms.position == 1.0
+
+
+def test_move_to_times_a_partial_move():
+    arms = _calibrated_arms()
+    assert arms.move_to(0.25) == (State.PUT_DOWN, pytest.approx(1.5))
+    assert arms.move_to(0.99) is None
+    with pytest.raises(ValueError):
+        ArmModel().move_to(0.5)
+    arms = ArmModel()
+    arms.on_action(State.PICK_UP, 0, SEC, limit_tick=SEC)
+    with pytest.raises(ValueError):
+        arms.move_to(0.5)
+
+
+def test_partial_arm_move_in_the_simulator(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        # Calibrate by moving to each limit in turn
+        for state in (State.PICK_UP, State.PUT_DOWN, State.PICK_UP):
+            future = controller.request(state, until_end=True, timeout=60)
+            await run_sim_until(sim, future.done, timeout=10.0)
+        calibrated = controller.arms
+        with pytest.raises(ValueError):
+            controller.move_arms(101)
+        state, secs = controller.move_arms(25)
+        await run_sim_until(sim, lambda: controller.arms["position_percent"] != 100, timeout=10.0)
+        await controller.cleanup()
+        return calibrated, state, secs, controller.arms, sim.arm_position
+    calibrated, state, secs, arms, arm_position = asyncio.run(run())
+    assert calibrated["position_percent"] == 100
+    assert calibrated["travel_secs"]["put_down"] == pytest.approx(ARM_TRAVEL_US / SEC, rel=0.05)
+    assert calibrated["travel_secs"]["pick_up"] == pytest.approx(ARM_TRAVEL_US / SEC, rel=0.05)
+    assert state == State.PUT_DOWN
+    assert secs == pytest.approx(0.75 * ARM_TRAVEL_US / SEC, rel=0.05)
+    assert arms["position_percent"] == pytest.approx(25, abs=1)
+    assert arm_position == pytest.approx(0.25, abs=0.03)
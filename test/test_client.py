@@ -0,0 +1,34 @@
+import asyncio
+import threading
+from verbot.client import _close_loop
+
+
+class OldLoop():
+    """An event loop from before Python 3.9, without shutdown_default_executor()"""
+
+    def __init__(self):
+        self.closed = False
+
+    def run_until_complete(self, future):
+        raise AssertionError("Nothing to run")
+
+    def close(self):
+        self.closed = True
+
+
+def test_close_loop_joins_executor_threads():
+    loop = asyncio.new_event_loop()
+    workers = []
+    def work():
+        workers.append(threading.current_thread())
+        threading.Event().wait(0.05)
+    loop.run_in_executor(None, work)
+    _close_loop(loop)
+    assert loop.is_closed()
+    assert not workers[0].is_alive()
+
+
+def test_close_loop_before_python_3_9():
+    loop = OldLoop()
+    _close_loop(loop)
+    assert loop.closed
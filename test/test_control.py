@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from verbot.control import GPIO_ACTIONS, RequestSuperseded
+from verbot.shared import State
+from verbot.timesync import ActionScheduler, CANCELLED
+
+# Action switch gpios, by state
+ACTION_GPIOS = {state : gpio for gpio, state in GPIO_ACTIONS.items()}
+
+
+def test_emergency_stop_preempts_everything(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        scheduler = ActionScheduler(controller)
+        loop = asyncio.get_running_loop()
+        controller.desired_state = State.FORWARDS
+        await run_sim_until(sim, lambda: controller.current_state == State.FORWARDS)
+        pending = controller.request(State.REVERSE)
+        scheduled = scheduler.schedule(State.TALK, loop.time() + 0.05)
+        controller.desired_state = State.ROTATE_LEFT
+        latency = await controller.emergency_stop()
+        # The drum is settled back to STOP by interrogating, which doesn't move the robot
+        motor_speed = sim.motor_speed
+        action_us = dict(sim.action_us)
+        await run_sim_until(sim, lambda: controller.current_state == State.STOP)
+        await asyncio.sleep(0.1)
+        await sim.run_for(1.0)
+        await controller.cleanup()
+        return controller, motor_speed, latency, pending, scheduled, action_us, sim.action_us
+    controller, motor_speed, latency, pending, scheduled, action_us, action_us_after = asyncio.run(run())
+    assert motor_speed >= 0
+    assert action_us_after == action_us
+    assert latency >= 0
+    assert isinstance(pending.exception(), RequestSuperseded)
+    assert scheduled.status == CANCELLED
+    assert controller.desired_state == State.STOP
+    assert controller.pipeline_stats["depth"] == 0
+
+
+def test_timed_action_completes_in_virtual_time(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        future = controller.request(State.FORWARDS, secs=20.0, until_end=True, timeout=60)
+        await run_sim_until(sim, future.done, timeout=10.0)
+        await controller.cleanup()
+        # The future's latency is wall clock time
+        return controller, future.result(), sim.action_us[ACTION_GPIOS[State.FORWARDS]]
+    controller, wall_secs, action_us = asyncio.run(run())
+    assert controller.current_state == State.STOP
+    assert action_us == pytest.approx(20000000, rel=0.01)
+    # The simulation runs faster than real time, so must drive the action's completion
+    assert wall_secs < 10.0
+
+
+def test_request_is_reached_by_interrogation(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        future = controller.request(State.FORWARDS, timeout=30)
+        await run_sim_until(sim, future.done)
+        # Past the ramp up
+        await sim.run_for(0.1)
+        motor_speed = sim.motor_speed
+        await controller.cleanup()
+        return controller, future.result(), motor_speed
+    controller, latency, motor_speed = asyncio.run(run())
+    assert controller.current_state == State.FORWARDS
+    # Clockwise, performing the action
+    assert motor_speed == -100
+    assert latency > 0
+
+
+def test_superseded_request_fails(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        first = controller.request(State.TALK)
+        await sim.settle()
+        second = controller.request(State.ROTATE_RIGHT)
+        await run_sim_until(sim, second.done)
+        await controller.cleanup()
+        return first, second
+    first, second = asyncio.run(run())
+    assert isinstance(first.exception(), RequestSuperseded)
+    assert second.result() > 0
+
+
+def test_untimed_until_end_is_refused(sim_controller):
+    async def run():
+        sim, controller = await sim_controller()
+        try:
+            with pytest.raises(ValueError):
+                controller.request(State.FORWARDS, until_end=True)
+        finally:
+            await controller.cleanup()
+    asyncio.run(run())
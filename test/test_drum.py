@@ -0,0 +1,70 @@
+from verbot.drum import DrumModel
+
+ORDER = ("stop", "rotate_right", "rotate_left", "forwards", "reverse", "put_down", "pick_up", "talk")
+
+
+def _measured_drum(step_us=100000):
+    """A drum which has passed STOP then ROTATE_RIGHT at full speed, step_us apart"""
+    drum = DrumModel(ORDER)
+    drum.set_speed(100)
+    drum.on_switch("stop", 1000)
+    drum.on_switch("rotate_right", 1000 + step_us)
+    return drum
+
+
+def test_steps_to_unknown_position():
+    drum = DrumModel(ORDER)
+    assert drum.position is None
+    assert drum.steps_to("forwards") is None
+    assert drum.eta_us("forwards") is None
+
+
+def test_steps_to_counts_forwards_round_the_drum():
+    drum = DrumModel(ORDER)
+    drum.park("forwards")
+    assert drum.parked_at == "forwards"
+    assert drum.steps_to("reverse") == 1
+    assert drum.steps_to("talk") == 4
+    assert drum.steps_to("stop") == 5
+    # The switch already activated needs a full revolution
+    assert drum.steps_to("forwards") == len(ORDER)
+    assert drum.steps_to("unknown") is None
+
+
+def test_step_time_is_measured_between_switches():
+    drum = _measured_drum(step_us=100000)
+    assert drum.position == "rotate_right"
+    assert drum.step_us == 100000
+
+
+def test_step_time_is_normalised_to_full_speed_across_skipped_switches():
+    drum = DrumModel(ORDER)
+    drum.set_speed(50)
+    drum.on_switch("stop", 0)
+    # Two steps at half speed
+    drum.on_switch("rotate_left", 400000)
+    assert drum.step_us == 100000
+
+
+def test_eta_scales_with_speed_and_elapsed_time():
+    drum = _measured_drum(step_us=100000)
+    assert drum.eta_us("forwards") == 200000
+    assert drum.eta_us("forwards", speed=50) == 400000
+    assert drum.eta_us("forwards", speed=50, elapsed_us=150000) == 250000
+    assert drum.eta_us("forwards", elapsed_us=10000000) == 0
+    assert drum.eta_us("forwards", speed=0) is None
+
+
+def test_speed_change_between_switches_is_not_measured():
+    drum = _measured_drum(step_us=100000)
+    drum.set_speed(50)
+    drum.set_speed(100)
+    drum.on_switch("rotate_left", 1000 + 100000 + 300000)
+    assert drum.step_us == 100000
+
+
+def test_forget_discards_position():
+    drum = _measured_drum()
+    drum.forget()
+    assert drum.position is None
+    assert drum.steps_to("stop") is None
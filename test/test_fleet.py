@@ -0,0 +1,41 @@
+import asyncio
+from verbot.fleet import FleetServer, HEALTH_ERROR, HEALTH_OK
+from verbot.sim import SimulatedPi
+
+
+class StaticRobot():
+    """A robot which answers every request with the same result"""
+
+    def __init__(self, name, result):
+        self.name = name
+        self.result = result
+
+    async def start(self, session):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def call(self, request):
+        return {"jsonrpc" : "2.0", "result" : self.result, "id" : request["id"]}
+
+
+def test_health_of_robots_not_reporting_everything(tmp_path):
+    async def run():
+        fleet = FleetServer(health_interval=None)
+        fleet.add_local("sim", pi=SimulatedPi(), calibration_path=str(tmp_path / "sim.json"))
+        # e.g. older versions, and a robot answering with nonsense
+        fleet._add(StaticRobot("old", {"state" : "stop", "desired" : "stop"}))
+        fleet._add(StaticRobot("odd", ["stop"]))
+        await fleet.start()
+        try:
+            return await fleet.check_health()
+        finally:
+            await fleet.stop()
+    health = asyncio.run(run())
+    assert health["sim"]["status"] == HEALTH_OK
+    assert health["sim"]["pipeline_depth"] == 0
+    assert health["old"]["status"] == HEALTH_OK
+    assert health["old"]["state"] == "stop"
+    assert health["old"]["pipeline_depth"] is None
+    assert health["odd"]["status"] == HEALTH_ERROR
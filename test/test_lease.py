@@ -0,0 +1,77 @@
+import pytest
+from verbot.lease import LeaseBusy, LeaseManager, MAX_LEASE_TTL, current_client
+
+
+class FakeClock():
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_first_client_is_granted_and_others_refused():
+    clock = FakeClock()
+    leases = LeaseManager(default_ttl=5.0, clock=clock)
+    assert leases.acquire("a") == 5.0
+    assert leases.holder == "a"
+    with pytest.raises(LeaseBusy) as busy:
+        leases.acquire("b")
+    assert busy.value.holder == "a"
+    assert busy.value.expires_in == 5.0
+    assert leases.stats["refused_by_client"] == {"b" : 1}
+
+
+def test_renewal_extends_but_never_shortens():
+    clock = FakeClock()
+    leases = LeaseManager(default_ttl=5.0, clock=clock)
+    leases.acquire("a", ttl=60)
+    clock.now += 10
+    assert leases.acquire("a") == 50.0
+    clock.now += 49
+    assert leases.acquire("a") == 5.0
+    assert leases.stats["renewed"] == 2
+
+
+def test_lease_lapses_after_its_ttl():
+    clock = FakeClock()
+    leases = LeaseManager(default_ttl=5.0, clock=clock)
+    leases.acquire("a")
+    clock.now += 5
+    assert leases.holder is None
+    leases.acquire("b")
+    assert leases.holder == "b"
+    assert leases.stats["expired"] == 1
+
+
+def test_only_the_holder_can_release():
+    leases = LeaseManager(clock=FakeClock())
+    leases.acquire("a")
+    assert not leases.release("b")
+    assert leases.holder == "a"
+    assert leases.release("a")
+    assert leases.holder is None
+
+
+def test_internal_requests_are_never_refused():
+    leases = LeaseManager(clock=FakeClock())
+    leases.acquire("a")
+    assert leases.acquire(None) is None
+    assert leases.holder == "a"
+
+
+def test_current_client_is_the_default():
+    leases = LeaseManager(clock=FakeClock())
+    token = current_client.set("ws:1")
+    try:
+        leases.acquire()
+    finally:
+        current_client.reset(token)
+    assert leases.holder == "ws:1"
+
+
+@pytest.mark.parametrize("ttl", [0, -1, MAX_LEASE_TTL + 1])
+def test_invalid_ttl(ttl):
+    with pytest.raises(ValueError):
+        LeaseManager(clock=FakeClock()).acquire("a", ttl=ttl)
@@ -0,0 +1,60 @@
+import asyncio
+import struct
+import pytest
+from apigpio.apigpio import ApigpioError
+from verbot import drv_8835_driver as drv8835
+
+# PI_BAD_HPWM_FREQ, as pigpiod sends it
+BAD_HPWM_FREQ = (1 << 32) - 96
+
+
+class RawPi():
+    """An apigpio.Pi without the PWM methods missing from stock apigpio, so they are sent as raw commands"""
+
+    def __init__(self, status=0):
+        self.status = status
+        self.commands = []
+
+    async def _pigpio_aio_command(self, cmd, p1, p2):
+        self.commands.append((cmd, p1, p2))
+        return self.status
+
+    async def _pigpio_aio_command_ext(self, cmd, p1, p2, p3, extents, rl=True):
+        self.commands.append((cmd, p1, p2, b"".join(extents)))
+        return self.status
+
+
+class FailingPi():
+    """An apigpio.Pi with hardware_PWM(), which returns an error rather than raising"""
+
+    async def hardware_PWM(self, gpio, PWMfreq, PWMduty):
+        return -96
+
+
+def test_hardware_pwm_duty_is_a_raw_command():
+    pi = RawPi()
+    motor = drv8835.Motor(pi, pwm_mode=drv8835.PWM_MODE_HARDWARE)
+    asyncio.run(motor._writeDuty(500000))
+    assert pi.commands == [(drv8835.PI_CMD_HP, drv8835.MOTOR_PWM_PIN, drv8835.PWM_FREQUENCY, struct.pack("I", 500000))]
+
+
+def test_pwm_info_is_read_by_raw_commands():
+    pi = RawPi(status=drv8835.PWM_FREQUENCY)
+    motor = drv8835.Motor(pi, pwm_mode=drv8835.PWM_MODE_HARDWARE)
+    asyncio.run(motor._read_pwm_info())
+    assert pi.commands == [(drv8835.PI_CMD_PFG, drv8835.MOTOR_PWM_PIN, 0)]
+    assert motor.pwm_frequency == drv8835.PWM_FREQUENCY
+    assert motor.pwm_resolution == drv8835.HW_PWM_CLOCK // drv8835.PWM_FREQUENCY
+
+
+@pytest.mark.parametrize("pi", [RawPi(status=BAD_HPWM_FREQ), FailingPi()])
+def test_failed_hardware_pwm_writes_raise(pi):
+    motor = drv8835.Motor(pi, pwm_mode=drv8835.PWM_MODE_HARDWARE)
+    with pytest.raises(ApigpioError):
+        asyncio.run(motor._writeDuty(500000))
+
+
+def test_failed_pwm_info_reads_raise():
+    motor = drv8835.Motor(RawPi(status=BAD_HPWM_FREQ))
+    with pytest.raises(ApigpioError):
+        asyncio.run(motor._read_pwm_info())
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from verbot.calibration import Calibration
+from verbot.odometry import Odometry
+from verbot.shared import State
+
+# At the default calibration: 60 mm/sec and 45 degrees/sec
+SEC = 1000000
+
+
+def test_forwards_then_turn_then_forwards():
+    odometry = Odometry(Calibration())
+    odometry.on_action(State.FORWARDS, 0, 2 * SEC)
+    odometry.on_action(State.ROTATE_LEFT, 3 * SEC, 5 * SEC)
+    odometry.on_action(State.FORWARDS, 6 * SEC, 7 * SEC)
+    pose = odometry.pose
+    assert pose["x_mm"] == pytest.approx(120)
+    assert pose["y_mm"] == pytest.approx(60)
+    assert pose["heading_deg"] == pytest.approx(90)
+    assert pose["intervals"] == 3
+    assert pose["travel_secs"] == pytest.approx(5)
+
+
+def test_reverse_and_rotate_right():
+    odometry = Odometry(Calibration())
+    odometry.on_action(State.ROTATE_RIGHT, 0, 2 * SEC)
+    odometry.on_action(State.REVERSE, 2 * SEC, 3 * SEC)
+    pose = odometry.pose
+    assert pose["heading_deg"] == pytest.approx(270)
+    assert pose["x_mm"] == pytest.approx(0, abs=1e-9)
+    assert pose["y_mm"] == pytest.approx(60)
+
+
+def test_actions_across_the_tick_wrap():
+    odometry = Odometry(Calibration())
+    odometry.on_action(State.FORWARDS, 0xFFFFFFFF - SEC + 1, SEC)
+    assert odometry.pose["x_mm"] == pytest.approx(120)
+
+
+def test_other_actions_dont_move_the_robot():
+    odometry = Odometry(Calibration())
+    for state in (State.TALK, State.PICK_UP, State.PUT_DOWN):
+        odometry.on_action(state, 0, SEC)
+    assert odometry.pose == {"x_mm" : 0.0, "y_mm" : 0.0, "heading_deg" : 0.0, "intervals" : 0, "travel_secs" : 0.0}
+
+
+def test_reset():
+    odometry = Odometry(Calibration())
+    odometry.on_action(State.FORWARDS, 0, SEC)
+    odometry.reset(10, 20, 450)
+    pose = odometry.pose
+    assert (pose["x_mm"], pose["y_mm"], pose["heading_deg"], pose["intervals"]) == (10, 20, 90, 0)
+
+
+def test_pose_after_timed_actions_in_the_simulator(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        for state, secs in ((State.FORWARDS, 2.0), (State.ROTATE_LEFT, 2.0), (State.FORWARDS, 1.0)):
+            future = controller.request(state, secs=secs, until_end=True, timeout=60)
+            await run_sim_until(sim, future.done, timeout=10.0)
+        await controller.cleanup()
+        return controller.pose
+    pose = asyncio.run(run())
+    assert pose["x_mm"] == pytest.approx(120, abs=3)
+    assert pose["y_mm"] == pytest.approx(60, abs=3)
+    assert pose["heading_deg"] == pytest.approx(90, abs=1)
+    assert pose["intervals"] == 3
@@ -0,0 +1,74 @@
+import asyncio
+from verbot.pipeline import ActionPipeline
+
+
+def test_requests_whilst_busy_are_coalesced_into_the_latest():
+    async def run():
+        executed = []
+        busy = asyncio.Event()
+        release = asyncio.Event()
+        async def execute(request):
+            executed.append(request)
+            busy.set()
+            await release.wait()
+        pipeline = ActionPipeline(execute, lambda request: False)
+        pipeline.start()
+        pipeline.submit(("forwards", None))
+        await busy.wait()
+        for request in (("reverse", None), ("rotate_left", None), ("talk", 1.0)):
+            pipeline.submit(request)
+        release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        pipeline.stop()
+        return executed, pipeline.stats
+    executed, stats = asyncio.run(run())
+    assert executed == [("forwards", None), ("talk", 1.0)]
+    assert stats["coalesced"] == 2
+    assert stats["executed"] == 2
+
+
+def test_noop_requests_are_dropped():
+    async def run():
+        executed = []
+        async def execute(request):
+            executed.append(request)
+        pipeline = ActionPipeline(execute, lambda request: request == ("stop", None))
+        pipeline.start()
+        pipeline.submit(("stop", None))
+        await asyncio.sleep(0)
+        pipeline.submit(("forwards", None))
+        await asyncio.sleep(0)
+        pipeline.stop()
+        return executed, pipeline.stats
+    executed, stats = asyncio.run(run())
+    assert executed == [("forwards", None)]
+    assert stats["dropped"] == 1
+
+
+def test_full_queue_discards_the_oldest_request():
+    async def run():
+        executed = []
+        async def execute(request):
+            executed.append(request)
+        pipeline = ActionPipeline(execute, lambda request: False, maxsize=2)
+        for request in range(5):
+            pipeline.submit(request)
+        depth = pipeline.stats["depth"]
+        pipeline.start()
+        await asyncio.sleep(0)
+        pipeline.stop()
+        return executed, depth, pipeline.stats
+    executed, depth, stats = asyncio.run(run())
+    assert depth == 2
+    assert executed == [4]
+    assert stats["coalesced"] == 4
+
+
+def test_flush_discards_pending_requests():
+    async def run():
+        pipeline = ActionPipeline(None, lambda request: False)
+        pipeline.submit(1)
+        pipeline.submit(2)
+        return pipeline.flush(), pipeline.stats["depth"]
+    assert asyncio.run(run()) == (2, 0)
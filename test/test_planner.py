@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from verbot.calibration import Calibration
+from verbot.control import DRUM_ORDER, GPIO_ACTIONS
+from verbot.planner import DEFAULT_STEP_US, MotionPlanner
+from verbot.shared import State
+
+# Action switch gpios, by state
+ACTION_GPIOS = {state : gpio for gpio, state in GPIO_ACTIONS.items()}
+
+
+def _planner(rates=None):
+    return MotionPlanner(DRUM_ORDER, Calibration(rates))
+
+
+async def _execute(sim, controller, run_sim_until, plan):
+    """Perform each step of a plan in turn, as a client would"""
+    for step in plan.steps:
+        future = controller.request(step.state, secs=step.secs, until_end=True, timeout=60)
+        await run_sim_until(sim, future.done, timeout=10.0)
+        future.result()
+
+
+def test_drum_steps_only_advance_forwards():
+    planner = _planner()
+    assert planner.drum_steps(State.FORWARDS, State.REVERSE) == 1
+    assert planner.drum_steps(State.FORWARDS, State.ROTATE_LEFT) == len(DRUM_ORDER) - 1
+    assert planner.drum_steps(State.FORWARDS, State.FORWARDS) == len(DRUM_ORDER)
+    assert planner.drum_steps(State.FORWARDS, State.FORWARDS, engaged=True) == 0
+    assert planner.drum_steps(None, State.FORWARDS) == len(DRUM_ORDER)
+
+
+def test_interrogation_slows_for_the_last_switch():
+    planner = _planner()
+    assert planner.interrogation_us(0) == 0
+    assert planner.interrogation_us(1) == 2 * DEFAULT_STEP_US
+    assert planner.interrogation_us(3, step_us=100000) == 100000 * (2 + 2)
+
+
+def test_plan_turns_the_short_way_when_it_is_quicker():
+    plan = _planner().plan_heading(0, -90, drum_at=State.ROTATE_RIGHT, engaged=True)
+    assert [(step.state, step.secs, step.drum_steps) for step in plan.steps] == [(State.ROTATE_RIGHT, 2.0, 0)]
+    assert plan.predicted_secs == 2.0
+
+
+def test_plan_turns_the_long_way_when_the_drum_makes_it_quicker():
+    planner = _planner({State.ROTATE_LEFT : {"degrees_per_sec" : 360}, State.ROTATE_RIGHT : {"degrees_per_sec" : 360}})
+    # Rotating right needs almost a full revolution of the drum from ROTATE_LEFT
+    plan = planner.plan_heading(0, -10, drum_at=State.ROTATE_LEFT, engaged=True)
+    assert [step.state for step in plan.steps] == [State.ROTATE_LEFT]
+    assert plan.steps[0].secs == pytest.approx(350 / 360)
+
+
+def test_plan_reverses_rather_than_turning_round():
+    plan = _planner().plan_waypoints((0, 0, 0), [(-120, 0)], drum_at=State.REVERSE, engaged=True)
+    assert [(step.state, step.secs) for step in plan.steps] == [(State.REVERSE, 2.0)]
+    assert plan.drum_steps == 0
+
+
+class Uncalibrated():
+    """A calibration table without any rates"""
+
+    def degrees_per_sec(self, state):
+        return None
+
+    def mm_per_sec(self, state):
+        return None
+
+
+def test_uncalibrated_plans_are_refused():
+    planner = MotionPlanner(DRUM_ORDER, Uncalibrated())
+    with pytest.raises(ValueError):
+        planner.plan_heading(0, 90)
+    with pytest.raises(ValueError):
+        planner.plan_waypoints((0, 0, 0), [(100, 0)])
+
+
+def test_heading_plan_is_executed(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        plan = controller.plan_heading(90)
+        await _execute(sim, controller, run_sim_until, plan)
+        await controller.cleanup()
+        return plan, controller.pose, sim.action_us
+    plan, pose, action_us = asyncio.run(run())
+    assert [step.state for step in plan.steps] == [State.ROTATE_LEFT]
+    assert action_us[ACTION_GPIOS[State.ROTATE_LEFT]] == pytest.approx(plan.steps[0].secs * 1000000, rel=0.02)
+    assert pose["heading_deg"] == pytest.approx(90, abs=2)
+
+
+def test_waypoint_plan_is_executed(sim_controller, run_sim_until):
+    async def run():
+        sim, controller = await sim_controller()
+        plan = controller.plan_waypoints([(0, 120), (-120, 120)])
+        await _execute(sim, controller, run_sim_until, plan)
+        await controller.cleanup()
+        return plan, controller.pose, sim.action_us
+    plan, pose, action_us = asyncio.run(run())
+    for state in set(step.state for step in plan.steps):
+        secs = sum(step.secs for step in plan.steps if step.state == state)
+        assert action_us[ACTION_GPIOS[state]] == pytest.approx(secs * 1000000, rel=0.02)
+    assert pose["x_mm"] == pytest.approx(-120, abs=5)
+    assert pose["y_mm"] == pytest.approx(120, abs=5)
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import json
+import pytest
+from aiohttp import test_utils
+from verbot import server as verbot_server
+from verbot.control import GPIO_ACTIONS
+from verbot.lease import LeaseManager
+from verbot.server import BATCH_STEP_TIMEOUT, ERROR_ABORTED, ERROR_BUSY, Server
+from verbot.shared import CLIENT_HEADER, State
+from verbot.sim import SimulatedPi
+
+# Action switch gpios, by state
+ACTION_GPIOS = {state : gpio for gpio, state in GPIO_ACTIONS.items()}
+
+
+async def _drive(sim):
+    """Keep simulated time passing whilst requests are served"""
+    while True:
+        await sim.run_for(0.01)
+        await asyncio.sleep(0.001)
+
+
+@contextlib.asynccontextmanager
+async def _serve():
+    """Serve a Server for a SimulatedPi over HTTP, yielding (sim, server, client)"""
+    sim = SimulatedPi()
+    server = Server(pi=sim, assistant=False, teleop_port=None, calibration_path=None)
+    await server.start_controller()
+    driver = asyncio.create_task(_drive(sim))
+    client = test_utils.TestClient(test_utils.TestServer(server._app))
+    await client.start_server()
+    try:
+        yield sim, server, client
+    finally:
+        await client.close()
+        driver.cancel()
+        await server.stop_controller()
+
+
+def _request(method, id=1, **params):
+    return {"jsonrpc" : "2.0", "method" : method, "params" : params, "id" : id}
+
+
+async def _post(client, body, batch=None, client_id=None):
+    """Returns (HTTP status, JSON response)"""
+    response = await client.post("/", json=body, params={} if batch is None else {"batch" : batch},
+                                 headers={} if client_id is None else {CLIENT_HEADER : client_id})
+    return response.status, await response.json()
+
+
+def test_sequence_arm_steps_run_to_their_limit():
+    async def run():
+        async with _serve() as (sim, server, client):
+            status, response = await _post(client, [
+                _request("verbot_action", 1, action="pick_up"),
+                _request("verbot_action", 2, action="forwards"),
+            ], batch="sequence")
+            return status, response, sim.arm_position, sim.action_us.get(ACTION_GPIOS[State.PICK_UP])
+    status, response, arm_position, pick_up_us = asyncio.run(run())
+    assert status == 200
+    assert [step["status"] for step in response["steps"]] == ["ok", "ok"]
+    assert arm_position == 1.0
+    assert pick_up_us > 0
+
+
+def test_sequence_steps_are_allowed_their_duration():
+    async def run():
+        async with _serve() as (sim, server, client):
+            return [verbot_server._wait_for_completion(server, _request("verbot_action", **params))["params"] for params in (
+                {"action" : "forwards", "duration" : 45},
+                {"action" : "rotate_left", "degrees" : 90},
+                {"action" : "forwards", "duration" : 45, "timeout" : 5},
+                {"action" : "forwards"},
+            )]
+    timed, rotation, explicit, untimed = asyncio.run(run())
+    assert timed["timeout"] == BATCH_STEP_TIMEOUT + 45
+    assert timed["until_end"]
+    # At the default calibration of 45 degrees/sec
+    assert rotation["timeout"] == BATCH_STEP_TIMEOUT + 2
+    assert explicit["timeout"] == 5
+    assert untimed == {"action" : "forwards", "timeout" : BATCH_STEP_TIMEOUT, "until_end" : False}
+
+
+def test_sequence_holds_control_for_the_whole_batch():
+    async def run():
+        async with _serve() as (sim, server, client):
+            server._leases = LeaseManager(default_ttl=0.2)
+            batch = asyncio.create_task(_post(client, [
+                _request("verbot_action", 1, action="forwards", duration=10),
+                _request("verbot_action", 2, action="talk", duration=1),
+            ], batch="sequence", client_id="first"))
+            while server._verbot.current_state != State.FORWARDS:
+                await asyncio.sleep(0.01)
+            # Longer than a lease, whilst the first step runs
+            await asyncio.sleep(0.3)
+            _, refused = await _post(client, _request("verbot_action", action="reverse"), client_id="second")
+            return await batch, refused
+    (status, response), refused = asyncio.run(run())
+    assert refused["error"]["code"] == ERROR_BUSY
+    assert status == 200
+    assert [step["status"] for step in response["steps"]] == ["ok", "ok"]
+
+
+def test_coalesce_acts_on_the_last_action_only():
+    async def run():
+        async with _serve() as (sim, server, client):
+            status, response = await _post(client, [
+                _request("verbot_action", 1, action="forwards"),
+                _request("verbot_action", 2, action="reverse"),
+                _request("verbot_lease", 3),
+                _request("verbot_action", 4, action="rotate_left"),
+            ], batch="coalesce")
+            return status, response, server._verbot.desired_state
+    status, response, desired_state = asyncio.run(run())
+    assert status == 200
+    assert [step["status"] for step in response["steps"]] == ["coalesced", "coalesced", "ok", "ok"]
+    assert response["responses"][0]["result"] == {"coalesced" : True}
+    assert desired_state == State.ROTATE_LEFT
+
+
+def test_sequence_aborts_at_the_first_error():
+    async def run():
+        async with _serve() as (sim, server, client):
+            status, response = await _post(client, [
+                _request("verbot_action", 1, action="rotate_right", duration=1),
+                _request("verbot_action", 2, action="forwards", duration=-1),
+                _request("verbot_action", 3, action="talk", duration=1),
+            ], batch="sequence")
+            return status, response, sim.action_us
+    status, response, action_us = asyncio.run(run())
+    assert status == 200
+    assert [step["status"] for step in response["steps"]] == ["ok", "error", "aborted"]
+    assert response["responses"][2]["error"]["code"] == ERROR_ABORTED
+    assert ACTION_GPIOS[State.TALK] not in action_us
+
+
+@pytest.mark.parametrize("batch, body", [
+    ("parallel", [_request("verbot_action", action="forwards")]),
+    ("sequence", []),
+    ("sequence", [{"jsonrpc" : "2.0", "id" : 1}]),
+    ("sequence", [_request("verbot_action", action="fly")]),
+    # verbot_action_wait, which runs sequence steps, has no assistant action
+    ("sequence", [_request("verbot_action", 1, action="forwards"), _request("verbot_action", 2, action="assistant")]),
+])
+def test_invalid_batches_are_refused_before_acting(batch, body):
+    async def run():
+        async with _serve() as (sim, server, client):
+            status, response = await _post(client, body, batch=batch)
+            await asyncio.sleep(0.1)
+            return status, response, server._verbot.desired_state
+    status, response, desired_state = asyncio.run(run())
+    assert status == 400
+    assert response["error"]["code"] == -32600
+    assert desired_state == State.STOP
+
+
+@pytest.mark.parametrize("body", [
+    _request("verbot_action", action="forwards"),
+    _request("verbot_action", action="forwards", duration=2),
+    _request("verbot_action", action="forwards", duration=-1),
+    _request("verbot_action", action="forwards", speed=50),
+    _request("verbot_stop_everything"),
+    {"jsonrpc" : "2.0", "method" : "verbot_action", "params" : {"action" : "forwards"}},
+])
+def test_fast_path_responses_match_jsonrpcserver(body):
+    async def run():
+        async with _serve() as (sim, server, client):
+            responses = []
+            for fast_path in (True, False):
+                server.fast_path = fast_path
+                response = await client.post("/", json=body)
+                # Notifications have no response body
+                text = await response.text()
+                responses.append((response.status, json.loads(text) if text else None))
+            return responses
+    fast, full = asyncio.run(run())
+    assert fast == full
+
+
+def test_fast_path_busy_response_matches_jsonrpcserver():
+    async def run():
+        async with _serve() as (sim, server, client):
+            # A lease which never lapses, so both responses give the same time to expiry
+            server._leases = LeaseManager(clock=lambda: 0.0)
+            server._leases.acquire("first")
+            responses = []
+            for fast_path in (True, False):
+                server.fast_path = fast_path
+                responses.append(await _post(client, _request("verbot_action", action="forwards"), client_id="second"))
+            return responses
+    fast, full = asyncio.run(run())
+    assert fast == full
+    assert fast[1]["error"]["code"] == ERROR_BUSY
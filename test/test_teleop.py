@@ -0,0 +1,135 @@
+import asyncio
+from verbot.lease import LeaseManager
+from verbot.shared import State
+from verbot.teleop import COMMAND, HEARTBEAT, REPLY, TeleopProtocol
+
+HEARTBEAT_TIMEOUT = 0.05
+DRIVER = ("10.0.0.1", 5000)
+OTHER = ("10.0.0.2", 5000)
+
+
+class FakeController():
+    """Just enough of verbot.control.Controller for teleop"""
+
+    def __init__(self):
+        self.current_state = State.STOP
+        self.desired_state = State.STOP
+        self.performed = []
+        self.stops = 0
+
+    def perform(self, state, secs=None, degrees=None):
+        self.performed.append((state, secs))
+
+    async def emergency_stop(self):
+        self.stops += 1
+        self.desired_state = State.STOP
+        return 0.0
+
+
+class FakeTransport():
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((REPLY.unpack(data), addr))
+
+
+def _teleop(leases=None):
+    controller = FakeController()
+    protocol = TeleopProtocol(controller, heartbeat_timeout=HEARTBEAT_TIMEOUT, leases=leases)
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    return protocol, controller, transport
+
+
+def _send(protocol, addr, seq, action, duration_ms=0):
+    protocol.datagram_received(COMMAND.pack(seq, action, duration_ms), addr)
+
+
+async def _heartbeats(protocol, addr, first_seq, count):
+    for seq in range(first_seq, first_seq + count):
+        await asyncio.sleep(HEARTBEAT_TIMEOUT / 2)
+        _send(protocol, addr, seq, HEARTBEAT)
+
+
+def test_silence_stops_the_robot():
+    async def run():
+        protocol, controller, _ = _teleop()
+        _send(protocol, DRIVER, 1, State.FORWARDS.value)
+        assert controller.desired_state == State.FORWARDS
+        await _heartbeats(protocol, DRIVER, 2, 4)
+        assert controller.stops == 0
+        await asyncio.sleep(HEARTBEAT_TIMEOUT * 2)
+        return protocol, controller
+    protocol, controller = asyncio.run(run())
+    assert controller.stops == 1
+    assert protocol.stats["failsafe_stops"] == 1
+
+
+def test_other_senders_dont_keep_the_robot_moving():
+    async def run():
+        protocol, controller, _ = _teleop()
+        _send(protocol, DRIVER, 1, State.FORWARDS.value)
+        await _heartbeats(protocol, OTHER, 1, 6)
+        return protocol, controller
+    protocol, controller = asyncio.run(run())
+    assert controller.stops == 1
+
+
+def test_refused_and_invalid_datagrams_dont_keep_the_robot_moving():
+    async def run():
+        leases = LeaseManager()
+        protocol, controller, _ = _teleop(leases)
+        _send(protocol, DRIVER, 1, State.FORWARDS.value)
+        for seq in range(1, 7):
+            await asyncio.sleep(HEARTBEAT_TIMEOUT / 2)
+            # Refused as busy, then invalid actions from the driver
+            _send(protocol, OTHER, seq, State.REVERSE.value)
+            _send(protocol, DRIVER, seq + 1, 200)
+        return protocol, controller
+    protocol, controller = asyncio.run(run())
+    assert protocol.stats["busy"] == 6
+    assert protocol.stats["invalid"] == 6
+    assert controller.stops == 1
+
+
+def test_stop_is_never_refused():
+    async def run():
+        leases = LeaseManager()
+        protocol, controller, transport = _teleop(leases)
+        _send(protocol, DRIVER, 1, State.FORWARDS.value)
+        _send(protocol, OTHER, 1, State.STOP.value)
+        await asyncio.sleep(0)
+        return protocol, controller, transport, leases
+    protocol, controller, transport, leases = asyncio.run(run())
+    assert protocol.stats["busy"] == 0
+    assert controller.stops == 1
+    assert transport.sent[-1][1] == OTHER
+    # The driver still holds control
+    assert leases.holder == "udp:{0}:{1}".format(*DRIVER)
+
+
+def test_timed_actions_need_no_heartbeat():
+    async def run():
+        protocol, controller, _ = _teleop()
+        _send(protocol, DRIVER, 1, State.ROTATE_LEFT.value, 500)
+        await asyncio.sleep(HEARTBEAT_TIMEOUT * 2)
+        return controller
+    controller = asyncio.run(run())
+    assert controller.performed == [(State.ROTATE_LEFT, 0.5)]
+    assert controller.stops == 0
+
+
+def test_stale_datagrams_are_discarded():
+    async def run():
+        protocol, controller, transport = _teleop()
+        _send(protocol, DRIVER, 10, State.FORWARDS.value)
+        _send(protocol, DRIVER, 9, State.REVERSE.value)
+        _send(protocol, DRIVER, 10, State.REVERSE.value)
+        protocol.connection_lost(None)
+        return protocol, controller, transport
+    protocol, controller, transport = asyncio.run(run())
+    assert controller.desired_state == State.FORWARDS
+    assert protocol.stats["out_of_order"] == 2
+    assert [reply for reply, _ in transport.sent] == [(10, State.STOP.value)]
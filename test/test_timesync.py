@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from verbot.shared import State
+from verbot.timesync import ActionScheduler, ClockEstimate, BEGUN, CANCELLED, FAILED
+
+
+def _exchange(clock, local, offset, out_delay, back_delay, drift=0.0, processing=0.001):
+    """Add an exchange at local time with a remote clock offset (+ drift) and the given one way delays"""
+    remote = lambda t: t + offset + drift * t
+    t0 = local
+    t1 = remote(t0 + out_delay)
+    t2 = t1 + processing
+    t3 = t0 + out_delay + processing + back_delay
+    clock.add(t0, t1, t2, t3)
+
+
+def test_offset_and_delay_of_symmetric_exchanges():
+    clock = ClockEstimate()
+    for i in range(4):
+        _exchange(clock, 10.0 + i, offset=5.0, out_delay=0.002, back_delay=0.002)
+    assert clock.samples == 4
+    assert clock.delay == pytest.approx(0.004)
+    assert clock.offset_at(12.0) == pytest.approx(5.0)
+    assert clock.drift == 0.0
+    assert clock.to_local(clock.to_remote(12.0)) == pytest.approx(12.0)
+
+
+def test_quickest_exchanges_are_trusted_over_queued_ones():
+    clock = ClockEstimate()
+    for i in range(8):
+        # Replies delayed in a queue make the remote clock look behind
+        _exchange(clock, 10.0 + i, offset=5.0, out_delay=0.001, back_delay=0.001 if i % 4 == 0 else 0.2)
+    assert clock.delay == pytest.approx(0.002)
+    assert clock.offset_at(15.0) == pytest.approx(5.0)
+
+
+def test_drift_is_fitted_once_measurable():
+    clock = ClockEstimate()
+    for i in range(8):
+        _exchange(clock, 100.0 + i * 10, offset=5.0, out_delay=0.001, back_delay=0.001, drift=100e-6)
+    assert clock.drift == pytest.approx(100e-6, rel=0.01)
+    assert clock.offset_at(200.0) == pytest.approx(5.0 + 100e-6 * 200.0, abs=1e-5)
+
+
+def test_no_drift_from_a_short_span():
+    clock = ClockEstimate()
+    for i in range(8):
+        _exchange(clock, 100.0 + i, offset=5.0, out_delay=0.001, back_delay=0.001, drift=100e-6)
+    assert clock.drift == 0.0
+
+
+def test_tick_drift_unwraps_ticks():
+    clock = ClockEstimate()
+    assert clock.tick_drift is None
+    start_tick = 0xFFFFFFFF - 5000000
+    for i in range(4):
+        at = 100.0 + i * 5
+        tick = (start_tick + int(i * 5 * 1000000 * (1 + 20e-6))) & 0xFFFFFFFF
+        clock.add(at, at, at, at, tick=tick, tick_at=at)
+    assert clock.tick_drift == pytest.approx(20e-6, abs=1e-6)
+
+
+class FakeController():
+    """Just enough of verbot.control.Controller for the scheduler"""
+
+    def __init__(self):
+        self.current_state = State.STOP
+        self.desired_state = State.STOP
+        self.performed = []
+        self.state_listeners = []
+        self.stop_listeners = []
+
+    def add_state_listener(self, listener):
+        self.state_listeners.append(listener)
+
+    def add_stop_listener(self, listener):
+        self.stop_listeners.append(listener)
+
+    def perform(self, state, secs=None, degrees=None):
+        if state == State.STOP:
+            raise ValueError("stop can't be timed")
+        self.performed.append((state, secs, degrees))
+
+    def begin(self, state):
+        self.current_state = state
+        for listener in self.state_listeners:
+            listener(state)
+
+
+def test_scheduled_actions_fire_and_begin():
+    async def run():
+        controller = FakeController()
+        scheduler = ActionScheduler(controller)
+        loop = asyncio.get_running_loop()
+        timed = scheduler.schedule(State.FORWARDS, loop.time() + 0.01, secs=1.0)
+        untimed = scheduler.schedule(State.REVERSE, loop.time() + 0.02)
+        failed = scheduler.schedule(State.STOP, loop.time(), secs=1.0)
+        await asyncio.sleep(0.03)
+        controller.begin(State.FORWARDS)
+        return controller, timed, untimed, failed
+    controller, timed, untimed, failed = asyncio.run(run())
+    assert controller.performed == [(State.FORWARDS, 1.0, None)]
+    assert controller.desired_state == State.REVERSE
+    assert timed.status == BEGUN
+    assert timed.begun_at >= timed.fired_at >= timed.at
+    assert failed.status == FAILED
+
+
+def test_cancel_and_emergency_stop_cancel_pending_actions():
+    async def run():
+        controller = FakeController()
+        scheduler = ActionScheduler(controller)
+        loop = asyncio.get_running_loop()
+        first = scheduler.schedule(State.FORWARDS, loop.time() + 0.01)
+        second = scheduler.schedule(State.REVERSE, loop.time() + 0.01)
+        assert scheduler.cancel(first.id) == 1
+        for listener in controller.stop_listeners:
+            listener()
+        await asyncio.sleep(0.02)
+        return controller, first, second
+    controller, first, second = asyncio.run(run())
+    assert first.status == CANCELLED
+    assert second.status == CANCELLED
+    assert controller.desired_state == State.STOP
+
+
+def test_history_never_forgets_pending_actions():
+    async def run():
+        scheduler = ActionScheduler(FakeController(), history=3)
+        loop = asyncio.get_running_loop()
+        done = scheduler.schedule(State.FORWARDS, loop.time())
+        await asyncio.sleep(0.001)
+        pending = [scheduler.schedule(State.FORWARDS, loop.time() + 60) for _ in range(3)]
+        with pytest.raises(ValueError):
+            scheduler.schedule(State.FORWARDS, loop.time() + 60)
+        ids = [action["id"] for action in scheduler.actions]
+        cancelled = scheduler.cancel()
+        return done, pending, ids, cancelled
+    done, pending, ids, cancelled = asyncio.run(run())
+    assert ids == [action.id for action in pending]
+    assert done.id not in ids
+    assert cancelled == 3
+    assert all(action.status == CANCELLED for action in pending)
+
+
+def test_too_far_ahead_is_refused():
+    async def run():
+        scheduler = ActionScheduler(FakeController())
+        with pytest.raises(ValueError):
+            scheduler.schedule(State.FORWARDS, asyncio.get_running_loop().time() + 7200)
+        return scheduler.actions
+    assert asyncio.run(run()) == []
@@ -0,0 +1,35 @@
+import pytest
+from verbot.shared import State
+from verbot.trace import EdgeTrace, read_binary
+
+
+def _trace(count, capacity=8):
+    """A trace of count events, alternating between gpios 9 & 10, at ticks 0, 100, 200..."""
+    trace = EdgeTrace(capacity)
+    for n in range(count):
+        trace.record(9 + n % 2, n % 2, n * 100, State.INTERROGATE)
+    return trace
+
+
+def test_oldest_events_are_overwritten():
+    trace = _trace(12)
+    assert trace.recorded == 12
+    assert len(trace) == 8
+    assert [tick for _, _, tick, _ in trace.events()] == [n * 100 for n in range(4, 12)]
+
+
+@pytest.mark.parametrize("last, ticks", [(None, [0, 100, 200, 300, 400]), (2, [300, 400]), (10, [0, 100, 200, 300, 400]), (0, [])])
+def test_last_events(last, ticks):
+    assert [tick for _, _, tick, _ in _trace(5).events(last=last)] == ticks
+
+
+def test_last_events_for_one_gpio():
+    events = _trace(12).events(last=2, gpio=10)
+    assert events == [(10, 1, 900, State.INTERROGATE), (10, 1, 1100, State.INTERROGATE)]
+
+
+def test_binary_export_round_trip(tmp_path):
+    trace = _trace(12)
+    path = str(tmp_path / "edges.bin")
+    assert trace.copy().export_binary(path) == 8
+    assert read_binary(path) == trace.events()
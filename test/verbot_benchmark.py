@@ -0,0 +1,358 @@
+"""
+Latency benchmarks for the Verbot control server, run against the simulated gearbox (verbot.sim)
+
+Measures:
+ command_to_motor - JSON-RPC verbot_action request sent until the resulting Motor.setSpeedPercent() call
+ edge_callback    - time spent inside each GPIO edge callback
+ edge_to_motor    - GPIO edge callback delivered until the controller's resulting Motor.setSpeedPercent() call
+ concurrent       - request round trip latency & throughput with many clients sending at once
+ dispatch_cpu     - server CPU time per verbot_action request, dispatched by jsonrpcserver vs the fast path
+ fleet_*          - (with --fleet N) a fleet gateway driving N simulated robots on one loop: request latency & throughput,
+                    broadcast & health check latency, and event loop lag
+ pigpiod_cpu      - (with --pigpiod-cpu, on a Pi) pigpiod CPU load whilst driving the motor with software vs hardware PWM
+
+Results are written as JSON. When a baseline results file is given, the exit status is non-zero if any
+p95 latency has regressed by more than the tolerance, so it can be used to block regressions.
+
+Usage: python test/verbot_benchmark.py [--iterations N] [--clients N] [--output results.json] [--baseline old.json]
+       python test/verbot_benchmark.py --fleet N [--iterations N]
+       python test/verbot_benchmark.py --pigpiod-cpu [--cpu-secs N]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import aiohttp
+from aiohttp import web
+import apigpio
+from verbot import drv_8835_driver as drv8835
+from verbot.fleet import FleetServer
+from verbot.server import Server
+from verbot.shared import State
+from verbot.sim import SimulatedPi
+
+ACTIONS = {
+    "forwards"      : State.FORWARDS,
+    "rotate_left"   : State.ROTATE_LEFT,
+    "reverse"       : State.REVERSE,
+    "rotate_right"  : State.ROTATE_RIGHT,
+    "put_down"      : State.PUT_DOWN,
+    "talk"          : State.TALK,
+    "stop"          : State.STOP,
+}
+
+def percentiles(samples):
+    """Summarize a list of latencies (secs) in ms"""
+    if not samples:
+        return {"count" : 0}
+    ordered = sorted(samples)
+    def pct(p):
+        return 1000 * ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {
+        "count"     : len(ordered),
+        "mean_ms"   : 1000 * sum(ordered) / len(ordered),
+        "p50_ms"    : pct(0.50),
+        "p95_ms"    : pct(0.95),
+        "p99_ms"    : pct(0.99),
+        "max_ms"    : 1000 * ordered[-1],
+    }
+
+
+class Harness():
+    """
+    A Server bound to localhost, driving a simulated Verbot, with timing probes
+    on the motor and on GPIO edge callbacks
+    """
+
+    def __init__(self, seed=0):
+        self.sim = SimulatedPi(seed=seed)
+        self.server = Server(bind_addr="127.0.0.1", listen_port=0, pi=self.sim, assistant=False, teleop_port=0)
+        self.verbot = self.server._verbot
+        self.motor_calls = []           # perf_counter() of each Motor.setSpeedPercent() call
+        self.motor_called = asyncio.Event()
+        self.edge_callback = []
+        self.edge_to_motor = []
+        self._last_edge_at = None
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        motor = self.verbot._motor
+        set_speed_percent = motor.setSpeedPercent
+        async def timed_set_speed_percent(speed):
+            now = time.perf_counter()
+            self.motor_calls.append(now)
+            if self._last_edge_at is not None:
+                self.edge_to_motor.append(now - self._last_edge_at)
+                self._last_edge_at = None
+            self.motor_called.set()
+            await set_speed_percent(speed)
+        motor.setSpeedPercent = timed_set_speed_percent
+
+        await self.verbot.init_io()
+        for cb in self.sim._callbacks:
+            cb.func = self._timed_callback(cb.func)
+
+        self._runner = web.AppRunner(self.server._app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = "http://127.0.0.1:{0}/".format(port)
+
+    async def stop(self):
+        await self.verbot.cleanup()
+        await self._runner.cleanup()
+
+    def _timed_callback(self, func):
+        def timed(gpio, level, tick):
+            started_at = time.perf_counter()
+            func(gpio, level, tick)
+            self.edge_callback.append(time.perf_counter() - started_at)
+            self._last_edge_at = started_at
+        return timed
+
+    async def action(self, session, action):
+        request = {"jsonrpc" : "2.0", "method" : "verbot_action", "params" : {"action" : action}, "id" : 1}
+        async with session.post(self.url, json=request) as response:
+            await response.read()
+
+    async def settle(self, state):
+        await self.sim.run_until(lambda: self.verbot.current_state == state, timeout=10.0)
+        self._last_edge_at = None
+
+
+async def bench_sequential(harness, iterations):
+    """command_to_motor: one client, each command waits for the drum to reach its action"""
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        for action in itertools.islice(itertools.cycle(ACTIONS), iterations):
+            harness.motor_called.clear()
+            started_at = time.perf_counter()
+            await harness.action(session, action)
+            await asyncio.wait_for(harness.motor_called.wait(), 5.0)
+            latencies.append(harness.motor_calls[-1] - started_at)
+            await harness.settle(ACTIONS[action])
+    return {
+        "command_to_motor"  : percentiles(latencies),
+        "edge_callback"     : percentiles(harness.edge_callback),
+        "edge_to_motor"     : percentiles(harness.edge_to_motor),
+    }
+
+async def bench_concurrent(harness, clients, iterations):
+    """concurrent: many clients sending commands as fast as they can"""
+    latencies = []
+    motor_calls_before = len(harness.motor_calls)
+    async def client(index):
+        async with aiohttp.ClientSession() as session:
+            actions = itertools.cycle(list(ACTIONS)[index % len(ACTIONS):] + list(ACTIONS)[:index % len(ACTIONS)])
+            for action in itertools.islice(actions, iterations):
+                started_at = time.perf_counter()
+                await harness.action(session, action)
+                latencies.append(time.perf_counter() - started_at)
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - started_at
+    await harness.sim.settle()
+    result = percentiles(latencies)
+    result["clients"] = clients
+    result["throughput_rps"] = len(latencies) / elapsed
+    result["motor_calls"] = len(harness.motor_calls) - motor_calls_before
+    return {"concurrent" : result}
+
+async def bench_dispatch_cpu(harness, requests):
+    """dispatch_cpu: CPU time (process time) for the server to dispatch each request, with and without the fast path"""
+    bodies = [
+        json.dumps({"jsonrpc" : "2.0", "method" : "verbot_action", "params" : {"action" : "stop"}, "id" : i}).encode()
+        for i in range(requests)
+    ]
+    results = {}
+    for name, fast_path in (("generic", False), ("fast_path", True)):
+        harness.server.fast_path = fast_path
+        cpu_before = time.process_time()
+        started_at = time.perf_counter()
+        for body in bodies:
+            await harness.server._dispatch(body)
+        results[name] = {
+            "cpu_us_per_request"    : 1000000 * (time.process_time() - cpu_before) / requests,
+            "us_per_request"        : 1000000 * (time.perf_counter() - started_at) / requests,
+        }
+        await harness.sim.settle()
+    harness.server.fast_path = True
+    results["speedup"] = results["generic"]["cpu_us_per_request"] / results["fast_path"]["cpu_us_per_request"]
+    return {"dispatch_cpu" : results}
+
+async def bench_fleet(robots, iterations, seed):
+    """fleet_*: a gateway driving many simulated robots, all on one loop"""
+    sims = [SimulatedPi(seed=seed + i) for i in range(robots)]
+    fleet = FleetServer(health_interval=None)
+    for index, sim in enumerate(sims):
+        fleet.add_local("robot{0}".format(index), pi=sim)
+    runner = web.AppRunner(fleet._app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = "http://127.0.0.1:{0}/".format(site._server.sockets[0].getsockname()[1])
+    running = True
+    loop_lag = []
+    async def pump():
+        # Virtual time only passes when the simulations are run
+        while running:
+            await asyncio.sleep(0.001)
+            await asyncio.gather(*(sim.run_for(0.005) for sim in sims))
+    async def sample_loop_lag():
+        while running:
+            started_at = time.perf_counter()
+            await asyncio.sleep(0.01)
+            loop_lag.append(time.perf_counter() - started_at - 0.01)
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(sample_loop_lag())]
+    latencies = []
+    broadcasts = []
+    health_checks = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def rpc(path, method, params):
+                request = {"jsonrpc" : "2.0", "method" : method, "params" : params, "id" : 1}
+                async with session.post(url + path, json=request) as response:
+                    return (await response.json())["result"]
+            async def client(name, index):
+                actions = itertools.cycle(list(ACTIONS)[index % len(ACTIONS):] + list(ACTIONS)[:index % len(ACTIONS)])
+                for action in itertools.islice(actions, iterations):
+                    started_at = time.perf_counter()
+                    await rpc("robots/" + name, "verbot_action", {"action" : action})
+                    latencies.append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            await asyncio.gather(*(client(name, index) for index, name in enumerate(fleet.robots)))
+            elapsed = time.perf_counter() - started_at
+            for _ in range(max(1, iterations // 5)):
+                started_at = time.perf_counter()
+                await rpc("", "fleet_broadcast", {"robot_method" : "verbot_action_wait", "params" : {"action" : "forwards", "timeout" : 30}})
+                broadcasts.append(time.perf_counter() - started_at)
+                started_at = time.perf_counter()
+                health = await rpc("", "fleet_health", {"refresh" : True})
+                health_checks.append(time.perf_counter() - started_at)
+                await rpc("", "fleet_stop", {})
+    finally:
+        running = False
+        await asyncio.gather(*tasks)
+        await runner.cleanup()
+    return {
+        "fleet" : {
+            "robots"            : robots,
+            "throughput_rps"    : len(latencies) / elapsed,
+            "healthy"           : sum(robot["status"] == "ok" for robot in health.values()),
+        },
+        "fleet_request"     : percentiles(latencies),
+        "fleet_broadcast"   : percentiles(broadcasts),
+        "fleet_health"      : percentiles(health_checks),
+        "fleet_loop_lag"    : percentiles(loop_lag),
+    }
+
+async def run(args):
+    harness = Harness(seed=args.seed)
+    await harness.start()
+    try:
+        results = {}
+        results.update(await bench_sequential(harness, args.iterations))
+        results.update(await bench_concurrent(harness, args.clients, args.iterations))
+        results.update(await bench_dispatch_cpu(harness, args.dispatch_requests))
+        results["pipeline"] = harness.verbot.pipeline_stats
+    finally:
+        await harness.stop()
+    return results
+
+def pigpiod_pid():
+    """Returns the pid of the local pigpiod process"""
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open("/proc/{0}/comm".format(pid)) as f:
+                if f.read().strip() == "pigpiod":
+                    return int(pid)
+        except OSError:
+            pass
+    raise RuntimeError("pigpiod is not running")
+
+def process_cpu_secs(pid):
+    """Returns the user + system CPU time (secs) used by a process so far"""
+    with open("/proc/{0}/stat".format(pid)) as f:
+        # Skip past the command name, which may contain spaces
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+async def bench_pigpiod_cpu(secs, speed=50):
+    """pigpiod_cpu: CPU load of the local pigpiod whilst the motor runs, idle and in each PWM mode"""
+    pid = pigpiod_pid()
+    results = {}
+    for mode in (None, drv8835.PWM_MODE_SOFTWARE, drv8835.PWM_MODE_HARDWARE):
+        pi = apigpio.Pi()
+        await pi.connect(("127.0.0.1", 8888))
+        try:
+            motor = None
+            if mode is not None:
+                motor = drv8835.Motor(pi, pwm_mode=mode)
+                await motor.init_io()
+                await motor.setSpeedPercent(speed)
+            cpu_before = process_cpu_secs(pid)
+            started_at = time.perf_counter()
+            await asyncio.sleep(secs)
+            load = (process_cpu_secs(pid) - cpu_before) / (time.perf_counter() - started_at)
+            result = {"cpu_percent" : 100 * load}
+            if motor is not None:
+                await motor.stop()
+                result.update(motor.pwm_info)
+            results[mode or "idle"] = result
+        finally:
+            await pi.stop()
+    return {"pigpiod_cpu" : results}
+
+def regressions(results, baseline, tolerance):
+    """Returns a list of descriptions of p95 latencies worse than baseline by more than tolerance"""
+    failures = []
+    for name, metrics in baseline.items():
+        old = metrics.get("p95_ms") if isinstance(metrics, dict) else None
+        new = results.get(name, {}).get("p95_ms")
+        if old and new and new > old * (1 + tolerance):
+            failures.append("{0}: p95 {1:.3f} ms > baseline {2:.3f} ms".format(name, new, old))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50, help="commands per client")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--dispatch-requests", type=int, default=2000, help="requests for the dispatch CPU benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="simulation random seed")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="fail if p95 latencies regress against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional regression")
+    parser.add_argument("--pigpiod-cpu", action="store_true",
+        help="on a Pi, measure pigpiod CPU load with each motor PWM mode instead (the motor will run!)")
+    parser.add_argument("--fleet", type=int, metavar="N", help="load test a fleet gateway with N simulated robots instead")
+    parser.add_argument("--cpu-secs", type=float, default=10.0, help="measurement period for each PWM mode")
+    args = parser.parse_args()
+
+    if args.pigpiod_cpu:
+        results = asyncio.run(bench_pigpiod_cpu(args.cpu_secs))
+    elif args.fleet:
+        results = asyncio.run(bench_fleet(args.fleet, args.iterations, args.seed))
+    else:
+        results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print("REGRESSION: {0}".format(failure))
+        if failures:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
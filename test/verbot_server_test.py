@@ -1,6 +1,14 @@
-from jsonrpcclient import request
+"""
+Interactive control of a Verbot. The robot is found by zeroconf discovery unless its URL is given
 
-HOST="127.0.0.1:8080"
+Usage: python test/verbot_server_test.py [http://host:8080/]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from verbot.client import SyncVerbotClient
 
 VALID_ACTIONS={
     "a" : "assistant",
@@ -32,7 +40,11 @@ VALID_ACTIONS={
     "talk" : "talk"
 }
 
-print("CTRL+C to exit")
+if len(sys.argv) > 1:
+    client = SyncVerbotClient(sys.argv[1])
+else:
+    client = SyncVerbotClient.discover()
+print("Connected to {0}. CTRL+C to exit".format(client.url))
 while True:
     try:
         cmd = input('Command: ')
@@ -40,9 +52,10 @@ while True:
         if not action:
             print("{0} is not a valid command. Valid commands are {1}".format(cmd, VALID_ACTIONS.keys()))
             continue
-        response = request("http://{0}".format(HOST), "verbot_action", action=action)
+        client.action(action)
     except KeyboardInterrupt:
         print("\nGoodbye!\n")
         break
     except Exception as e:
         print("ERROR: {0}".format(e))
+client.close()